@@ -1,25 +1,39 @@
 # ==================================================================
 # 1. IMPORTAÇÕES
 # ==================================================================
-from flask import Flask, jsonify, render_template, abort, request, Response, url_for, flash
-import cloudinary, cloudinary.uploader, cloudinary.api
+from flask import Flask, jsonify, render_template, abort, request, Response, url_for, flash, send_from_directory, stream_with_context
 import psycopg2, psycopg2.extras
-import json, os, re, io, fitz, shutil, requests
+import json, os, re, io
 from werkzeug.utils import secure_filename
 from collections import defaultdict
 from datetime import datetime
-from zipfile import ZipFile
+from zipfile import ZipFile, BadZipFile
 from flask import render_template, redirect
 import io
-import pandas as pd
-import fitz
 import re
 import sys
 import logging
+import itertools
+import time
+import pool_conexoes
 try:
-    from conferencia_app.parser_mapa import parse_mapa, debug_extrator
+    from conferencia_app.armazenamento import (
+        enfileirar_upload, iniciar_uploader, obter_armazenamento,
+        resumo_fila, ArmazenamentoLocal
+    )
+    from conferencia_app.cache_parse import (
+        criar_cache, extrair_pedidos_com_cache, iterar_mapa_com_cache
+    )
+    from conferencia_app import itens_pedido, indice_barcode, relatorio_cortes, registro_cargas, eventos, mapa_carga
 except ImportError:
-    from .parser_mapa import parse_mapa, debug_extrator
+    from .armazenamento import (
+        enfileirar_upload, iniciar_uploader, obter_armazenamento,
+        resumo_fila, ArmazenamentoLocal
+    )
+    from .cache_parse import (
+        criar_cache, extrair_pedidos_com_cache, iterar_mapa_com_cache
+    )
+    from . import itens_pedido, indice_barcode, relatorio_cortes, registro_cargas, eventos, mapa_carga
 
 
 
@@ -33,249 +47,46 @@ print("RODANDO ESTE APP:", __file__)
 # 3. FUNÇÕES AUXILIARES E DE BANCO DE DADOS
 # =================================================================
 
-def get_db_connection():
-    conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
-    return conn
-
-# Em app.py, substitua a função init_db inteira
-
-def init_db():
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    # Tabela de pedidos
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS pedidos (
-            id SERIAL PRIMARY KEY, numero_pedido TEXT UNIQUE NOT NULL, nome_cliente TEXT,
-            vendedor TEXT, nome_da_carga TEXT, nome_arquivo TEXT, status_conferencia TEXT,
-            produtos JSONB, url_pdf TEXT, conferente TEXT
-        );
-    ''')
-
-    # Tabelas do Mapa de Separação
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS cargas (
-          id SERIAL PRIMARY KEY, numero_carga TEXT UNIQUE NOT NULL, motorista TEXT,
-          descricao_romaneio TEXT, peso_total NUMERIC, entregas INTEGER,
-          data_emissao TEXT, criado_em TIMESTAMP DEFAULT NOW()
-        );
-    ''')
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS carga_grupos (
-          id SERIAL PRIMARY KEY, numero_carga TEXT REFERENCES cargas(numero_carga) ON DELETE CASCADE,
-          grupo_codigo TEXT, grupo_titulo TEXT
-        );
-    ''')
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS carga_itens (
-          id SERIAL PRIMARY KEY, numero_carga TEXT REFERENCES cargas(numero_carga) ON DELETE CASCADE,
-          grupo_codigo TEXT, fabricante TEXT, codigo TEXT, cod_barras TEXT, descricao TEXT,
-          qtd_unidades INTEGER, unidade TEXT, pack_qtd INTEGER, pack_unid TEXT,
-          observacao TEXT DEFAULT '', separado BOOLEAN DEFAULT FALSE, forcar_conferido BOOLEAN DEFAULT FALSE,
-          faltou BOOLEAN DEFAULT FALSE, sobrando INTEGER DEFAULT 0
-        );
-    ''')
-    
-    # ===== ADIÇÃO CRÍTICA AQUI =====
-    # Garante que as novas colunas existem no banco de dados
-    cur.execute("ALTER TABLE IF EXISTS carga_grupos ADD COLUMN IF NOT EXISTS separador_nome TEXT;")
-    cur.execute("ALTER TABLE IF EXISTS carga_itens ADD COLUMN IF NOT EXISTS qtd_separada INTEGER;")
-    # ===============================
-
-    conn.commit()
-    cur.close()
-    conn.close()
-
-def extrair_dados_do_pdf(stream, nome_da_carga, nome_arquivo):
+def _extracao():
+    """
+    Parsers de PDF e o pool de extração: (parser_mapa, extrator_pedido,
+    pool_extracao). Trazem PyMuPDF e NumPy, então só são importados no
+    primeiro upload (ou no extrator de debug), não no boot do app.
+    """
     try:
-        import fitz
-        import re
-        documento = fitz.open(stream=stream, filetype="pdf")
-        produtos_finais = []
-        dados_cabecalho = {}
-        
-        inicio_extracao = False
-
-        for i, pagina in enumerate(documento):
-            if i == 0:
-                def extrair_campo_regex(pattern, text):
-                    match = re.search(pattern, text, re.DOTALL)
-                    return match.group(1).replace('\n', ' ').strip() if match else "N/E"
-
-                texto_completo_pagina = pagina.get_text("text")
-                numero_pedido = extrair_campo_regex(r"Pedido:\s*(\d+)", texto_completo_pagina)
-                if numero_pedido == "N/E":
-                    numero_pedido = extrair_campo_regex(r"Pedido\s+(\d+)", texto_completo_pagina)
-
-                nome_cliente = extrair_campo_regex(r"Cliente:\s*(.*?)(?:\s*Cond\. Pgto:|\n)", texto_completo_pagina)
-
-                vendedor = "N/E"
-                try:
-                    vendedor_rect_list = pagina.search_for("Vendedor")
-                    if vendedor_rect_list:
-                        vendedor_rect = vendedor_rect_list[0]
-                        search_area = fitz.Rect(
-                            vendedor_rect.x0 - 15,
-                            vendedor_rect.y1,
-                            vendedor_rect.x1 + 15,
-                            vendedor_rect.y1 + 20
-                        )
-                        vendedor_words = pagina.get_text("words", clip=search_area)
-                        if vendedor_words:
-                            vendedor = vendedor_words[0][4]
-                except Exception:
-                    vendedor = extrair_campo_regex(r"Vendedor\s*([A-ZÀ-Ú]+)", texto_completo_pagina)
-
-                dados_cabecalho = {
-                    "numero_pedido": numero_pedido,
-                    "nome_cliente": nome_cliente,
-                    "vendedor": vendedor
-                }
-
-            palavras_na_tabela = pagina.get_text("words")
-            if not palavras_na_tabela:
-                continue
-
-            palavras_na_tabela.sort(key=lambda p: (p[1], p[0]))
-
-            linhas_agrupadas = []
-            linha_atual = [palavras_na_tabela[0]]
-            y_referencia = palavras_na_tabela[0][1]
-            for j in range(1, len(palavras_na_tabela)):
-                palavra = palavras_na_tabela[j]
-                if abs(palavra[1] - y_referencia) < 5:
-                    linha_atual.append(palavra)
-                else:
-                    linhas_agrupadas.append(sorted(linha_atual, key=lambda p: p[0]))
-                    linha_atual = [palavra]
-                    y_referencia = palavra[1]
-            linhas_agrupadas.append(sorted(linha_atual, key=lambda p: p[0]))
-
-            for palavras_linha in linhas_agrupadas:
-                texto_linha = " ".join([p[4] for p in palavras_linha])
-                if "ITEM CÓD. BARRAS" in texto_linha:
-                    inicio_extracao = True
-                    continue
-                elif "**POR GENTILEZA" in texto_linha:
-                    inicio_extracao = False
-                    continue
-                if not inicio_extracao:
-                    continue
-
-                product_chunks = []
-                current_chunk = []
-                if len(palavras_linha) > 1 and palavras_linha[0][4].isdigit() and len(palavras_linha[0][4]) <= 2:
-                    current_chunk.append(palavras_linha[0])
-                    for k in range(1, len(palavras_linha)):
-                        word_info = palavras_linha[k]
-                        word_text = word_info[4]
-                        is_start_of_new_product = False
-                        if (
-                            word_text.isdigit()
-                            and len(word_text) <= 2
-                            and k + 1 < len(palavras_linha)
-                            and palavras_linha[k + 1][4].isdigit()
-                            and len(palavras_linha[k + 1][4]) > 5
-                        ):
-                            is_start_of_new_product = True
-                        if is_start_of_new_product:
-                            product_chunks.append(current_chunk)
-                            current_chunk = []
-                        current_chunk.append(word_info)
-                    product_chunks.append(current_chunk)
-                else:
-                    product_chunks.append(palavras_linha)
-
-                for chunk in product_chunks:
-                    barcode_parts = []
-                    nome_produto_parts = []
-                    quantidade_parts = []
-                    valores_parts = []
-
-                    for x0, y0, x1, y1, palavra, *_ in chunk:
-                        if 40 < x0 < 100:
-                             barcode_parts.append(palavra)
-                        elif x0 < 340:
-                            nome_produto_parts.append(palavra)
-                        elif x0 < 450:
-                            quantidade_parts.append(palavra)
-                        else:
-                            valores_parts.append(palavra)
-
-                    if not nome_produto_parts:
-                        continue
-                    
-                    # ===== CORREÇÃO CIRÚRGICA =====
-                    # Move palavras não-numéricas do início da lista de quantidade de volta para o nome do produto.
-                    # Isso corrige o problema de "PI" ou "ACI" entrarem na quantidade.
-                    while quantidade_parts and not quantidade_parts[0].replace(',', '').replace('.', '').isdigit():
-                        palavra_movida = quantidade_parts.pop(0)
-                        nome_produto_parts.append(palavra_movida)
-                    # ==============================
-
-                    codigo_barras_final = "".join(barcode_parts)
-
-                    if (
-                        len(nome_produto_parts) > 2
-                        and nome_produto_parts[0].isdigit()
-                        and len(nome_produto_parts[0]) <= 2
-                    ):
-                        nome_produto_final = " ".join(nome_produto_parts[1:])
-                    else:
-                        nome_produto_final = " ".join(nome_produto_parts)
-
-                    quantidade_completa_str = " ".join(quantidade_parts)
-
-                    valor_total_item = "0.00"
-                    if valores_parts:
-                        match_valor = re.search(r'[\d,.]+', valores_parts[-1])
-                        if match_valor:
-                            valor_total_item = match_valor.group(0)
-
-                    unidades_pacote = 1
-                    match_unidades = re.search(r'C/\s*(\d+)', quantidade_completa_str, re.IGNORECASE)
-                    if match_unidades:
-                        unidades_pacote = int(match_unidades.group(1))
-
-                    if nome_produto_final and quantidade_completa_str:
-                        produtos_finais.append({
-                            "produto_nome": nome_produto_final,
-                            "codigo_barras": codigo_barras_final,
-                            "quantidade_pedida": quantidade_completa_str,
-                            "quantidade_entregue": None,
-                            "status": "Pendente",
-                            "valor_total_item": valor_total_item.replace(',', '.'),
-                            "unidades_pacote": unidades_pacote,
-                            "forced_confirmed": False
-                        })
-
-        documento.close()
-
-        if not produtos_finais:
-            return {"erro": "Nenhum produto pôde ser extraído do PDF."}
-
-        return {
-            **dados_cabecalho,
-            "produtos": produtos_finais,
-            "status_conferencia": "Pendente",
-            "nome_da_carga": nome_da_carga,
-            "nome_arquivo": nome_arquivo
-        }
+        from conferencia_app import parser_mapa, extrator_pedido, pool_extracao
+    except ImportError:
+        from . import parser_mapa, extrator_pedido, pool_extracao
+    return parser_mapa, extrator_pedido, pool_extracao
 
-    except Exception as e:
-        import traceback
-        return {"erro": f"Erro na extração do PDF: {str(e)}\n{traceback.format_exc()}"}
+def get_db_connection():
+    # Conexão do pool compartilhado; o close() devolve ao pool (ver pool_conexoes.py)
+    return pool_conexoes.conectar()
 
+# O esquema do banco (tabelas, colunas e índices) não é mais criado aqui:
+# é versionado em migracoes.py, aplicado uma vez por deploy com
+# `python -m migracoes` a partir da raiz do repositório.
 
-def salvar_no_banco_de_dados(dados_do_pedido):
-    """Salva um novo pedido no banco de dados PostgreSQL."""
+def salvar_no_banco_de_dados(dados_do_pedido, pdf_bytes=None):
+    """
+    Salva um novo pedido no banco de dados PostgreSQL.
+    Se `pdf_bytes` vier, o PDF entra na fila de upload na mesma transação e a
+    url_pdf é preenchida depois pelo uploader em segundo plano.
+    Retorna True se o pedido foi inserido (False se já existia).
+    """
     conn = get_db_connection()
     cur = conn.cursor()
-    sql = "INSERT INTO pedidos (numero_pedido, nome_cliente, vendedor, nome_da_carga, nome_arquivo, status_conferencia, produtos, url_pdf) VALUES (%s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT (numero_pedido) DO NOTHING;"
-    cur.execute(sql, (dados_do_pedido.get('numero_pedido'), dados_do_pedido.get('nome_cliente'), dados_do_pedido.get('vendedor'), dados_do_pedido.get('nome_da_carga'), dados_do_pedido.get('nome_arquivo'), dados_do_pedido.get('status_conferencia', 'Pendente'), json.dumps(dados_do_pedido.get('produtos', [])), dados_do_pedido.get('url_pdf')))
+    sql = "INSERT INTO pedidos (numero_pedido, nome_cliente, vendedor, nome_da_carga, nome_arquivo, status_conferencia, url_pdf) VALUES (%s, %s, %s, %s, %s, %s, %s) ON CONFLICT (numero_pedido) DO NOTHING RETURNING id;"
+    cur.execute(sql, (dados_do_pedido.get('numero_pedido'), dados_do_pedido.get('nome_cliente'), dados_do_pedido.get('vendedor'), dados_do_pedido.get('nome_da_carga'), dados_do_pedido.get('nome_arquivo'), dados_do_pedido.get('status_conferencia', 'Pendente'), dados_do_pedido.get('url_pdf')))
+    inserido = cur.fetchone() is not None
+    if inserido:
+        itens_pedido.inserir_itens(cur, dados_do_pedido.get('numero_pedido'), dados_do_pedido.get('produtos', []))
+    if inserido and pdf_bytes:
+        enfileirar_upload(cur, dados_do_pedido.get('numero_pedido'), f"pedidos/{dados_do_pedido.get('nome_arquivo')}", pdf_bytes)
     conn.commit()
     cur.close()
     conn.close()
+    return inserido
 
 def salvar_nome_carga(numero_carga: str, nome_exibicao: str):
     conn = get_db_connection()
@@ -294,7 +105,18 @@ def salvar_nome_carga(numero_carga: str, nome_exibicao: str):
 # =================================================================
 # 4. ROTAS DO SITE (ENDEREÇOS)
 # =================================================================
-init_db()
+# O uploader de PDFs sobe na primeira requisição que enfileira um envio
+# (iniciar_uploader nas rotas de upload) e o cache de extração no primeiro
+# uso, não na importação: carregar o app não abre thread nem conexão.
+_cache_parse = None
+
+
+def obter_cache_parse():
+    global _cache_parse
+    if _cache_parse is None:
+        _cache_parse = criar_cache(get_db_connection)
+    return _cache_parse
+
 
 @app.before_request
 def _force_root_home():
@@ -335,6 +157,8 @@ def detalhe_pedido(pedido_id):
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     cur.execute("SELECT * FROM pedidos WHERE numero_pedido = %s;", (pedido_id,))
     pedido_encontrado = cur.fetchone()
+    if pedido_encontrado:
+        pedido_encontrado['produtos'] = itens_pedido.carregar_produtos(cur, pedido_id)
     cur.close()
     conn.close()
     if pedido_encontrado:
@@ -343,127 +167,282 @@ def detalhe_pedido(pedido_id):
 
 # --- ROTAS DE API ---
 
+def _salvar_pedido_extraido(filename, pdf_bytes, dados_extraidos):
+    """Grava um pedido já extraído. Retorna None em caso de sucesso ou a mensagem de erro."""
+    try:
+        if "erro" in dados_extraidos:
+            return f"Arquivo '{filename}': {dados_extraidos['erro']}"
+        # O PDF vai para a fila; a url_pdf fica pendente até o uploader enviar
+        salvar_no_banco_de_dados(dados_extraidos, pdf_bytes=pdf_bytes)
+        return None
+    except Exception as e:
+        import traceback
+        return f"Arquivo '{filename}': Falha inesperada no processamento. {traceback.format_exc()}"
+
 @app.route('/api/upload/<nome_da_carga>', methods=['POST'])
 def upload_files(nome_da_carga):
     if 'files[]' not in request.files: 
         return jsonify({"sucesso": False, "erro": "Nenhum arquivo enviado."}), 400
-    files = request.files.getlist('files[]')
+    files = [f for f in request.files.getlist('files[]') if f.filename != '']
+
+    # Um único .zip com os PDFs da carga: processado membro a membro, com progresso
+    if len(files) == 1 and files[0].filename.lower().endswith('.zip'):
+        return upload_zip(nome_da_carga, files[0])
+
     erros, sucessos = [], 0
+
+    arquivos = []
     for file in files:
-        if file.filename == '': 
-            continue
-        filename = secure_filename(file.filename)
-        try:
-            pdf_bytes = file.read()
-            dados_extraidos = extrair_dados_do_pdf(nome_da_carga=nome_da_carga, nome_arquivo=filename, stream=pdf_bytes)
-            if "erro" in dados_extraidos:
-                erros.append(f"Arquivo '{filename}': {dados_extraidos['erro']}")
-                continue
-            upload_result = cloudinary.uploader.upload(pdf_bytes, resource_type="raw", public_id=f"pedidos/{filename}")
-            dados_extraidos['url_pdf'] = upload_result['secure_url']
-            salvar_no_banco_de_dados(dados_extraidos)
+        arquivos.append((secure_filename(file.filename), file.read()))
+
+    # PDFs já vistos saem do cache; o resto é extraído em paralelo no pool de
+    # processos. Os resultados voltam na ordem do envio.
+    _, extrator_pedido, pool_extracao = _extracao()
+    resultados = extrair_pedidos_com_cache(obter_cache_parse(), arquivos, nome_da_carga, pool_extracao.extrair_em_paralelo,
+                                           extrator_pedido.VERSAO_EXTRATOR)
+
+    for (filename, pdf_bytes), dados_extraidos in zip(arquivos, resultados):
+        erro = _salvar_pedido_extraido(filename, pdf_bytes, dados_extraidos)
+        if erro:
+            erros.append(erro)
+        else:
             sucessos += 1
-        except Exception as e:
-            import traceback
-            erros.append(f"Arquivo '{filename}': Falha inesperada no processamento. {traceback.format_exc()}")
+    if sucessos:
+        iniciar_uploader(get_db_connection)
     if erros: 
         return jsonify({"sucesso": False, "erro": f"{sucessos} arquivo(s) processado(s). ERROS: {'; '.join(erros)}"})
     return jsonify({"sucesso": True, "mensagem": f"Todos os {sucessos} arquivo(s) da carga '{nome_da_carga}' foram processados."})
 
+# Limite por membro do ZIP (descompactado), para não estourar a memória com um arquivo malformado
+MAX_PDF_NO_ZIP = 50 * 1024 * 1024
+
+def _membros_pdf(zf):
+    membros = []
+    for info in zf.infolist():
+        if info.is_dir() or info.filename.startswith('__MACOSX/'):
+            continue
+        if info.filename.lower().endswith('.pdf'):
+            membros.append(info)
+    return membros
+
+def upload_zip(nome_da_carga, arquivo_zip):
+    """
+    Recebe um ZIP com os PDFs de pedido. Os membros são lidos um de cada vez
+    direto do arquivo enviado (sem extrair para o disco) e vão para o pool em
+    lotes pequenos, então só um lote de PDFs descompactados fica em memória.
+    A resposta é NDJSON: uma linha com o total, uma por membro e um resumo final.
+    """
+    try:
+        zf = ZipFile(arquivo_zip.stream)
+        membros = _membros_pdf(zf)
+    except BadZipFile:
+        return jsonify({"sucesso": False, "erro": "Arquivo ZIP inválido."}), 400
+    if not membros:
+        zf.close()
+        return jsonify({"sucesso": False, "erro": "Nenhum PDF encontrado no ZIP."}), 400
+
+    _, extrator_pedido, pool_extracao = _extracao()
+    tamanho_lote = max(1, pool_extracao.numero_de_workers() * 2)
+
+    def gerar():
+        sucessos, erros = 0, 0
+        try:
+            yield json.dumps({"total": len(membros)}) + "\n"
+            for inicio in range(0, len(membros), tamanho_lote):
+                lote, linhas_erro = [], []
+                for indice, info in enumerate(membros[inicio:inicio + tamanho_lote], start=inicio):
+                    filename = secure_filename(os.path.basename(info.filename))
+                    if info.file_size > MAX_PDF_NO_ZIP:
+                        linhas_erro.append({"indice": indice, "arquivo": filename, "sucesso": False,
+                                            "erro": "Arquivo grande demais dentro do ZIP."})
+                        continue
+                    with zf.open(info) as membro:
+                        lote.append((indice, filename, membro.read()))
+
+                resultados = extrair_pedidos_com_cache(
+                    obter_cache_parse(), [(nome, pdf) for _, nome, pdf in lote],
+                    nome_da_carga, pool_extracao.extrair_em_paralelo, extrator_pedido.VERSAO_EXTRATOR
+                )
+                linhas = linhas_erro
+                for (indice, filename, pdf_bytes), dados_extraidos in zip(lote, resultados):
+                    erro = _salvar_pedido_extraido(filename, pdf_bytes, dados_extraidos)
+                    linha = {"indice": indice, "arquivo": filename, "sucesso": erro is None}
+                    if erro:
+                        linha["erro"] = erro
+                    else:
+                        linha["numero_pedido"] = dados_extraidos.get("numero_pedido")
+                    linhas.append(linha)
+                del lote, resultados
+
+                for linha in sorted(linhas, key=lambda l: l["indice"]):
+                    if linha["sucesso"]:
+                        sucessos += 1
+                    else:
+                        erros += 1
+                    yield json.dumps(linha) + "\n"
+            if sucessos:
+                iniciar_uploader(get_db_connection)
+        finally:
+            zf.close()
+        yield json.dumps({
+            "fim": True, "sucesso": erros == 0, "processados": sucessos, "erros": erros,
+            "mensagem": f"{sucessos} de {len(membros)} arquivo(s) da carga '{nome_da_carga}' processados."
+        }) + "\n"
+
+    return Response(stream_with_context(gerar()), mimetype='application/x-ndjson')
+
+@app.route('/arquivos/<path:chave>')
+def arquivo_local(chave):
+    """Serve os PDFs quando ARMAZENAMENTO_BACKEND=local."""
+    armazenamento = obter_armazenamento()
+    if not isinstance(armazenamento, ArmazenamentoLocal):
+        abort(404)
+    return send_from_directory(armazenamento.diretorio, chave, mimetype="application/pdf")
+
+@app.route('/api/fila-uploads')
+def api_fila_uploads():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    resumo = resumo_fila(cur)
+    cur.close()
+    conn.close()
+    return jsonify(resumo)
+
+@app.route('/api/cache-parse')
+def api_cache_parse():
+    return jsonify(obter_cache_parse().estatisticas())
+
 @app.route('/api/cargas')
 def api_cargas():
+    # Lê o registro de cargas (poucas linhas) em vez de varrer a tabela pedidos
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("SELECT DISTINCT nome_da_carga FROM pedidos WHERE nome_da_carga IS NOT NULL ORDER BY nome_da_carga;")
-    cargas = [row[0] for row in cur.fetchall()]
+    cargas = registro_cargas.listar(cur)
     cur.close()
     conn.close()
     return jsonify(cargas)
 
+LIMITE_PAGINA_PEDIDOS = 100
+LIMITE_PAGINA_MAXIMO = 500
+
+
 @app.route('/api/pedidos/<nome_da_carga>')
 def api_pedidos_por_carga(nome_da_carga):
+    """
+    Pedidos da carga. Com ?resumo=1 devolve só contagens/status/progresso por
+    pedido, calculados no SQL, em páginas por keyset: ?depois=<id>&limite=N,
+    e a resposta traz "proximo" (o `depois` da página seguinte, ou null).
+    Sem resumo, mantém o formato antigo (lista com os produtos).
+    Nos dois casos a resposta tem ETag, e um If-None-Match igual recebe 304.
+    """
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cur.execute("SELECT * FROM pedidos WHERE nome_da_carga = %s ORDER BY id DESC;", (nome_da_carga,))
-    pedidos = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify(pedidos)
+    try:
+        if request.args.get('resumo'):
+            try:
+                limite = int(request.args.get('limite') or LIMITE_PAGINA_PEDIDOS)
+                depois = request.args.get('depois')
+                depois = int(depois) if depois else None
+            except ValueError:
+                return jsonify({"erro": "Parâmetros de paginação inválidos."}), 400
+            limite = max(1, min(limite, LIMITE_PAGINA_MAXIMO))
+
+            cur.execute("""
+                SELECT p.id, p.numero_pedido, p.nome_cliente, p.vendedor, p.nome_arquivo,
+                       p.status_conferencia, p.conferente, p.itens_pendentes,
+                       c.total_itens, c.itens_confirmados, c.itens_corte
+                  FROM pedidos p
+                  CROSS JOIN LATERAL (
+                      SELECT COUNT(*) AS total_itens,
+                             COUNT(*) FILTER (WHERE i.status = 'Confirmado') AS itens_confirmados,
+                             COUNT(*) FILTER (WHERE i.status IN %s) AS itens_corte
+                        FROM pedido_itens i
+                       WHERE i.numero_pedido = p.numero_pedido
+                  ) c
+                 WHERE p.nome_da_carga = %s AND (%s::INTEGER IS NULL OR p.id < %s)
+                 ORDER BY p.id DESC
+                 LIMIT %s;
+            """, (itens_pedido.STATUS_CORTE, nome_da_carga, depois, depois, limite + 1))
+            pedidos = cur.fetchall()
+            proximo = None
+            if len(pedidos) > limite:
+                pedidos = pedidos[:limite]
+                proximo = pedidos[-1]["id"]
+            for pedido in pedidos:
+                total = pedido["total_itens"]
+                pedido["progresso"] = round(100 * (total - (pedido["itens_pendentes"] or 0)) / total) if total else 100
+            resposta = jsonify({"pedidos": pedidos, "proximo": proximo})
+        else:
+            cur.execute(f"""
+                SELECT p.id, p.numero_pedido, p.nome_cliente, p.vendedor, p.nome_da_carga, p.nome_arquivo,
+                       p.status_conferencia, p.url_pdf, p.conferente, {itens_pedido.SQL_PRODUTOS_JSON} AS produtos
+                  FROM pedidos p
+                 WHERE p.nome_da_carga = %s
+                 ORDER BY p.id DESC;
+            """, (nome_da_carga,))
+            resposta = jsonify(cur.fetchall())
+    finally:
+        cur.close()
+        conn.close()
+
+    resposta.add_etag()
+    resposta.headers['Cache-Control'] = 'no-cache'
+    return resposta.make_conditional(request)
 
 # =====================  (ALTERADO)  =====================
+def _resposta_conflito(item_atual):
+    """409 com o estado atual do item, para a tela do conferente se atualizar."""
+    return jsonify({
+        "sucesso": False, "conflito": True,
+        "erro": "Este item foi alterado por outro conferente. A tela foi atualizada com o valor atual.",
+        "item": item_atual
+    }), 409
+
 @app.route('/api/item/update', methods=['POST'])
 def update_item_status():
     dados_recebidos = request.json
-    status_final = "Erro"
     conn = None
+    cur = None
     try:
         conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur = conn.cursor()
         
         pedido_id = dados_recebidos.get('pedido_id')
         produto_index = dados_recebidos.get('produto_index')
 
         if produto_index is None:
             return jsonify({"sucesso": False, "erro": "Índice do produto não fornecido."}), 400
-
-        cur.execute("SELECT * FROM pedidos WHERE numero_pedido = %s;", (pedido_id,))
-        pedido = cur.fetchone()
-        if not pedido: 
-            return jsonify({"sucesso": False, "erro": "Pedido não encontrado."}), 404
-
-        produtos_atualizados = pedido['produtos']
-        
-        # Acessa o produto diretamente pelo índice, sem loop
-        if 0 <= produto_index < len(produtos_atualizados):
-            produto_alvo = produtos_atualizados[produto_index]
-        else:
+        # Sem a quantidade, calcular_status daria "Corte Parcial" (mesma regra do lote)
+        if dados_recebidos.get('quantidade_entregue') is None:
+            return jsonify({"sucesso": False, "erro": "Quantidade entregue não fornecida."}), 400
+
+        # Um UPDATE de uma linha em pedido_itens, condicionado à versão do item;
+        # o status do pedido segue o contador de pendentes
+        versao = dados_recebidos.get('versao')
+        resultado = itens_pedido.atualizar_item(
+            cur, pedido_id, int(produto_index),
+            dados_recebidos['quantidade_entregue'], dados_recebidos.get('observacao', ''),
+            versao=int(versao) if versao is not None else None
+        )
+        if resultado is None:
+            cur.execute("SELECT 1 FROM pedidos WHERE numero_pedido = %s;", (pedido_id,))
+            if not cur.fetchone():
+                return jsonify({"sucesso": False, "erro": "Pedido não encontrado."}), 404
             return jsonify({"sucesso": False, "erro": "Índice do produto inválido."}), 400
-
-        # Aplica as atualizações no produto correto
-        qtd_entregue_str = dados_recebidos['quantidade_entregue']
-        produto_alvo['quantidade_entregue'] = qtd_entregue_str
-        produto_alvo['observacao'] = dados_recebidos.get('observacao', '')
-
-        if bool(produto_alvo.get('forced_confirmed', False)):
-            status_final = "Confirmado"
-        else:
-            qtd_pedida_str = produto_alvo.get('quantidade_pedida', '0')
-            unidades_pacote = int(produto_alvo.get('unidades_pacote', 1))
-            match_pacotes = re.match(r'(\d+)', qtd_pedida_str)
-            pacotes_pedidos = int(match_pacotes.group(1)) if match_pacotes else 0
-            total_unidades_pedidas = pacotes_pedidos * unidades_pacote
-
-            try:
-                qtd_entregue_int = int(qtd_entregue_str)
-                if qtd_entregue_int == total_unidades_pedidas: 
-                    status_final = "Confirmado"
-                elif qtd_entregue_int == 0: 
-                    status_final = "Corte Total"
-                else: 
-                    status_final = "Corte Parcial"
-            except (ValueError, TypeError): 
-                status_final = "Corte Parcial"
-
-        produto_alvo['status'] = status_final
-        
-        # Verifica se todos os itens foram conferidos para finalizar o pedido
-        todos_conferidos = all(p['status'] != 'Pendente' for p in produtos_atualizados)
-        novo_status_conferencia = 'Finalizado' if todos_conferidos else 'Pendente'
-
-        sql_update = "UPDATE pedidos SET produtos = %s, status_conferencia = %s WHERE numero_pedido = %s;"
-        cur.execute(sql_update, (json.dumps(produtos_atualizados), novo_status_conferencia, pedido_id))
+        if resultado.get("conflito"):
+            conn.rollback()
+            return _resposta_conflito(resultado["atual"])
         conn.commit()
         
-        return jsonify({"sucesso": True, "status_final": status_final})
+        return jsonify({"sucesso": True, "status_final": resultado["status_final"], "versao": resultado["versao"]})
 
     except Exception as e:
         import traceback; traceback.print_exc()
         if conn: conn.rollback()
         return jsonify({"sucesso": False, "erro": str(e)}), 500
     finally:
-        if conn: 
-            if 'cur' in locals() and cur: cur.close(); 
-            conn.close()
+        if cur: cur.close()
+        if conn: conn.close()
 
 # =====================  (NOVO)  =====================
 @app.route('/api/item/force', methods=['POST'])
@@ -475,41 +454,65 @@ def force_item():
     """
     dados = request.json
     conn = None
+    cur = None
     try:
         conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute("SELECT * FROM pedidos WHERE numero_pedido = %s;", (dados['pedido_id'],))
-        pedido = cur.fetchone()
-        if not pedido:
+        cur = conn.cursor()
+        indice = dados.get('produto_index')
+        versao = dados.get('versao')
+        resultado = itens_pedido.alternar_forcado(
+            cur, dados['pedido_id'],
+            indice=int(indice) if indice is not None else None,
+            produto_nome=dados.get('produto_nome'),
+            versao=int(versao) if versao is not None else None
+        )
+        if resultado is None:
             return jsonify({"sucesso": False, "erro": "Pedido não encontrado."}), 404
+        if resultado.get("conflito"):
+            conn.rollback()
+            return _resposta_conflito(resultado["atual"])
+        conn.commit()
+        return jsonify({"sucesso": True, "forced_confirmed": resultado["forced_confirmed"],
+                        "status": resultado["status"], "versao": resultado["versao"]})
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        if conn: conn.rollback()
+        return jsonify({"sucesso": False, "erro": str(e)}), 500
+    finally:
+        if cur: cur.close()
+        if conn: conn.close()
 
-        produtos = pedido['produtos']
-        novo_forced = None
-        novo_status = None
-
-        for produto in produtos:
-            if produto.get('produto_nome') == dados.get('produto_nome'):
-                atual = bool(produto.get('forced_confirmed', False))
-                produto['forced_confirmed'] = not atual
-                novo_forced = produto['forced_confirmed']
-                if produto['forced_confirmed']:
-                    produto['status'] = 'Confirmado'
-                else:
-                    # opcional: você pode recalcular aqui se quiser
-                    produto['status'] = 'Pendente'
-                novo_status = produto['status']
-                break
-
-        cur.execute("UPDATE pedidos SET produtos = %s WHERE numero_pedido = %s;",
-                    (json.dumps(produtos), dados['pedido_id']))
+@app.route('/api/itens/lote', methods=['POST'])
+def atualizar_itens_em_lote():
+    """
+    Várias bipagens/forçamentos (de um ou mais pedidos) em uma requisição e
+    uma transação. Corpo: {"operacoes": [{"tipo": "update"|"force", "pedido_id",
+    "produto_index", "quantidade_entregue", "observacao", "versao"}, ...]}.
+    Responde com o resultado de cada operação, na mesma ordem.
+    """
+    dados = request.get_json(silent=True) or {}
+    operacoes = dados.get('operacoes')
+    if not isinstance(operacoes, list) or not operacoes:
+        return jsonify({"sucesso": False, "erro": "Nenhuma operação enviada."}), 400
+    if len(operacoes) > itens_pedido.MAX_OPERACOES_LOTE:
+        return jsonify({"sucesso": False, "erro": f"Máximo de {itens_pedido.MAX_OPERACOES_LOTE} operações por lote."}), 413
+
+    conn = None
+    cur = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        resultados = itens_pedido.aplicar_lote(cur, operacoes)
         conn.commit()
-        return jsonify({"sucesso": True, "forced_confirmed": novo_forced, "status": novo_status})
+        aplicadas = sum(1 for r in resultados if r["sucesso"])
+        return jsonify({"sucesso": True, "aplicadas": aplicadas, "resultados": resultados})
     except Exception as e:
         import traceback; traceback.print_exc()
+        if conn: conn.rollback()
         return jsonify({"sucesso": False, "erro": str(e)}), 500
     finally:
-        if conn:
-            cur.close(); conn.close()
+        if cur: cur.close()
+        if conn: conn.close()
 
 @app.route('/api/cortes')
 def api_cortes():
@@ -518,23 +521,16 @@ def api_cortes():
     conn = None
     try:
         conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute("SELECT * FROM pedidos WHERE status_conferencia = 'Finalizado';")
-        pedidos = cur.fetchall()
-        for pedido in pedidos:
-            produtos = pedido.get('produtos', []) if pedido.get('produtos') is not None else []
-            if not isinstance(produtos, list): 
-                continue
-            nome_carga = pedido.get('nome_da_carga', 'Sem Carga')
-            for produto in produtos:
-                if produto.get('status') in ['Corte Parcial', 'Corte Total']:
-                    cortes_agrupados[nome_carga].append({
-                        "numero_pedido": pedido.get('numero_pedido'),
-                        "nome_cliente": pedido.get('nome_cliente'),
-                        "vendedor": pedido.get('vendedor'),
-                        "observacao": produto.get('observacao', ''),
-                        "produto": produto
-                    })
+        cur = conn.cursor()
+        # Lê só as linhas do índice parcial de cortes (ver itens_pedido.listar_cortes)
+        for numero_pedido, nome_cliente, vendedor, nome_carga, produto in itens_pedido.listar_cortes(cur):
+            cortes_agrupados[nome_carga or 'Sem Carga'].append({
+                "numero_pedido": numero_pedido,
+                "nome_cliente": nome_cliente,
+                "vendedor": vendedor,
+                "observacao": produto.get('observacao', ''),
+                "produto": produto
+            })
         return jsonify(cortes_agrupados)
     except Exception as e:
         import traceback; traceback.print_exc()
@@ -545,70 +541,47 @@ def api_cortes():
 
 @app.route('/api/gerar-relatorio')
 def gerar_relatorio():
-    # idem: só considera Corte Parcial/Total (confirmados/forçados não entram) :contentReference[oaicite:2]{index=2}
+    """
+    Excel dos cortes (Corte Parcial/Total), gerado em memória constante e
+    enviado em blocos. Filtros opcionais na query string: carga, vendedor,
+    de e ate (AAAA-MM-DD, pela data de upload do pedido).
+    """
+    filtros = {"carga": request.args.get('carga', '').strip(),
+               "vendedor": request.args.get('vendedor', '').strip()}
+    try:
+        for campo in ("de", "ate"):
+            valor = request.args.get(campo, '').strip()
+            filtros[campo] = datetime.strptime(valor, "%Y-%m-%d") if valor else None
+    except ValueError:
+        return "Datas devem estar no formato AAAA-MM-DD.", 400
+
     conn = None
     try:
         conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute("SELECT * FROM pedidos;")
-        pedidos = cur.fetchall()
-        if not pedidos: 
+        cur = conn.cursor()
+        cur.execute("SELECT EXISTS (SELECT 1 FROM pedidos);")
+        existe = cur.fetchone()[0]
+        cur.close()
+        if not existe:
             return "Nenhum pedido encontrado para gerar o relatório.", 404
 
-        dados_para_excel = []
-        for pedido in pedidos:
-            produtos = pedido.get('produtos', []) if pedido.get('produtos') is not None else []
-            if not isinstance(produtos, list): 
-                continue
-            for produto in produtos:
-                if produto.get('status') in ['Corte Parcial', 'Corte Total']:
-                    try:
-                        valor_total = float(str(produto.get('valor_total_item', '0')).replace(',', '.'))
-                        unidades_pacote = int(produto.get('unidades_pacote', 1))
-                        qtd_pedida_str = produto.get('quantidade_pedida', '0')
-                        match = re.match(r'(\d+)', qtd_pedida_str)
-                        pacotes_pedidos = int(match.group(1)) if match else 0
-                        preco_por_pacote = valor_total / pacotes_pedidos if pacotes_pedidos > 0 else 0
-                        preco_unidade = preco_por_pacote / unidades_pacote if unidades_pacote > 0 else 0
-                        unidades_pedidas = pacotes_pedidos * unidades_pacote
-                        qtd_entregue_str = str(produto.get('quantidade_entregue', '0'))
-                        unidades_entregues = int(qtd_entregue_str) if qtd_entregue_str.isdigit() else 0
-                        valor_corte = (unidades_pedidas - unidades_entregues) * preco_unidade
-
-                        dados_para_excel.append({
-                            'Pedido': pedido.get('numero_pedido'),
-                            'Cliente': pedido.get('nome_cliente'),
-                            'Vendedor': pedido.get('vendedor'),
-                            'Produto': produto.get('produto_nome', ''),
-                            'Quantidade Pedida': produto.get('quantidade_pedida', ''),
-                            'Quantidade Entregue': produto.get('quantidade_entregue', ''),
-                            'Status': produto.get('status', ''),
-                            'Observação': produto.get('observacao', ''),
-                            'Valor Total Item': produto.get('valor_total_item'),
-                            'Valor do Corte Estimado': round(valor_corte, 2)
-                        })
-                    except (ValueError, TypeError, AttributeError) as e:
-                        print(f"Erro ao calcular corte para o produto {produto.get('produto_nome', 'N/A')}: {e}")
-                        continue
-
-        if not dados_para_excel: 
-            return "Nenhum item com corte encontrado para gerar o relatório."
-
-        df = pd.DataFrame(dados_para_excel)
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Cortes')
-        return Response(
-            output.getvalue(),
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": "attachment;filename=cortes_relatorio.xlsx"}
-        )
+        caminho, linhas = relatorio_cortes.gerar_arquivo(conn, filtros)
     except Exception as e:
         import traceback; traceback.print_exc()
         return f"Erro ao gerar relatório: {e}", 500
     finally:
-        if conn: 
-            cur.close(); conn.close()
+        if conn: conn.close()
+
+    if not linhas:
+        os.remove(caminho)
+        return "Nenhum item com corte encontrado para gerar o relatório."
+
+    return Response(
+        relatorio_cortes.enviar_em_blocos(caminho),
+        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": "attachment;filename=cortes_relatorio.xlsx",
+                 "Content-Length": str(os.path.getsize(caminho))}
+    )
 
 @app.route('/api/resetar-dia', methods=['POST'])
 def resetar_dia():
@@ -641,8 +614,11 @@ def resetar_dia():
 
         if limpa_pedidos:
             try:
-                cur.execute("TRUNCATE TABLE pedidos RESTART IDENTITY CASCADE;")
+                cur.execute("TRUNCATE TABLE pedido_itens, pedidos, fila_uploads, registro_cargas RESTART IDENTITY CASCADE;")
             except Exception:
+                cur.execute("DELETE FROM registro_cargas;")
+                cur.execute("DELETE FROM fila_uploads;")
+                cur.execute("DELETE FROM pedido_itens;")
                 cur.execute("DELETE FROM pedidos;")
 
         conn.commit()
@@ -676,12 +652,18 @@ def mapa_upload():
 
     filename = secure_filename(f.filename)
     nome_exibicao = os.path.splitext(filename)[0]  # "Araçariguama.pdf" -> "Araçariguama"
-    # Usar /tmp é uma boa prática para ambientes de deploy temporários
-    path_tmp = os.path.join("/tmp", filename)
-    f.save(path_tmp)
+    # Lido direto do upload: sem arquivo em /tmp, que dois uploads com o
+    # mesmo nome podiam sobrescrever um do outro
+    inicio_upload = time.perf_counter()
+    pdf_bytes = f.read()
+    parser_mapa, _, _ = _extracao()
+    paginas = iterar_mapa_com_cache(obter_cache_parse(), pdf_bytes, parser_mapa.iterar_mapa_paralelo, parser_mapa.VERSAO_PARSER)
 
     try:
-        header, _, grupos, itens = parse_mapa(path_tmp)
+        # O cabeçalho vem na primeira página; as demais são gravadas conforme
+        # o parser as entrega, enquanto o pool ainda lê as seguintes
+        primeira = next(paginas, None)
+        header = (primeira or {}).get("header") or {}
         numero_carga = header.get("numero_carga")
         if not numero_carga:
             # Retorna um erro 400 que o frontend pode exibir
@@ -690,37 +672,48 @@ def mapa_upload():
         conn = get_db_connection()
         cur = conn.cursor()
 
-        # Limpa dados antigos da carga para garantir um re-upload limpo
-        cur.execute("DELETE FROM cargas WHERE numero_carga = %s;", (numero_carga,))
-
-        # Insere a nova carga
-        cur.execute("""
-    INSERT INTO cargas (numero_carga, motorista, descricao_romaneio, data_emissao, nome_exibicao)
-    VALUES (%s, %s, %s, %s, %s)
-""", (numero_carga, header.get("motorista"), header.get("romaneio"), header.get("data"), nome_exibicao))
+        cur.execute("SELECT 1 FROM cargas WHERE numero_carga = %s FOR UPDATE;", (numero_carga,))
+        # Reenvio de um mapa que já existe: mescla com o gravado e mantém a
+        # separação feita. modo=substituir apaga tudo e grava do zero.
+        mesclar = cur.fetchone() is not None and request.form.get("modo") != "substituir"
 
-        # Insere grupos
-        for g in grupos or []:
+        if mesclar:
             cur.execute("""
-                INSERT INTO carga_grupos (numero_carga, grupo_codigo, grupo_titulo)
-                VALUES (%s, %s, %s) ON CONFLICT (numero_carga, grupo_codigo) DO NOTHING
-            """, (numero_carga, g.get("grupo_codigo"), g.get("grupo_titulo")))
+                UPDATE cargas SET motorista = %s, descricao_romaneio = %s, data_emissao = %s, nome_exibicao = %s
+                 WHERE numero_carga = %s
+            """, (header.get("motorista"), header.get("romaneio"), header.get("data"), nome_exibicao, numero_carga))
+            gravacao = mapa_carga.MesclagemMapa(cur, numero_carga)
+        else:
+            # Limpa dados antigos da carga para garantir um re-upload limpo
+            cur.execute("DELETE FROM cargas WHERE numero_carga = %s;", (numero_carga,))
 
-        # Insere itens
-        for it in itens or []:
+            # Insere a nova carga
             cur.execute("""
-                INSERT INTO carga_itens (
-                    numero_carga, grupo_codigo, fabricante, codigo, cod_barras,
-                    descricao, qtd_unidades, unidade, pack_qtd, pack_unid
-                ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-            """, (
-                numero_carga, it.get("grupo_codigo"), it.get("fabricante"),
-                it.get("codigo"), it.get("cod_barras"), it.get("descricao"),
-                it.get("qtd_unidades"), it.get("unidade"),
-                it.get("pack_qtd"), it.get("pack_unid")
-            ))
+        INSERT INTO cargas (numero_carga, motorista, descricao_romaneio, data_emissao, nome_exibicao)
+        VALUES (%s, %s, %s, %s, %s)
+    """, (numero_carga, header.get("motorista"), header.get("romaneio"), header.get("data"), nome_exibicao))
+            gravacao = mapa_carga.GravacaoMapa(cur, numero_carga)
+
+        # Grupos e itens em lotes (execute_values), conforme as páginas chegam
+        for pagina in itertools.chain([primeira], paginas):
+            gravacao.adicionar(pagina["grupos"], pagina["itens"])
+        resumo = gravacao.concluir()
+        if mesclar:
+            # Quem está com o mapa aberto recarrega os itens
+            eventos.notificar(cur, "mapa", numero_carga, "mapa_atualizado",
+                              {k: resumo[k] for k in ("inseridos", "atualizados", "removidos")})
         
         conn.commit()
+        app.logger.info(
+            f"[Mapa] Carga {numero_carga}: {resumo['grupos']} grupos e {resumo['itens']} itens "
+            f"gravados em {resumo['ms_gravacao']} ms ({resumo['lotes']} lote(s)); "
+            f"upload total {1000 * (time.perf_counter() - inicio_upload):.0f} ms"
+        )
+        if mesclar:
+            app.logger.info(
+                f"[Mapa] Carga {numero_carga} mesclada em {resumo['ms_mesclagem']} ms: {resumo['inseridos']} novos, "
+                f"{resumo['atualizados']} alterados, {resumo['removidos']} removidos"
+            )
         # Após sucesso, redireciona para a página de detalhe do mapa
         return redirect(url_for("mapa_detalhe", numero_carga=numero_carga))
 
@@ -729,14 +722,13 @@ def mapa_upload():
         # Retorna erro 500 para o frontend
         return f"Ocorreu um erro interno ao processar o PDF do mapa: {e}", 500
     finally:
+        # Se saiu antes do fim, cancela o que o pool ainda não começou
+        paginas.close()
         # Garante que o cursor e a conexão sejam fechados
         if 'conn' in locals() and conn:
             if 'cur' in locals() and cur:
                 cur.close()
             conn.close()
-        # Garante que o arquivo temporário seja removido
-        if os.path.exists(path_tmp):
-            os.remove(path_tmp)
 
 
 @app.route('/mapa/<numero_carga>')
@@ -788,37 +780,17 @@ def mapa_lista():
 
 @app.route('/api/mapa/<numero_carga>')
 def api_mapa_detalhe(numero_carga):
-    """Retorna grupos e itens da carga, para montar a tela de separação."""
+    """
+    Retorna grupos e itens da carga, para montar a tela de separação.
+    ?since=<versao> devolve só o que mudou desde a versão de uma resposta anterior.
+    """
+    desde = request.args.get('since', type=int)
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
-    # grupos (agora também busca o 'separador_nome')
-    cur.execute("""
-        SELECT grupo_codigo, grupo_titulo, separador_nome
-        FROM carga_grupos
-        WHERE numero_carga = %s
-        ORDER BY
-            CASE
-                WHEN grupo_codigo = 'GERAL' THEN 0
-                ELSE 1
-            END,
-            grupo_codigo;
-    """, (numero_carga,))
-    grupos = cur.fetchall()
-
-    # itens (agora também busca a 'qtd_separada')
-    cur.execute("""
-        SELECT id, grupo_codigo, fabricante, codigo, cod_barras, descricao,
-               qtd_unidades, unidade, pack_qtd, pack_unid,
-               observacao, separado, forcar_conferido, faltou, sobrando, qtd_separada
-        FROM carga_itens
-        WHERE numero_carga = %s
-        ORDER BY id;
-    """, (numero_carga,))
-    itens = cur.fetchall()
-
-    cur.close(); conn.close()
-    return jsonify({"grupos": grupos, "itens": itens})
+    try:
+        return jsonify(mapa_carga.ler_mapa(cur, numero_carga, desde))
+    finally:
+        cur.close(); conn.close()
 
 
 @app.route('/api/mapa/item/atualizar', methods=['POST'])
@@ -834,7 +806,7 @@ def api_mapa_item_atualizar():
 
     try:
         # Pega o estado atual do item, incluindo a quantidade pedida
-        cur.execute("SELECT qtd_unidades FROM carga_itens WHERE id = %s", (item_id,))
+        cur.execute("SELECT qtd_unidades, numero_carga FROM carga_itens WHERE id = %s", (item_id,))
         item_atual = cur.fetchone()
         if not item_atual:
             return jsonify({"ok": False, "erro": "Item não encontrado"}), 404
@@ -865,6 +837,7 @@ def api_mapa_item_atualizar():
         values = list(update_fields.values()) + [item_id]
 
         cur.execute(f"UPDATE carga_itens SET {set_clause} WHERE id = %s", tuple(values))
+        eventos.notificar(cur, "mapa", item_atual['numero_carga'], "item", {"id": item_id, **update_fields})
         conn.commit()
         
         return jsonify({"ok": True, "updated_fields": update_fields})
@@ -878,6 +851,50 @@ def api_mapa_item_atualizar():
         conn.close()
 
 
+@app.route('/api/mapa/itens/lote', methods=['POST'])
+def api_mapa_itens_lote():
+    """
+    Várias alterações de itens do mapa em uma requisição, um UPDATE e uma
+    transação (ver mapa_carga.atualizar_itens). Corpo: {"itens": [{"id",
+    "separado", "qtd_separada", "faltou", "observacao", "sobrando"}, ...]},
+    cada item só com os campos que mudaram. Responde com as linhas gravadas.
+    """
+    dados = request.get_json(silent=True) or {}
+    alteracoes = dados.get('itens')
+    if not isinstance(alteracoes, list) or not alteracoes:
+        return jsonify({"ok": False, "erro": "Nenhum item enviado."}), 400
+    if not all(isinstance(alteracao, dict) for alteracao in alteracoes):
+        return jsonify({"ok": False, "erro": "Alteração inválida: cada item deve ser um objeto."}), 400
+    if len(alteracoes) > mapa_carga.MAX_ITENS_ATUALIZACAO:
+        return jsonify({"ok": False, "erro": f"Máximo de {mapa_carga.MAX_ITENS_ATUALIZACAO} itens por lote."}), 413
+
+    conn = None
+    cur = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        try:
+            itens = mapa_carga.atualizar_itens(cur, alteracoes)
+        except (KeyError, TypeError, ValueError) as e:
+            conn.rollback()
+            return jsonify({"ok": False, "erro": f"Alteração inválida: {e}"}), 400
+
+        por_carga = defaultdict(list)
+        for item in itens:
+            por_carga[item.pop('numero_carga')].append(item)
+        for numero_carga, itens_carga in por_carga.items():
+            eventos.notificar_lista(cur, "mapa", numero_carga, "itens", "itens", itens_carga)
+        conn.commit()
+        return jsonify({"ok": True, "atualizados": len(itens), "itens": itens})
+    except (Exception, psycopg2.Error) as e:
+        app.logger.error(f"Erro ao atualizar itens do mapa em lote: {e}")
+        if conn: conn.rollback()
+        return jsonify({"ok": False, "erro": "Erro de banco de dados"}), 500
+    finally:
+        if cur: cur.close()
+        if conn: conn.close()
+
+
 @app.route('/api/mapa/grupo/marcar', methods=['POST'])
 def api_mapa_grupo_marcar():
     """Marca/Desmarca um grupo inteiro como 'separado' (checkbox em massa)."""
@@ -893,9 +910,10 @@ def api_mapa_grupo_marcar():
     cur.execute("""
         UPDATE carga_itens
            SET separado=%s
-         WHERE numero_carga=%s AND grupo_codigo=%s
+         WHERE numero_carga=%s AND grupo_codigo=%s AND NOT removido
     """, (separado, numero_carga, grupo_codigo))
     afetados = cur.rowcount
+    eventos.notificar(cur, "mapa", numero_carga, "grupo", {"grupo_codigo": grupo_codigo, "separado": separado})
     conn.commit()
     cur.close(); conn.close()
     return jsonify({"ok": True, "itens_afetados": afetados})
@@ -934,13 +952,10 @@ def mapa_extrator():
     if not f:
         return "Envie um PDF", 400
 
-    from werkzeug.utils import secure_filename
-    path_tmp = f"/tmp/{secure_filename(f.filename)}"
-    f.save(path_tmp)
-
     try:
-        # usa as funções de debug do parser
-        rows = debug_extrator(path_tmp)
+        # usa as funções de debug do parser (direto do upload, sem /tmp)
+        parser_mapa, _, _ = _extracao()
+        rows = parser_mapa.debug_extrator(f.stream)
     except Exception as e:
         return (f"Erro no extrator: {e}", 400)
 
@@ -1029,7 +1044,7 @@ def api_mapa_grupo_definir_separador():
            SET separador_nome = %s
          WHERE numero_carga = %s AND grupo_codigo = %s
     """, (separador_nome, numero_carga, grupo_codigo))
-    
+    eventos.notificar(cur, "mapa", numero_carga, "grupo", {"grupo_codigo": grupo_codigo, "separador_nome": separador_nome})
     conn.commit()
     cur.close(); conn.close()
     return jsonify({"ok": True})
@@ -1059,7 +1074,7 @@ def api_pedido_buscar_por_barcode(pedido_id):
     Dentro de um pedido específico, busca um produto pelo seu código de barras.
     """
     data = request.json or {}
-    barcode = data.get('barcode')
+    barcode = indice_barcode.normalizar(data.get('barcode'))
 
     if not barcode:
         return jsonify({"ok": False, "erro": "Código de barras não fornecido"}), 400
@@ -1067,21 +1082,17 @@ def api_pedido_buscar_por_barcode(pedido_id):
     conn = None
     try:
         conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur = conn.cursor()
 
-        cur.execute("SELECT produtos FROM pedidos WHERE numero_pedido = %s;", (pedido_id,))
-        pedido = cur.fetchone()
+        # Busca direta pelo índice (numero_pedido, codigo_barras) de pedido_itens
+        produto = itens_pedido.buscar_por_barcode(cur, pedido_id, barcode)
+        if produto:
+            return jsonify({"ok": True, "produto": produto})
 
-        if not pedido or not pedido['produtos']:
+        cur.execute("SELECT 1 FROM pedido_itens WHERE numero_pedido = %s LIMIT 1;", (pedido_id,))
+        if not cur.fetchone():
             return jsonify({"ok": False, "erro": "Pedido não encontrado ou sem produtos."}), 404
 
-        # Itera pela lista de produtos dentro do JSON do pedido
-        for produto in pedido['produtos']:
-            if produto.get('codigo_barras') == barcode:
-                # Encontrou o produto!
-                return jsonify({"ok": True, "produto": produto})
-
-        # Se o loop terminar e não encontrar, retorna erro
         return jsonify({"ok": False, "erro": "Produto com este código de barras não encontrado neste pedido."}), 404
 
     except Exception as e:
@@ -1094,6 +1105,74 @@ def api_pedido_buscar_por_barcode(pedido_id):
             conn.close()
 
 
+@app.route('/api/carga/<nome_da_carga>/buscar-por-barcode', methods=['POST'])
+def api_carga_buscar_por_barcode(nome_da_carga):
+    """
+    Busca um código de barras em todos os pedidos da carga e, se o corpo
+    trouxer "mapa" (numero_carga do romaneio), também nos itens desse mapa de
+    separação. Devolve cada ocorrência com pedido, índice do item e unidades
+    por pacote (pendentes primeiro).
+    """
+    data = request.json or {}
+    barcode = indice_barcode.normalizar(data.get('barcode'))
+    numero_mapa = str(data.get('mapa') or '').strip() or None
+
+    if not barcode:
+        return jsonify({"ok": False, "erro": "Código de barras não fornecido"}), 400
+
+    conn = None
+    cur = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        encontrados = indice_barcode.resolver(cur, nome_da_carga, barcode, numero_mapa)
+        if not encontrados["pedidos"] and not encontrados["mapa"]:
+            return jsonify({"ok": False, "erro": "Código de barras não encontrado nesta carga."}), 404
+        return jsonify({"ok": True, "barcode": barcode, **encontrados})
+    except Exception as e:
+        app.logger.error(f"Erro ao buscar barcode na carga: {e}", exc_info=True)
+        return jsonify({"ok": False, "erro": "Erro interno no servidor"}), 500
+    finally:
+        if cur: cur.close()
+        if conn: conn.close()
+
+# ---------- Eventos ao vivo (SSE) ----------
+def _resposta_sse(escopo, chave):
+    # Servidor sem threads (worker sync): o stream prenderia o worker inteiro.
+    # Sem vaga de stream neste worker: 503 em vez de prender mais uma thread
+    if not request.environ.get("wsgi.multithread") or not eventos.reservar_stream():
+        return Response(
+            f"retry: {eventos.ESPERA_OCUPADO * 1000}\n\n", status=503,
+            mimetype="text/event-stream",
+            headers={"Retry-After": str(eventos.ESPERA_OCUPADO), "Cache-Control": "no-cache"}
+        )
+    resposta = Response(
+        stream_with_context(eventos.fluxo_sse(escopo, chave)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # Libera a vaga quando o servidor encerra a resposta, tenha o gerador rodado ou não
+    resposta.call_on_close(eventos.liberar_stream)
+    return resposta
+
+
+@app.route('/api/eventos/carga/<nome_da_carga>')
+def eventos_da_carga(nome_da_carga):
+    """Itens conferidos, pedidos novos e pedidos finalizados da carga, ao vivo."""
+    return _resposta_sse("carga", nome_da_carga)
+
+
+@app.route('/api/eventos/cargas')
+def eventos_de_todas_as_cargas():
+    """Eventos de todas as cargas de pedidos (tela de gestão)."""
+    return _resposta_sse("carga", eventos.TODAS)
+
+
+@app.route('/api/eventos/mapa/<numero_carga>')
+def eventos_do_mapa(numero_carga):
+    """Itens e grupos separados do mapa, ao vivo."""
+    return _resposta_sse("mapa", numero_carga)
+
 
 @app.route('/ping')
 def ping():
@@ -0,0 +1,225 @@
+# Arquivo: armazenamento.py
+# Armazenamento dos PDFs de pedido e fila persistente de uploads.
+#
+# O upload do PDF para o armazenamento remoto saiu do caminho crítico do
+# /api/upload: o pedido é salvo na hora com url_pdf NULL, o PDF entra na
+# tabela fila_uploads e uma thread em segundo plano envia e preenche a URL,
+# com novas tentativas em caso de falha.
+
+import os
+import logging
+import threading
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+MAX_TENTATIVAS = 8
+INTERVALO_FILA = 5          # segundos entre varreduras da fila quando ociosa
+ESPERA_MAXIMA = 3600        # teto do backoff entre tentativas (segundos)
+PRAZO_ENVIO = 600           # reserva de um item durante o envio (segundos)
+
+
+# ---------- Backends de armazenamento ----------
+class ArmazenamentoCloudinary:
+    """Envia os PDFs como 'raw' para o Cloudinary (configurado por CLOUDINARY_URL)."""
+    nome = "cloudinary"
+
+    def enviar(self, conteudo: bytes, chave: str) -> str:
+        import cloudinary.uploader
+        resultado = cloudinary.uploader.upload(conteudo, resource_type="raw", public_id=chave)
+        return resultado["secure_url"]
+
+
+class ArmazenamentoLocal:
+    """Grava os PDFs em um diretório local; útil para rodar o fluxo todo offline."""
+    nome = "local"
+
+    def __init__(self, diretorio: str, url_base: str = "/arquivos"):
+        self.diretorio = os.path.abspath(diretorio)
+        self.url_base = url_base.rstrip("/")
+
+    def caminho(self, chave: str) -> str:
+        caminho = os.path.abspath(os.path.join(self.diretorio, chave))
+        if not caminho.startswith(self.diretorio + os.sep):
+            raise ValueError(f"Chave de arquivo inválida: {chave}")
+        return caminho
+
+    def enviar(self, conteudo: bytes, chave: str) -> str:
+        caminho = self.caminho(chave)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        tmp = caminho + ".parcial"
+        with open(tmp, "wb") as f:
+            f.write(conteudo)
+        os.replace(tmp, caminho)
+        return f"{self.url_base}/{chave}"
+
+
+_armazenamento = None
+
+
+def obter_armazenamento():
+    """Backend escolhido por ARMAZENAMENTO_BACKEND ('cloudinary' por padrão, ou 'local')."""
+    global _armazenamento
+    if _armazenamento is None:
+        backend = os.environ.get("ARMAZENAMENTO_BACKEND", "cloudinary").strip().lower()
+        if backend == "local":
+            _armazenamento = ArmazenamentoLocal(os.environ.get("ARMAZENAMENTO_DIR", "/tmp/conferencia_arquivos"))
+        elif backend == "cloudinary":
+            _armazenamento = ArmazenamentoCloudinary()
+        else:
+            raise ValueError(f"ARMAZENAMENTO_BACKEND desconhecido: {backend}")
+    return _armazenamento
+
+
+# ---------- Fila persistente (tabela fila_uploads) ----------
+def enfileirar_upload(cur, numero_pedido: str, chave: str, conteudo: bytes):
+    """Coloca o PDF na fila. Deve rodar na mesma transação que salva o pedido."""
+    cur.execute(
+        "INSERT INTO fila_uploads (numero_pedido, chave, conteudo) VALUES (%s, %s, %s);",
+        (numero_pedido, chave, psycopg2.Binary(conteudo))
+    )
+
+
+def _espera_backoff(tentativas: int) -> int:
+    return min(ESPERA_MAXIMA, 5 * (2 ** tentativas))
+
+
+def _reservar(get_db_connection):
+    """
+    Pega o próximo PDF pendente e o reserva por PRAZO_ENVIO segundos
+    (proxima_tentativa avança e a tentativa já conta), numa transação curta.
+    SKIP LOCKED deixa vários workers do gunicorn drenarem a mesma fila sem
+    pegar o mesmo item; se o worker morrer no meio do envio, o item volta
+    sozinho quando o prazo vence.
+    """
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE fila_uploads
+               SET tentativas = tentativas + 1,
+                   proxima_tentativa = NOW() + make_interval(secs => %s)
+             WHERE id = (
+                   SELECT id FROM fila_uploads
+                    WHERE proxima_tentativa <= NOW() AND tentativas < %s
+                    ORDER BY id
+                    LIMIT 1
+                      FOR UPDATE SKIP LOCKED
+             )
+            RETURNING id, numero_pedido, chave, conteudo, tentativas;
+        """, (PRAZO_ENVIO, MAX_TENTATIVAS))
+        row = cur.fetchone()
+        conn.commit()
+        cur.close()
+        return row
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _registrar(get_db_connection, fila_id, numero_pedido, url=None, erro=None, tentativas=0):
+    """Grava o resultado do envio (URL no pedido, ou o erro e a próxima tentativa)."""
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        if url is not None:
+            cur.execute("UPDATE pedidos SET url_pdf = %s WHERE numero_pedido = %s;", (url, numero_pedido))
+            cur.execute("DELETE FROM fila_uploads WHERE id = %s;", (fila_id,))
+        else:
+            cur.execute("""
+                UPDATE fila_uploads
+                   SET ultimo_erro = %s, proxima_tentativa = NOW() + make_interval(secs => %s)
+                 WHERE id = %s;
+            """, (erro, _espera_backoff(tentativas), fila_id))
+        conn.commit()
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def processar_fila(get_db_connection, armazenamento=None, limite: int = 20) -> int:
+    """
+    Envia até `limite` PDFs pendentes. Cada item é reservado numa transação,
+    enviado sem transação nem conexão aberta (o envio pode levar segundos e
+    não deve segurar lock nem conexão do pool) e o resultado é gravado em
+    outra transação. Retorna quantos itens foram enviados com sucesso.
+    """
+    armazenamento = armazenamento or obter_armazenamento()
+    enviados = 0
+    for _ in range(limite):
+        row = _reservar(get_db_connection)
+        if not row:
+            break
+
+        fila_id, numero_pedido, chave, conteudo, tentativas = row
+        try:
+            url = armazenamento.enviar(bytes(conteudo), chave)
+        except Exception as e:
+            logger.warning(f"[Upload] Falha ao enviar {chave} (tentativa {tentativas}): {e}")
+            _registrar(get_db_connection, fila_id, numero_pedido, erro=str(e), tentativas=tentativas)
+            continue
+
+        _registrar(get_db_connection, fila_id, numero_pedido, url=url)
+        enviados += 1
+    return enviados
+
+
+def resumo_fila(cur) -> dict:
+    cur.execute("""
+        SELECT COUNT(*) FILTER (WHERE tentativas < %s),
+               COUNT(*) FILTER (WHERE tentativas >= %s),
+               MIN(criado_em) FILTER (WHERE tentativas < %s)
+          FROM fila_uploads;
+    """, (MAX_TENTATIVAS, MAX_TENTATIVAS, MAX_TENTATIVAS))
+    pendentes, desistidos, mais_antigo = cur.fetchone()
+    return {
+        "pendentes": pendentes,
+        "desistidos": desistidos,
+        "mais_antigo": mais_antigo.isoformat() if mais_antigo else None,
+    }
+
+
+# ---------- Thread de envio em segundo plano ----------
+class UploaderEmSegundoPlano(threading.Thread):
+    def __init__(self, get_db_connection, intervalo: float = INTERVALO_FILA):
+        super().__init__(name="uploader-pdfs", daemon=True)
+        self.get_db_connection = get_db_connection
+        self.intervalo = intervalo
+        self._acordar = threading.Event()
+
+    def acordar(self):
+        self._acordar.set()
+
+    def run(self):
+        while True:
+            try:
+                while processar_fila(self.get_db_connection):
+                    pass
+            except Exception as e:
+                logger.error(f"[Upload] Erro ao processar a fila: {e}", exc_info=True)
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+
+
+_uploader = None
+_uploader_pid = None
+_uploader_lock = threading.Lock()
+
+
+def iniciar_uploader(get_db_connection):
+    """Sobe (uma vez por processo) a thread que drena a fila e a acorda."""
+    global _uploader, _uploader_pid
+    with _uploader_lock:
+        # Threads não sobrevivem ao fork do gunicorn: recria no processo filho
+        if _uploader is None or _uploader_pid != os.getpid() or not _uploader.is_alive():
+            _uploader = UploaderEmSegundoPlano(get_db_connection)
+            _uploader_pid = os.getpid()
+            _uploader.start()
+    _uploader.acordar()
+    return _uploader
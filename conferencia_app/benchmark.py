@@ -0,0 +1,322 @@
+# Arquivo: benchmark.py
+# Medições de desempenho da extração de PDFs.
+#
+# Uso (a partir da raiz do repositório):
+#   python -m conferencia_app.benchmark pool pasta_com_pdfs/ [--workers 1 2 4 8] [--repetir 3]
+#   python -m conferencia_app.benchmark layout mapa_grande.pdf [--repetir 5]
+#   python -m conferencia_app.benchmark extracao [--paginas 1 5 20] [--parsers pedido mapa]
+#   python -m conferencia_app.benchmark golden [--atualizar]
+#
+# "extracao" e "golden" usam os PDFs sintéticos de pdf_sintetico.py. A
+# extração roda em um processo filho por parser, para o pico de memória
+# (ru_maxrss) ser só daquele parser. O golden compara a saída de cada parser
+# no corpus fixo com a gravada em conferencia_app/golden/.
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+
+try:
+    from conferencia_app.pool_extracao import extrair_em_paralelo, encerrar_pool
+    from conferencia_app.layout_pdf import LayoutPagina
+    from conferencia_app.parser_mapa import Y_LINE_TOLERANCE, parse_mapa, parse_mapa_paralelo
+    from conferencia_app.extrator_pedido import extrair_dados_do_pdf
+    from conferencia_app.extrator import extrator_finalissimo
+    from conferencia_app import pdf_sintetico
+except ImportError:
+    from pool_extracao import extrair_em_paralelo, encerrar_pool
+    from layout_pdf import LayoutPagina
+    from parser_mapa import Y_LINE_TOLERANCE, parse_mapa, parse_mapa_paralelo
+    from extrator_pedido import extrair_dados_do_pdf
+    from extrator import extrator_finalissimo
+    import pdf_sintetico
+
+PASTA_GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+
+
+def _carregar_pdfs(caminhos):
+    arquivos = []
+    for caminho in caminhos:
+        if os.path.isdir(caminho):
+            nomes = sorted(n for n in os.listdir(caminho) if n.lower().endswith(".pdf"))
+            arquivos.extend(os.path.join(caminho, n) for n in nomes)
+        else:
+            arquivos.append(caminho)
+    lidos = []
+    for caminho in arquivos:
+        with open(caminho, "rb") as f:
+            lidos.append((os.path.basename(caminho), f.read()))
+    return lidos
+
+
+def bench_pool(args):
+    arquivos = _carregar_pdfs(args.pdfs) * args.repetir
+    if not arquivos:
+        print("Nenhum PDF encontrado.")
+        return 1
+
+    print(f"{len(arquivos)} arquivo(s) por rodada")
+    print(f"{'workers':>8} {'segundos':>10} {'arquivos/s':>12} {'erros':>6}")
+    for n in args.workers:
+        # Aquecimento: sobe os processos do pool fora da medição
+        extrair_em_paralelo(arquivos[:n], "BENCH", max_workers=n)
+        inicio = time.perf_counter()
+        resultados = extrair_em_paralelo(arquivos, "BENCH", max_workers=n)
+        duracao = time.perf_counter() - inicio
+        erros = sum(1 for r in resultados if "erro" in r)
+        print(f"{n:>8} {duracao:>10.3f} {len(arquivos) / duracao:>12.1f} {erros:>6}")
+        encerrar_pool()
+    return 0
+
+
+def _linhas_referencia(pagina, tolerancia):
+    """Como o parser de mapa fazia antes do layout_pdf: get_text duas vezes e laço em Python."""
+    pagina.get_text("text")
+    words = pagina.get_text("words")
+    if not words:
+        return []
+    words.sort(key=lambda w: (w[1], w[0]))
+    lines, current_line, last_y = [], [words[0]], words[0][1]
+    for word in words[1:]:
+        if abs(word[1] - last_y) <= tolerancia:
+            current_line.append(word)
+        else:
+            lines.append(sorted(current_line, key=lambda w: w[0]))
+            current_line = [word]
+        last_y = word[1]
+    lines.append(sorted(current_line, key=lambda w: w[0]))
+    return lines
+
+
+def _linhas_layout(pagina, tolerancia):
+    layout = LayoutPagina(pagina)
+    layout.texto
+    return layout.palavras.linhas_encadeadas(tolerancia)
+
+
+def bench_layout(args):
+    """ms por página: agrupamento antigo x layout_pdf, no mesmo documento."""
+    for nome, conteudo in _carregar_pdfs(args.pdfs):
+        doc = fitz.open(stream=conteudo, filetype="pdf")
+        paginas = len(doc)
+        print(f"{nome}: {paginas} página(s)")
+        print(f"{'método':>12} {'ms/página':>10} {'linhas':>8}")
+        tempos = {}
+        for metodo, funcao in (("referência", _linhas_referencia), ("layout_pdf", _linhas_layout)):
+            melhor = None
+            for _ in range(args.repetir):
+                inicio = time.perf_counter()
+                linhas = sum(len(funcao(pagina, Y_LINE_TOLERANCE)) for pagina in doc)
+                duracao = time.perf_counter() - inicio
+                melhor = duracao if melhor is None else min(melhor, duracao)
+            tempos[metodo] = melhor
+            print(f"{metodo:>12} {1000 * melhor / paginas:>10.2f} {linhas:>8}")
+        print(f"{'ganho':>12} {tempos['referência'] / tempos['layout_pdf']:>9.2f}x")
+        doc.close()
+    return 0
+
+
+def _rodar_pedido(caminho):
+    with open(caminho, "rb") as f:
+        return extrair_dados_do_pdf(f.read(), "SINTETICA", os.path.basename(caminho))
+
+
+def _rodar_mapa(caminho, parse=parse_mapa):
+    header, _, grupos, itens = parse(caminho)
+    return {"header": header, "grupos": grupos, "itens": itens}
+
+
+def _rodar_mapa_paralelo(caminho):
+    return _rodar_mapa(caminho, parse_mapa_paralelo)
+
+
+def _acertos_pedido(resultado, gabarito):
+    esperados = {(p["codigo_barras"], p["produto_nome"], p["quantidade_pedida"]) for p in gabarito["produtos"]}
+    return sum(1 for p in resultado.get("produtos", [])
+               if (p["codigo_barras"], p["produto_nome"], p["quantidade_pedida"]) in esperados)
+
+
+def _acertos_finalissimo(resultado, gabarito):
+    # O extrator antigo não devolve o código de barras
+    esperados = {(p["produto_nome"], p["quantidade_pedida"]) for p in gabarito["produtos"]}
+    return sum(1 for p in resultado.get("produtos", []) if (p["produto"], p["quantidade_pedida"]) in esperados)
+
+
+def _acertos_mapa(resultado, gabarito):
+    campos = ("grupo_codigo", "cod_barras", "codigo", "descricao", "qtd_unidades", "pack_qtd")
+    esperados = {tuple(i[c] for c in campos) for i in gabarito["itens"]}
+    return sum(1 for i in resultado["itens"] if tuple(i.get(c) for c in campos) in esperados)
+
+
+# nome: (tipo de PDF, executa(caminho), itens(resultado), acertos(resultado, gabarito))
+# No mapa_paralelo o pico de RSS medido é só o do processo que junta as páginas.
+PARSERS = {
+    "pedido": ("pedido", _rodar_pedido, lambda r: r.get("produtos", []), _acertos_pedido),
+    "finalissimo": ("pedido", extrator_finalissimo, lambda r: r.get("produtos", []), _acertos_finalissimo),
+    "mapa": ("mapa", _rodar_mapa, lambda r: r["itens"], _acertos_mapa),
+    "mapa_paralelo": ("mapa", _rodar_mapa_paralelo, lambda r: r["itens"], _acertos_mapa),
+}
+
+# Parsers que têm que dar exatamente a saída de outro: conferem com o golden dele
+MESMO_GOLDEN = {"mapa_paralelo": "mapa"}
+
+
+def _medir_parser(nome_parser, caminho, repetir, fila):
+    """Roda no processo filho: melhor tempo de N rodadas e o pico de memória."""
+    _, executar, _, _ = PARSERS[nome_parser]
+    rss_antes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    melhor, resultado = None, None
+    for _ in range(repetir):
+        inicio = time.perf_counter()
+        resultado = executar(caminho)
+        duracao = time.perf_counter() - inicio
+        melhor = duracao if melhor is None else min(melhor, duracao)
+    rss_pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    fila.put((melhor, resultado, rss_antes, rss_pico))
+
+
+def bench_extracao(args):
+    """páginas/s, itens/s, acerto e pico de RSS de cada parser nos PDFs sintéticos."""
+    contexto = multiprocessing.get_context("spawn")
+    if args.workers is not None:
+        # Lido por numero_de_workers() no processo filho
+        os.environ["EXTRACAO_WORKERS"] = str(args.workers)
+    print(f"{'parser':>12} {'páginas':>8} {'itens':>6} {'ms':>9} {'págs/s':>8} {'itens/s':>9} "
+          f"{'acerto':>7} {'RSS MB':>7} {'+MB':>6}")
+    with tempfile.TemporaryDirectory(prefix="bench_extracao_") as pasta:
+        for nome_parser in args.parsers:
+            tipo, _, itens_de, acertos_de = PARSERS[nome_parser]
+            for paginas in args.paginas:
+                opcoes = {"paginas": paginas, "semente": args.semente}
+                if args.itens is not None:
+                    opcoes["itens_por_pagina"] = args.itens
+                conteudo, gabarito = pdf_sintetico.GERADORES[tipo](**opcoes)
+                caminho = os.path.join(pasta, f"{tipo}_{paginas}.pdf")
+                with open(caminho, "wb") as f:
+                    f.write(conteudo)
+
+                fila = contexto.Queue()
+                processo = contexto.Process(target=_medir_parser, args=(nome_parser, caminho, args.repetir, fila))
+                processo.start()
+                segundos, resultado, rss_antes, rss_pico = fila.get()
+                processo.join()
+
+                if "erro" in resultado:
+                    print(f"{nome_parser:>12} {paginas:>8} erro: {resultado['erro'].splitlines()[0]}")
+                    continue
+                itens = len(itens_de(resultado))
+                esperados = len(gabarito.get("produtos") or gabarito.get("itens"))
+                acerto = acertos_de(resultado, gabarito) / esperados if esperados else 0
+                # ru_maxrss vem em KB no Linux
+                print(f"{nome_parser:>12} {paginas:>8} {itens:>6} {1000 * segundos:>9.1f} {paginas / segundos:>8.1f} "
+                      f"{itens / segundos:>9.0f} {acerto:>7.1%} {rss_pico / 1024:>7.1f} "
+                      f"{(rss_pico - rss_antes) / 1024:>6.1f}")
+    return 0
+
+
+def _arquivo_golden(nome_corpus, nome_parser):
+    return os.path.join(PASTA_GOLDEN, f"{nome_corpus}.{nome_parser}.json")
+
+
+def _primeira_diferenca(esperado, obtido, caminho="saida"):
+    """Onde as duas estruturas começam a divergir, para a mensagem do golden."""
+    if type(esperado) is not type(obtido):
+        return f"{caminho}: {esperado!r} -> {obtido!r}"
+    if isinstance(esperado, dict):
+        for chave in sorted(set(esperado) | set(obtido)):
+            if chave not in esperado or chave not in obtido:
+                return f"{caminho}.{chave}: só em {'obtido' if chave in obtido else 'golden'}"
+            diferenca = _primeira_diferenca(esperado[chave], obtido[chave], f"{caminho}.{chave}")
+            if diferenca:
+                return diferenca
+        return None
+    if isinstance(esperado, list):
+        for i, (a, b) in enumerate(zip(esperado, obtido)):
+            diferenca = _primeira_diferenca(a, b, f"{caminho}[{i}]")
+            if diferenca:
+                return diferenca
+        if len(esperado) != len(obtido):
+            return f"{caminho}: {len(esperado)} -> {len(obtido)} elementos"
+        return None
+    return None if esperado == obtido else f"{caminho}: {esperado!r} -> {obtido!r}"
+
+
+def bench_golden(args):
+    """Compara a saída dos parsers no corpus fixo com a gravada (ou regrava com --atualizar)."""
+    falhas = 0
+    os.makedirs(PASTA_GOLDEN, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="golden_") as pasta:
+        for nome_corpus, tipo, paginas, itens_por_pagina, semente in pdf_sintetico.CORPUS:
+            conteudo, _ = pdf_sintetico.GERADORES[tipo](paginas, itens_por_pagina, semente)
+            caminho = os.path.join(pasta, f"{nome_corpus}.pdf")
+            with open(caminho, "wb") as f:
+                f.write(conteudo)
+            for nome_parser, (tipo_parser, executar, _, _) in PARSERS.items():
+                if tipo_parser != tipo:
+                    continue
+                # Ida e volta pelo JSON: tuplas viram listas, como no arquivo gravado
+                obtido = json.loads(json.dumps(executar(caminho), ensure_ascii=False))
+                arquivo = _arquivo_golden(nome_corpus, MESMO_GOLDEN.get(nome_parser, nome_parser))
+                if args.atualizar and nome_parser not in MESMO_GOLDEN:
+                    with open(arquivo, "w", encoding="utf-8") as f:
+                        json.dump(obtido, f, ensure_ascii=False, indent=1, sort_keys=True)
+                        f.write("\n")
+                    print(f"gravado   {nome_corpus} / {nome_parser}")
+                    continue
+                if not os.path.exists(arquivo):
+                    print(f"SEM GOLDEN {nome_corpus} / {nome_parser} (rode com --atualizar)")
+                    falhas += 1
+                    continue
+                with open(arquivo, encoding="utf-8") as f:
+                    esperado = json.load(f)
+                diferenca = _primeira_diferenca(esperado, obtido)
+                if diferenca:
+                    print(f"DIFERENTE {nome_corpus} / {nome_parser}: {diferenca}")
+                    falhas += 1
+                else:
+                    print(f"ok        {nome_corpus} / {nome_parser}")
+    return 1 if falhas else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de extração de PDFs")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_pool = sub.add_parser("pool", help="arquivos/s do pool de extração de pedidos")
+    p_pool.add_argument("pdfs", nargs="+", help="PDFs de pedido ou pastas com PDFs")
+    p_pool.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    p_pool.add_argument("--repetir", type=int, default=1, help="repete a lista de arquivos N vezes")
+    p_pool.set_defaults(func=bench_pool)
+
+    p_layout = sub.add_parser("layout", help="ms/página do agrupamento de palavras em linhas")
+    p_layout.add_argument("pdfs", nargs="+", help="PDFs (mapas grandes mostram melhor a diferença)")
+    p_layout.add_argument("--repetir", type=int, default=5, help="usa a melhor de N rodadas")
+    p_layout.set_defaults(func=bench_layout)
+
+    p_extracao = sub.add_parser("extracao", help="páginas/s, itens/s e pico de RSS de cada parser (PDFs sintéticos)")
+    p_extracao.add_argument("--parsers", nargs="+", choices=sorted(PARSERS), default=sorted(PARSERS))
+    p_extracao.add_argument("--paginas", type=int, nargs="+", default=[1, 5, 20])
+    p_extracao.add_argument("--itens", type=int, default=None, help="itens por página (padrão do gerador)")
+    p_extracao.add_argument("--semente", type=int, default=0)
+    p_extracao.add_argument("--repetir", type=int, default=3, help="usa a melhor de N rodadas")
+    p_extracao.add_argument("--workers", type=int, default=None,
+                            help="processos do mapa_paralelo (padrão EXTRACAO_WORKERS ou nº de núcleos)")
+    p_extracao.set_defaults(func=bench_extracao)
+
+    p_golden = sub.add_parser("golden", help="confere a saída dos parsers com conferencia_app/golden")
+    p_golden.add_argument("--atualizar", action="store_true", help="regrava os arquivos com a saída atual")
+    p_golden.set_defaults(func=bench_golden)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+# Arquivo: cache_parse.py
+# Cache do resultado da extração de PDFs (pedidos e mapas), indexado pelo
+# SHA-256 do conteúdo. O mesmo PDF reenviado (motorista reenviando a carga,
+# gestão refazendo um upload que falhou) não passa de novo pelo PyMuPDF.
+#
+# Cada entrada guarda a versão do parser que a gerou: ao mudar o parser,
+# basta subir VERSAO_EXTRATOR / VERSAO_PARSER e as entradas antigas viram miss.
+
+import os
+import json
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+MAX_BYTES_PADRAO = 200 * 1024 * 1024
+
+# Mapas maiores que isso não vão para o cache: as páginas passam direto
+# para a gravação, sem o documento inteiro ficar em memória
+try:
+    MAX_PAGINAS_MAPA = int(os.environ.get("CACHE_PARSE_MAX_PAGINAS", "40"))
+except ValueError:
+    MAX_PAGINAS_MAPA = 40
+
+# Entrada página a página do iterar_mapa_com_cache (a de "mapa" é a tupla do parse_mapa)
+TIPO_MAPA_PAGINAS = "mapa_paginas"
+
+
+def sha256_de(conteudo: bytes) -> str:
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+class _Contadores:
+    """Hits/misses por tipo de documento, no processo atual."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.valores = {}
+
+    def somar(self, tipo: str, campo: str):
+        with self._lock:
+            por_tipo = self.valores.setdefault(tipo, {"hits": 0, "misses": 0, "gravados": 0})
+            por_tipo[campo] += 1
+
+    def copia(self) -> dict:
+        with self._lock:
+            return {tipo: dict(v) for tipo, v in self.valores.items()}
+
+
+class CachePostgres:
+    """Entradas na tabela cache_parse, com despejo das menos usadas por tamanho total."""
+    nome = "postgres"
+
+    def __init__(self, get_db_connection, max_bytes: int = MAX_BYTES_PADRAO):
+        self.get_db_connection = get_db_connection
+        self.max_bytes = max_bytes
+
+    def obter(self, sha256: str, tipo: str, versao: str):
+        conn = self.get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE cache_parse SET usado_em = NOW()
+                 WHERE sha256 = %s AND tipo = %s AND versao = %s
+             RETURNING resultado;
+            """, (sha256, tipo, versao))
+            row = cur.fetchone()
+            conn.commit()
+            cur.close()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def guardar(self, sha256: str, tipo: str, versao: str, resultado):
+        dados = json.dumps(resultado, ensure_ascii=False)
+        conn = self.get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO cache_parse (sha256, tipo, versao, resultado, tamanho)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (sha256, tipo) DO UPDATE
+                   SET versao = EXCLUDED.versao, resultado = EXCLUDED.resultado,
+                       tamanho = EXCLUDED.tamanho, criado_em = NOW(), usado_em = NOW();
+            """, (sha256, tipo, versao, dados, len(dados.encode("utf-8"))))
+            # Despeja as entradas menos usadas que passarem do limite de tamanho
+            cur.execute("""
+                DELETE FROM cache_parse c
+                 USING (
+                    SELECT sha256, tipo,
+                           SUM(tamanho) OVER (ORDER BY usado_em DESC, sha256) AS acumulado
+                      FROM cache_parse
+                 ) t
+                 WHERE c.sha256 = t.sha256 AND c.tipo = t.tipo AND t.acumulado > %s;
+            """, (self.max_bytes,))
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+
+    def resumo(self) -> dict:
+        conn = self.get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT COUNT(*), COALESCE(SUM(tamanho), 0) FROM cache_parse;")
+            entradas, tamanho = cur.fetchone()
+            cur.close()
+            return {"entradas": entradas, "bytes": int(tamanho)}
+        finally:
+            conn.close()
+
+    def limpar(self):
+        conn = self.get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM cache_parse;")
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+
+
+class CacheDisco:
+    """Um arquivo JSON por entrada; despeja pela data de último uso (mtime)."""
+    nome = "disco"
+
+    def __init__(self, diretorio: str, max_bytes: int = MAX_BYTES_PADRAO):
+        self.diretorio = diretorio
+        self.max_bytes = max_bytes
+        os.makedirs(diretorio, exist_ok=True)
+
+    def _caminho(self, sha256: str, tipo: str) -> str:
+        return os.path.join(self.diretorio, f"{tipo}-{sha256}.json")
+
+    def obter(self, sha256: str, tipo: str, versao: str):
+        caminho = self._caminho(sha256, tipo)
+        try:
+            with open(caminho, "r", encoding="utf-8") as f:
+                entrada = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entrada.get("versao") != versao:
+            return None
+        try:
+            os.utime(caminho)
+        except OSError:
+            pass
+        return entrada.get("resultado")
+
+    def guardar(self, sha256: str, tipo: str, versao: str, resultado):
+        caminho = self._caminho(sha256, tipo)
+        tmp = f"{caminho}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"versao": versao, "resultado": resultado}, f, ensure_ascii=False)
+        os.replace(tmp, caminho)
+        self._despejar()
+
+    def _entradas(self):
+        entradas = []
+        for item in os.scandir(self.diretorio):
+            if item.is_file() and item.name.endswith(".json"):
+                st = item.stat()
+                entradas.append((st.st_mtime, st.st_size, item.path))
+        return entradas
+
+    def _despejar(self):
+        entradas = self._entradas()
+        total = sum(tamanho for _, tamanho, _ in entradas)
+        for _, tamanho, caminho in sorted(entradas):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(caminho)
+                total -= tamanho
+            except OSError:
+                pass
+
+    def resumo(self) -> dict:
+        entradas = self._entradas()
+        return {"entradas": len(entradas), "bytes": sum(tamanho for _, tamanho, _ in entradas)}
+
+    def limpar(self):
+        for _, _, caminho in self._entradas():
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+
+
+class CacheParse:
+    """Fachada usada pelo app: conta hits/misses e nunca deixa uma falha do cache derrubar o upload."""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.contadores = _Contadores()
+
+    def obter(self, sha256: str, tipo: str, versao: str):
+        if self.backend is None:
+            return None
+        try:
+            resultado = self.backend.obter(sha256, tipo, versao)
+        except Exception as e:
+            logger.warning(f"[Cache] Falha ao ler {tipo} {sha256[:12]}: {e}")
+            resultado = None
+        self.contadores.somar(tipo, "hits" if resultado is not None else "misses")
+        return resultado
+
+    def guardar(self, sha256: str, tipo: str, versao: str, resultado):
+        if self.backend is None:
+            return
+        try:
+            self.backend.guardar(sha256, tipo, versao, resultado)
+            self.contadores.somar(tipo, "gravados")
+        except Exception as e:
+            logger.warning(f"[Cache] Falha ao gravar {tipo} {sha256[:12]}: {e}")
+
+    def estatisticas(self) -> dict:
+        dados = {"backend": self.backend.nome if self.backend else "desligado",
+                 "contadores": self.contadores.copia()}
+        if self.backend is not None:
+            try:
+                dados.update(self.backend.resumo())
+            except Exception as e:
+                dados["erro"] = str(e)
+        return dados
+
+    def limpar(self):
+        if self.backend is not None:
+            self.backend.limpar()
+
+
+def criar_cache(get_db_connection) -> CacheParse:
+    """
+    Monta o cache a partir do ambiente:
+    CACHE_PARSE_BACKEND = postgres (padrão) | disco | desligado
+    CACHE_PARSE_DIR (para 'disco') e CACHE_PARSE_MAX_MB (limite total).
+    CACHE_PARSE_MAX_PAGINAS (maior mapa guardado) é lido na importação.
+    """
+    backend = os.environ.get("CACHE_PARSE_BACKEND", "postgres").strip().lower()
+    try:
+        max_bytes = int(float(os.environ.get("CACHE_PARSE_MAX_MB", "200")) * 1024 * 1024)
+    except ValueError:
+        max_bytes = MAX_BYTES_PADRAO
+
+    if backend == "postgres":
+        return CacheParse(CachePostgres(get_db_connection, max_bytes))
+    if backend == "disco":
+        return CacheParse(CacheDisco(os.environ.get("CACHE_PARSE_DIR", "/tmp/conferencia_cache_parse"), max_bytes))
+    if backend == "desligado":
+        return CacheParse(None)
+    raise ValueError(f"CACHE_PARSE_BACKEND desconhecido: {backend}")
+
+
+# ---------- Uso pelos uploads ----------
+# Campos que dependem da requisição e não do conteúdo do PDF
+_CAMPOS_DO_UPLOAD = ("nome_da_carga", "nome_arquivo")
+
+
+def extrair_pedidos_com_cache(cache: CacheParse, arquivos, nome_da_carga, extrair_lote, versao: str):
+    """
+    Resolve pelo cache o que já foi extraído e manda só os misses para
+    `extrair_lote(arquivos, nome_da_carga)`. Mantém a ordem de `arquivos`.
+    """
+    resultados = [None] * len(arquivos)
+    hashes = [sha256_de(pdf_bytes) for _, pdf_bytes in arquivos]
+    faltando = []
+    for i, (nome_arquivo, _) in enumerate(arquivos):
+        guardado = cache.obter(hashes[i], "pedido", versao)
+        if guardado is None:
+            faltando.append(i)
+        else:
+            resultados[i] = {**guardado, "nome_da_carga": nome_da_carga, "nome_arquivo": nome_arquivo}
+
+    if faltando:
+        extraidos = extrair_lote([arquivos[i] for i in faltando], nome_da_carga)
+        for i, dados in zip(faltando, extraidos):
+            resultados[i] = dados
+            if "erro" not in dados:
+                cache.guardar(hashes[i], "pedido", versao,
+                              {k: v for k, v in dados.items() if k not in _CAMPOS_DO_UPLOAD})
+    return resultados
+
+
+def parse_mapa_com_cache(cache: CacheParse, pdf_bytes: bytes, parse, versao: str):
+    """`parse(pdf_bytes)` devolve (header, extra, grupos, itens), como parse_mapa."""
+    sha = sha256_de(pdf_bytes)
+    guardado = cache.obter(sha, "mapa", versao)
+    if guardado is not None:
+        return tuple(guardado)
+    resultado = parse(pdf_bytes)
+    cache.guardar(sha, "mapa", versao, list(resultado))
+    return resultado
+
+
+def iterar_mapa_com_cache(cache: CacheParse, pdf_bytes: bytes, iterar, versao: str,
+                          max_paginas: int = None):
+    """
+    Versão página a página: `iterar(pdf_bytes)` rende as páginas como
+    parser_mapa.iterar_mapa. Num miss as páginas são repassadas conforme
+    chegam; só mapas de até `max_paginas` páginas (CACHE_PARSE_MAX_PAGINAS)
+    são guardados, e só se o documento for lido até o fim. Acima disso as
+    páginas já lidas são descartadas e o resto passa sem ficar em memória.
+    Num hit as páginas guardadas saem uma a uma, como no parser.
+    """
+    if max_paginas is None:
+        max_paginas = MAX_PAGINAS_MAPA
+    sha = sha256_de(pdf_bytes)
+    guardado = cache.obter(sha, TIPO_MAPA_PAGINAS, versao)
+    if guardado is not None:
+        yield from guardado
+        return
+    paginas = []
+    for pagina in iterar(pdf_bytes):
+        if paginas is not None:
+            if len(paginas) < max_paginas:
+                paginas.append(pagina)
+            else:
+                paginas = None
+        yield pagina
+    if paginas is not None:
+        cache.guardar(sha, TIPO_MAPA_PAGINAS, versao, paginas)
@@ -0,0 +1,229 @@
+# Arquivo: eventos.py
+# Eventos ao vivo (Server-Sent Events) das cargas de pedidos e dos mapas.
+#
+# Quem grava chama notificar(cur, ...) dentro da própria transação: é um
+# pg_notify, entregue pelo Postgres só no commit (e descartado no rollback).
+# Cada processo do gunicorn tem uma thread com uma conexão em LISTEN que
+# recebe todos os eventos e repassa para as filas dos navegadores conectados
+# àquela carga/mapa. Assim o quadro dos supervisores se atualiza com deltas
+# pequenos, sem ninguém ficar consultando o banco em loop.
+#
+# Cada stream aberto prende uma thread do worker gthread por até
+# DURACAO_MAXIMA. Para os streams não tomarem todas as threads (lista de
+# pedidos, gestão e mapa abrem um cada), cada processo aceita no máximo
+# SSE_MAX_STREAMS ao mesmo tempo; acima disso a rota responde 503 com
+# Retry-After e a página tenta de novo depois. Em servidor sem threads
+# (worker sync) a rota não abre stream nenhum: sempre 503. Os workers gthread
+# e as threads ficam no gunicorn.conf.py da raiz, onde o wsgi:app sobe.
+
+import os
+import json
+import time
+import queue
+import select
+import logging
+import threading
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+CANAL = "conferencia_eventos"
+TAMANHO_FILA = 500          # eventos por navegador antes de mandar recarregar
+INTERVALO_PING = 15         # segundos entre comentários de keep-alive
+DURACAO_MAXIMA = 300        # o stream fecha e o EventSource reconecta sozinho
+ESPERA_RECONEXAO = 5        # segundos antes de refazer o LISTEN se cair
+TODAS = "*"                 # chave de quem acompanha todas as cargas/mapas (gestão)
+LIMITE_PAYLOAD = 7000       # bytes por pg_notify (o Postgres recusa acima de 8000)
+ESPERA_OCUPADO = 30         # segundos que o navegador espera quando não há vaga de stream
+
+
+def notificar(cur, escopo, chave, evento, dados):
+    """
+    Publica um evento para quem acompanha `escopo` ("carga" ou "mapa") `chave`.
+    Só sai no commit da transação de `cur`.
+    """
+    if chave is None:
+        return
+    payload = json.dumps({"escopo": escopo, "chave": str(chave), "evento": evento, "dados": dados},
+                         ensure_ascii=False, default=str)
+    cur.execute("SELECT pg_notify(%s, %s);", (CANAL, payload))
+
+
+def notificar_lista(cur, escopo, chave, evento, campo, lista):
+    """
+    Como notificar, para uma lista grande (ex.: itens gravados em lote): sai
+    em quantos eventos forem precisos para cada payload caber no pg_notify,
+    cada um com {campo: [parte da lista]}.
+    """
+    parte, tamanho = [], 0
+    for elemento in lista:
+        tamanho_elemento = len(json.dumps(elemento, ensure_ascii=False, default=str).encode()) + 1
+        if parte and tamanho + tamanho_elemento > LIMITE_PAYLOAD:
+            notificar(cur, escopo, chave, evento, {campo: parte})
+            parte, tamanho = [], 0
+        parte.append(elemento)
+        tamanho += tamanho_elemento
+    if parte:
+        notificar(cur, escopo, chave, evento, {campo: parte})
+
+
+class Assinatura:
+    """Fila de eventos de um navegador conectado."""
+
+    def __init__(self, escopo, chave):
+        self.escopo = escopo
+        self.chave = str(chave)
+        self.fila = queue.Queue(maxsize=TAMANHO_FILA)
+        self.transbordou = False
+
+    def entregar(self, mensagem):
+        try:
+            self.fila.put_nowait(mensagem)
+        except queue.Full:
+            # Cliente lento: em vez de acumular, pede para ele recarregar tudo
+            self.transbordou = True
+
+
+class Ouvinte(threading.Thread):
+    """Thread do processo que escuta o canal e distribui para as assinaturas."""
+
+    def __init__(self, dsn):
+        super().__init__(name="ouvinte-eventos", daemon=True)
+        self.dsn = dsn
+        self._lock = threading.Lock()
+        self._assinaturas = {}
+        self._ja_conectou = False
+
+    def assinar(self, escopo, chave):
+        assinatura = Assinatura(escopo, chave)
+        with self._lock:
+            self._assinaturas.setdefault((assinatura.escopo, assinatura.chave), set()).add(assinatura)
+        return assinatura
+
+    def cancelar(self, assinatura):
+        with self._lock:
+            grupo = self._assinaturas.get((assinatura.escopo, assinatura.chave))
+            if grupo:
+                grupo.discard(assinatura)
+                if not grupo:
+                    del self._assinaturas[(assinatura.escopo, assinatura.chave)]
+
+    def total_assinaturas(self):
+        with self._lock:
+            return sum(len(g) for g in self._assinaturas.values())
+
+    def _distribuir(self, payload):
+        try:
+            mensagem = json.loads(payload)
+        except ValueError:
+            return
+        escopo = mensagem.get("escopo")
+        with self._lock:
+            destino = list(self._assinaturas.get((escopo, mensagem.get("chave")), ()))
+            destino += self._assinaturas.get((escopo, TODAS), ())
+        for assinatura in destino:
+            assinatura.entregar(mensagem)
+
+    def _escutar(self):
+        conn = psycopg2.connect(self.dsn)
+        try:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cur = conn.cursor()
+            cur.execute(f"LISTEN {CANAL};")
+            if self._ja_conectou:
+                # Eventos podem ter se perdido enquanto estava desconectado
+                with self._lock:
+                    for grupo in self._assinaturas.values():
+                        for assinatura in grupo:
+                            assinatura.transbordou = True
+            self._ja_conectou = True
+            while True:
+                if select.select([conn], [], [], INTERVALO_PING) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self._distribuir(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+    def run(self):
+        while True:
+            try:
+                self._escutar()
+            except Exception as e:
+                logger.warning(f"[Eventos] LISTEN caiu, reconectando em {ESPERA_RECONEXAO}s: {e}")
+            time.sleep(ESPERA_RECONEXAO)
+
+
+_ouvinte = None
+_ouvinte_pid = None
+_ouvinte_lock = threading.Lock()
+
+
+def obter_ouvinte():
+    """Sobe (uma vez por processo, sob demanda) a thread que faz o LISTEN."""
+    global _ouvinte, _ouvinte_pid
+    with _ouvinte_lock:
+        # Threads não sobrevivem ao fork do gunicorn: recria no processo filho
+        if _ouvinte is None or _ouvinte_pid != os.getpid() or not _ouvinte.is_alive():
+            _ouvinte = Ouvinte(os.environ.get('DATABASE_URL'))
+            _ouvinte_pid = os.getpid()
+            _ouvinte.start()
+    return _ouvinte
+
+
+def _max_streams():
+    try:
+        return max(0, int(os.environ.get("SSE_MAX_STREAMS", 4)))
+    except ValueError:
+        return 4
+
+
+_vagas = None
+_vagas_pid = None
+_vagas_lock = threading.Lock()
+
+
+def reservar_stream():
+    """Ocupa uma vaga de stream deste processo. False se estiverem todas em uso."""
+    global _vagas, _vagas_pid
+    with _vagas_lock:
+        # Como o ouvinte, o contador é por processo: recria no filho do fork
+        if _vagas is None or _vagas_pid != os.getpid():
+            _vagas = threading.BoundedSemaphore(_max_streams()) if _max_streams() else None
+            _vagas_pid = os.getpid()
+        vagas = _vagas
+    return vagas is not None and vagas.acquire(blocking=False)
+
+
+def liberar_stream():
+    with _vagas_lock:
+        vagas = _vagas if _vagas_pid == os.getpid() else None
+    if vagas is not None:
+        vagas.release()
+
+
+def _formatar(evento, dados):
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False, default=str)}\n\n"
+
+
+def fluxo_sse(escopo, chave):
+    """Gerador com o corpo text/event-stream de uma carga ou mapa."""
+    ouvinte = obter_ouvinte()
+    assinatura = ouvinte.assinar(escopo, chave)
+    fim = time.monotonic() + DURACAO_MAXIMA
+    try:
+        yield "retry: 3000\n\n"
+        while time.monotonic() < fim:
+            if assinatura.transbordou:
+                yield _formatar("recarregar", {})
+                return
+            try:
+                mensagem = assinatura.fila.get(timeout=INTERVALO_PING)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            yield _formatar(mensagem["evento"], mensagem["dados"])
+    finally:
+        ouvinte.cancelar(assinatura)
@@ -0,0 +1,193 @@
+# Arquivo: extrator_pedido.py
+# Extração dos dados de um PDF de pedido. Fica num módulo próprio (sem Flask
+# e sem banco) para poder ser executado nos processos do pool de extração.
+
+import re
+
+import fitz  # PyMuPDF
+import numpy as np
+
+try:
+    from conferencia_app.layout_pdf import LayoutPagina
+except ImportError:
+    from .layout_pdf import LayoutPagina
+
+# Versão do extrator: gravada junto com o resultado no cache_parse.
+# Suba o número sempre que uma mudança alterar a saída de extrair_dados_do_pdf.
+VERSAO_EXTRATOR = "1"
+
+# Colunas da tabela de produtos, pela posição x0 de cada palavra
+COL_BARRAS, COL_NOME, COL_QUANTIDADE, COL_VALORES = range(4)
+Y_TOLERANCIA_LINHA = 5
+
+
+def _colunas_da_tabela(x0):
+    """Mesmas faixas de sempre: 40 < x0 < 100 barras, < 340 nome, < 450 quantidade, resto valores."""
+    return np.select(
+        [(x0 > 40) & (x0 < 100), x0 < 340, x0 < 450],
+        [COL_BARRAS, COL_NOME, COL_QUANTIDADE],
+        default=COL_VALORES
+    )
+
+def extrair_dados_do_pdf(stream, nome_da_carga, nome_arquivo):
+    try:
+        documento = fitz.open(stream=stream, filetype="pdf")
+        produtos_finais = []
+        dados_cabecalho = {}
+        
+        inicio_extracao = False
+
+        for i, pagina in enumerate(documento):
+            layout = LayoutPagina(pagina)
+            if i == 0:
+                def extrair_campo_regex(pattern, text):
+                    match = re.search(pattern, text, re.DOTALL)
+                    return match.group(1).replace('\n', ' ').strip() if match else "N/E"
+
+                texto_completo_pagina = layout.texto
+                numero_pedido = extrair_campo_regex(r"Pedido:\s*(\d+)", texto_completo_pagina)
+                if numero_pedido == "N/E":
+                    numero_pedido = extrair_campo_regex(r"Pedido\s+(\d+)", texto_completo_pagina)
+
+                nome_cliente = extrair_campo_regex(r"Cliente:\s*(.*?)(?:\s*Cond\. Pgto:|\n)", texto_completo_pagina)
+
+                vendedor = "N/E"
+                try:
+                    vendedor_rect_list = pagina.search_for("Vendedor")
+                    if vendedor_rect_list:
+                        vendedor_rect = vendedor_rect_list[0]
+                        search_area = fitz.Rect(
+                            vendedor_rect.x0 - 15,
+                            vendedor_rect.y1,
+                            vendedor_rect.x1 + 15,
+                            vendedor_rect.y1 + 20
+                        )
+                        # TextPage própria de propósito: com clip o PyMuPDF
+                        # recorta diferente de filtrar as palavras da página
+                        vendedor_words = pagina.get_text("words", clip=search_area)
+                        if vendedor_words:
+                            vendedor = vendedor_words[0][4]
+                except Exception:
+                    vendedor = extrair_campo_regex(r"Vendedor\s*([A-ZÀ-Ú]+)", texto_completo_pagina)
+
+                dados_cabecalho = {
+                    "numero_pedido": numero_pedido,
+                    "nome_cliente": nome_cliente,
+                    "vendedor": vendedor
+                }
+
+            tabela = layout.palavras
+            if not len(tabela):
+                continue
+            textos = tabela.texto
+            coluna = _colunas_da_tabela(tabela.x0).tolist()
+
+            for linha in tabela.linhas_ancoradas(Y_TOLERANCIA_LINHA):
+                palavras_linha = linha.tolist()
+                texto_linha = " ".join([textos[p] for p in palavras_linha])
+                if "ITEM CÓD. BARRAS" in texto_linha:
+                    inicio_extracao = True
+                    continue
+                elif "**POR GENTILEZA" in texto_linha:
+                    inicio_extracao = False
+                    continue
+                if not inicio_extracao:
+                    continue
+
+                product_chunks = []
+                current_chunk = []
+                if len(palavras_linha) > 1 and textos[palavras_linha[0]].isdigit() and len(textos[palavras_linha[0]]) <= 2:
+                    current_chunk.append(palavras_linha[0])
+                    for k in range(1, len(palavras_linha)):
+                        word_info = palavras_linha[k]
+                        word_text = textos[word_info]
+                        is_start_of_new_product = False
+                        if (
+                            word_text.isdigit()
+                            and len(word_text) <= 2
+                            and k + 1 < len(palavras_linha)
+                            and textos[palavras_linha[k + 1]].isdigit()
+                            and len(textos[palavras_linha[k + 1]]) > 5
+                        ):
+                            is_start_of_new_product = True
+                        if is_start_of_new_product:
+                            product_chunks.append(current_chunk)
+                            current_chunk = []
+                        current_chunk.append(word_info)
+                    product_chunks.append(current_chunk)
+                else:
+                    product_chunks.append(palavras_linha)
+
+                for chunk in product_chunks:
+                    barcode_parts = []
+                    nome_produto_parts = []
+                    quantidade_parts = []
+                    valores_parts = []
+
+                    partes = (barcode_parts, nome_produto_parts, quantidade_parts, valores_parts)
+                    for p in chunk:
+                        partes[coluna[p]].append(textos[p])
+
+                    if not nome_produto_parts:
+                        continue
+                    
+                    # ===== CORREÇÃO CIRÚRGICA =====
+                    # Move palavras não-numéricas do início da lista de quantidade de volta para o nome do produto.
+                    # Isso corrige o problema de "PI" ou "ACI" entrarem na quantidade.
+                    while quantidade_parts and not quantidade_parts[0].replace(',', '').replace('.', '').isdigit():
+                        palavra_movida = quantidade_parts.pop(0)
+                        nome_produto_parts.append(palavra_movida)
+                    # ==============================
+
+                    codigo_barras_final = "".join(barcode_parts)
+
+                    if (
+                        len(nome_produto_parts) > 2
+                        and nome_produto_parts[0].isdigit()
+                        and len(nome_produto_parts[0]) <= 2
+                    ):
+                        nome_produto_final = " ".join(nome_produto_parts[1:])
+                    else:
+                        nome_produto_final = " ".join(nome_produto_parts)
+
+                    quantidade_completa_str = " ".join(quantidade_parts)
+
+                    valor_total_item = "0.00"
+                    if valores_parts:
+                        match_valor = re.search(r'[\d,.]+', valores_parts[-1])
+                        if match_valor:
+                            valor_total_item = match_valor.group(0)
+
+                    unidades_pacote = 1
+                    match_unidades = re.search(r'C/\s*(\d+)', quantidade_completa_str, re.IGNORECASE)
+                    if match_unidades:
+                        unidades_pacote = int(match_unidades.group(1))
+
+                    if nome_produto_final and quantidade_completa_str:
+                        produtos_finais.append({
+                            "produto_nome": nome_produto_final,
+                            "codigo_barras": codigo_barras_final,
+                            "quantidade_pedida": quantidade_completa_str,
+                            "quantidade_entregue": None,
+                            "status": "Pendente",
+                            "valor_total_item": valor_total_item.replace(',', '.'),
+                            "unidades_pacote": unidades_pacote,
+                            "forced_confirmed": False
+                        })
+
+        documento.close()
+
+        if not produtos_finais:
+            return {"erro": "Nenhum produto pôde ser extraído do PDF."}
+
+        return {
+            **dados_cabecalho,
+            "produtos": produtos_finais,
+            "status_conferencia": "Pendente",
+            "nome_da_carga": nome_da_carga,
+            "nome_arquivo": nome_arquivo
+        }
+
+    except Exception as e:
+        import traceback
+        return {"erro": f"Erro na extração do PDF: {str(e)}\n{traceback.format_exc()}"}
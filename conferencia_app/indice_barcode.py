@@ -0,0 +1,57 @@
+# Arquivo: indice_barcode.py
+# Busca de um código de barras em toda a carga: itens dos pedidos
+# (pedido_itens.codigo_barras) e itens do mapa de separação (carga_itens.cod_barras).
+#
+# A carga dos pedidos (pedidos.nome_da_carga) é o nome digitado no upload
+# ("DENILSON"); a do mapa (cargas.numero_carga) é o número do romaneio lido
+# do PDF. Um não se deduz do outro, então o mapa só entra na busca quando o
+# número dele vem junto.
+#
+# O "índice" são índices do próprio Postgres, então ficam em dia sozinhos a
+# cada upload, edição ou exclusão, sem tabela paralela para sincronizar:
+#   - btree em pedido_itens(nome_da_carga, codigo_barras): só os itens da
+#     carga com o EAN bipado, sem passar pelo histórico do EAN nas outras
+#     cargas (nome_da_carga é copiado do pedido no upload)
+#   - btree em carga_itens(numero_carga, cod_barras): busca direta no mapa
+# (criados em migracoes.py)
+
+
+def normalizar(codigo_barras):
+    """O leitor às vezes manda espaços/quebra de linha junto com o EAN."""
+    return str(codigo_barras or "").strip()
+
+
+def resolver(cur, carga, codigo_barras, numero_mapa=None):
+    """
+    Onde esse EAN aparece na carga. Retorna {"pedidos": [...], "mapa": [...]}:
+    nos pedidos da carga `carga` (nome_da_carga), (numero_pedido, indice,
+    unidades_pacote) com os itens ainda pendentes primeiro; no mapa
+    `numero_mapa` (numero_carga do romaneio), as linhas de carga_itens com
+    pack_qtd. Sem `numero_mapa`, "mapa" volta vazio.
+    """
+    cur.execute("""
+        SELECT p.numero_pedido, p.nome_cliente, i.indice, i.produto_nome, i.unidades_pacote,
+               i.quantidade_pedida, i.quantidade_entregue, i.status, i.versao
+          FROM pedido_itens i
+          JOIN pedidos p ON p.numero_pedido = i.numero_pedido
+         WHERE i.nome_da_carga = %s AND i.codigo_barras = %s
+         ORDER BY (i.status <> 'Pendente'), p.id, i.indice;
+    """, (carga, codigo_barras))
+    colunas = ("numero_pedido", "nome_cliente", "indice", "produto_nome", "unidades_pacote",
+               "quantidade_pedida", "quantidade_entregue", "status", "versao")
+    pedidos = [dict(zip(colunas, row)) for row in cur.fetchall()]
+
+    if not numero_mapa:
+        return {"pedidos": pedidos, "mapa": []}
+
+    cur.execute("""
+        SELECT id, grupo_codigo, codigo, descricao, qtd_unidades, unidade, pack_qtd, pack_unid, separado
+          FROM carga_itens
+         WHERE numero_carga = %s AND cod_barras = %s
+         ORDER BY separado, id;
+    """, (numero_mapa, codigo_barras))
+    colunas = ("id", "grupo_codigo", "codigo", "descricao", "qtd_unidades", "unidade",
+               "pack_qtd", "pack_unid", "separado")
+    mapa = [dict(zip(colunas, row)) for row in cur.fetchall()]
+
+    return {"pedidos": pedidos, "mapa": mapa}
@@ -0,0 +1,346 @@
+# Arquivo: itens_pedido.py
+# Itens dos pedidos na tabela normalizada pedido_itens (uma linha por produto).
+#
+# Antes cada bipagem fazia SELECT do pedido inteiro, editava um elemento do
+# JSONB `produtos` em Python e regravava o array todo. Agora a atualização de
+# um item é um UPDATE de uma linha, e o status do pedido (Finalizado/Pendente)
+# acompanha o contador pedidos.itens_pendentes em vez de varrer todos os itens.
+#
+# Concorrência otimista: cada item tem uma `versao`, incrementada a cada
+# escrita. O UPDATE só acontece se a versão ainda for a que o conferente viu;
+# se outro conferente gravou antes, a função devolve o estado atual do item
+# (a rota responde 409) em vez de sobrescrever a bipagem dele.
+
+import re
+
+from psycopg2.extras import execute_values
+
+try:
+    from conferencia_app import registro_cargas, eventos
+except ImportError:
+    from . import registro_cargas, eventos
+
+STATUS_CORTE = ('Corte Parcial', 'Corte Total')
+
+# Colunas devolvidas para as telas, na mesma forma dos antigos elementos de `produtos`
+COLUNAS_ITEM = (
+    "produto_nome", "codigo_barras", "quantidade_pedida", "quantidade_entregue", "status",
+    "valor_total_item", "unidades_pacote", "forced_confirmed", "observacao", "versao"
+)
+SQL_COLUNAS_ITEM = ", ".join(f"i.{coluna}" for coluna in COLUNAS_ITEM)
+
+# Subconsulta que remonta a lista de produtos de um pedido `p` em JSON
+SQL_PRODUTOS_JSON = """
+    COALESCE((
+        SELECT json_agg(json_build_object(
+                   'produto_nome', i.produto_nome, 'codigo_barras', i.codigo_barras,
+                   'quantidade_pedida', i.quantidade_pedida, 'quantidade_entregue', i.quantidade_entregue,
+                   'status', i.status, 'valor_total_item', i.valor_total_item,
+                   'unidades_pacote', i.unidades_pacote, 'forced_confirmed', i.forced_confirmed,
+                   'observacao', i.observacao, 'versao', i.versao
+               ) ORDER BY i.indice)
+          FROM pedido_itens i
+         WHERE i.numero_pedido = p.numero_pedido
+    ), '[]'::json)
+"""
+
+
+def inserir_itens(cur, numero_pedido, produtos):
+    """Grava os produtos extraídos de um pedido recém-inserido e inicia o contador."""
+    produtos = produtos or []
+    pendentes = sum(1 for p in produtos if p.get("status", "Pendente") == "Pendente")
+    status_pedido = "Pendente" if pendentes or not produtos else "Finalizado"
+    cur.execute(
+        "UPDATE pedidos SET itens_pendentes = %s, status_conferencia = %s WHERE numero_pedido = %s RETURNING nome_da_carga;",
+        (pendentes, status_pedido, numero_pedido)
+    )
+    row = cur.fetchone()
+    # A carga vai junto em cada item, para a busca por EAN na carga (indice_barcode)
+    linhas = [
+        (
+            numero_pedido, indice, p.get("produto_nome"), p.get("codigo_barras"),
+            p.get("quantidade_pedida"), p.get("quantidade_entregue"), p.get("status", "Pendente"),
+            p.get("valor_total_item"), int(p.get("unidades_pacote") or 1),
+            bool(p.get("forced_confirmed", False)), p.get("observacao", ""), row[0] if row else None
+        )
+        for indice, p in enumerate(produtos)
+    ]
+    if linhas:
+        execute_values(cur, """
+            INSERT INTO pedido_itens (
+                numero_pedido, indice, produto_nome, codigo_barras, quantidade_pedida,
+                quantidade_entregue, status, valor_total_item, unidades_pacote,
+                forced_confirmed, observacao, nome_da_carga
+            ) VALUES %s
+        """, linhas, page_size=500)
+    if row:
+        registro_cargas.registrar_pedido(cur, row[0], status_pedido == "Finalizado",
+                                         sum(1 for linha in linhas if linha[6] in STATUS_CORTE))
+        eventos.notificar(cur, "carga", row[0], "pedido_novo",
+                          {"numero_pedido": numero_pedido, "status_conferencia": status_pedido,
+                           "total_itens": len(linhas)})
+
+
+def carregar_produtos(cur, numero_pedido):
+    """Lista de produtos do pedido, na ordem original, como dicionários."""
+    cur.execute(f"""
+        SELECT {SQL_COLUNAS_ITEM}
+          FROM pedido_itens i
+         WHERE i.numero_pedido = %s
+         ORDER BY i.indice;
+    """, (numero_pedido,))
+    return [dict(zip(COLUNAS_ITEM, row)) for row in cur.fetchall()]
+
+
+def buscar_por_barcode(cur, numero_pedido, codigo_barras):
+    """Primeiro item do pedido com esse código de barras (usa o índice (numero_pedido, codigo_barras))."""
+    cur.execute(f"""
+        SELECT i.indice, {SQL_COLUNAS_ITEM}
+          FROM pedido_itens i
+         WHERE i.numero_pedido = %s AND i.codigo_barras = %s
+         ORDER BY i.indice
+         LIMIT 1;
+    """, (numero_pedido, codigo_barras))
+    row = cur.fetchone()
+    if not row:
+        return None
+    return {"indice": row[0], **dict(zip(COLUNAS_ITEM, row[1:]))}
+
+
+def listar_cortes(cur, apenas_finalizados=True):
+    """
+    Itens em corte (Parcial/Total) com os dados do pedido, na ordem dos
+    pedidos. Cada linha: (numero_pedido, nome_cliente, vendedor, nome_da_carga, produto).
+    """
+    filtro_pedido = "AND p.status_conferencia = 'Finalizado'" if apenas_finalizados else ""
+    cur.execute(f"""
+        SELECT p.numero_pedido, p.nome_cliente, p.vendedor, p.nome_da_carga, {SQL_COLUNAS_ITEM}
+          FROM pedido_itens i
+          JOIN pedidos p ON p.numero_pedido = i.numero_pedido
+         WHERE i.status IN %s {filtro_pedido}
+         ORDER BY p.id, i.indice;
+    """, (STATUS_CORTE,))
+    for numero_pedido, nome_cliente, vendedor, nome_da_carga, *item in cur.fetchall():
+        yield numero_pedido, nome_cliente, vendedor, nome_da_carga, dict(zip(COLUNAS_ITEM, item))
+
+
+def calcular_status(quantidade_pedida, unidades_pacote, forced_confirmed, qtd_entregue_str):
+    """Mesma regra de sempre: compara unidades entregues com pacotes pedidos x unidades por pacote."""
+    if forced_confirmed:
+        return "Confirmado"
+    match_pacotes = re.match(r'(\d+)', quantidade_pedida or '0')
+    pacotes_pedidos = int(match_pacotes.group(1)) if match_pacotes else 0
+    total_unidades_pedidas = pacotes_pedidos * int(unidades_pacote or 1)
+    try:
+        qtd_entregue_int = int(qtd_entregue_str)
+        if qtd_entregue_int == total_unidades_pedidas:
+            return "Confirmado"
+        elif qtd_entregue_int == 0:
+            return "Corte Total"
+        return "Corte Parcial"
+    except (ValueError, TypeError):
+        return "Corte Parcial"
+
+
+def _ajustar_pendentes(cur, numero_pedido, status_antigo, status_novo, item=None):
+    """
+    Atualiza o contador de itens pendentes, o status do pedido e os contadores
+    da carga (registro_cargas), e publica o evento do item (`item`, um dict
+    pequeno com o que mudou) para a carga. Retorna o status do pedido. Sem mudança de
+    pendência a linha do pedido nem é tocada, então bipagens simultâneas no
+    mesmo pedido não disputam a trava dela.
+    """
+    delta = int(status_novo == "Pendente") - int(status_antigo == "Pendente")
+    delta_cortes = int(status_novo in STATUS_CORTE) - int(status_antigo in STATUS_CORTE)
+    if delta == 0:
+        cur.execute("SELECT status_conferencia, nome_da_carga FROM pedidos WHERE numero_pedido = %s;", (numero_pedido,))
+        row = cur.fetchone()
+        delta_finalizados = 0
+    else:
+        cur.execute("""
+            UPDATE pedidos
+               SET itens_pendentes = itens_pendentes + %s,
+                   status_conferencia = CASE WHEN itens_pendentes + %s <= 0 THEN 'Finalizado' ELSE 'Pendente' END
+             WHERE numero_pedido = %s
+         RETURNING status_conferencia, nome_da_carga, itens_pendentes - %s <= 0;
+        """, (delta, delta, numero_pedido, delta))
+        row = cur.fetchone()
+        delta_finalizados = int(row[0] == "Finalizado") - int(bool(row[2])) if row else 0
+    if not row:
+        return None
+    registro_cargas.ajustar(cur, row[1], finalizados=delta_finalizados, cortes=delta_cortes)
+    if item is not None:
+        eventos.notificar(cur, "carga", row[1], "item",
+                          {"numero_pedido": numero_pedido, "status_conferencia": row[0], **item})
+    if delta_finalizados:
+        eventos.notificar(cur, "carga", row[1], "pedido",
+                          {"numero_pedido": numero_pedido, "status_conferencia": row[0]})
+    return row[0]
+
+
+def ler_item(cur, numero_pedido, indice):
+    """Estado atual de um item (sem travar a linha), ou None."""
+    cur.execute(f"""
+        SELECT i.indice, {SQL_COLUNAS_ITEM}
+          FROM pedido_itens i
+         WHERE i.numero_pedido = %s AND i.indice = %s;
+    """, (numero_pedido, indice))
+    row = cur.fetchone()
+    if not row:
+        return None
+    return {"indice": row[0], **dict(zip(COLUNAS_ITEM, row[1:]))}
+
+
+def _conflito(cur, numero_pedido, indice):
+    return {"conflito": True, "atual": ler_item(cur, numero_pedido, indice)}
+
+
+def atualizar_item(cur, numero_pedido, indice, quantidade_entregue, observacao='', versao=None, tentativas=5):
+    """
+    Registra a quantidade entregue de um item. Retorna dict com o novo status
+    do item e do pedido e a nova versão, ou None se o item não existir.
+
+    Com `versao` (a que o conferente tinha na tela), grava só se o item ainda
+    estiver nela; senão devolve {"conflito": True, "atual": item}. Sem
+    `versao` (clientes antigos), relê e tenta de novo até `tentativas` vezes,
+    o que ainda garante que o contador de pendentes nunca se perde.
+    """
+    for _ in range(tentativas):
+        atual = ler_item(cur, numero_pedido, indice)
+        if atual is None:
+            return None
+        if versao is not None and atual["versao"] != versao:
+            return {"conflito": True, "atual": atual}
+
+        status_antigo = atual["status"]
+        status_final = calcular_status(atual["quantidade_pedida"], atual["unidades_pacote"],
+                                       atual["forced_confirmed"], quantidade_entregue)
+        cur.execute("""
+            UPDATE pedido_itens
+               SET quantidade_entregue = %s, observacao = %s, status = %s, versao = versao + 1
+             WHERE numero_pedido = %s AND indice = %s AND versao = %s
+         RETURNING versao;
+        """, (quantidade_entregue, observacao, status_final, numero_pedido, indice, atual["versao"]))
+        row = cur.fetchone()
+        if row:
+            status_pedido = _ajustar_pendentes(cur, numero_pedido, status_antigo, status_final, item={
+                "indice": indice, "status": status_final, "status_antigo": status_antigo,
+                "quantidade_entregue": quantidade_entregue, "observacao": observacao, "versao": row[0]
+            })
+            return {"status_final": status_final, "status_antigo": status_antigo,
+                    "status_conferencia": status_pedido, "versao": row[0]}
+        if versao is not None:
+            break
+    return _conflito(cur, numero_pedido, indice)
+
+
+def alternar_forcado(cur, numero_pedido, indice=None, produto_nome=None, versao=None, tentativas=5):
+    """
+    Alterna o 'forced_confirmed' de um item (pelo índice ou, como antes, pelo
+    nome do produto). Forçado vira 'Confirmado'; ao desfazer volta a 'Pendente'.
+    Retorna None se o item não existir. `versao` funciona como em atualizar_item.
+    """
+    if indice is None:
+        cur.execute("""
+            SELECT indice FROM pedido_itens
+             WHERE numero_pedido = %s AND produto_nome = %s
+             ORDER BY indice
+             LIMIT 1;
+        """, (numero_pedido, produto_nome))
+        row = cur.fetchone()
+        if not row:
+            return None
+        indice = row[0]
+
+    for _ in range(tentativas):
+        atual = ler_item(cur, numero_pedido, indice)
+        if atual is None:
+            return None
+        if versao is not None and atual["versao"] != versao:
+            return {"conflito": True, "atual": atual}
+
+        status_antigo = atual["status"]
+        novo_forced = not bool(atual["forced_confirmed"])
+        novo_status = "Confirmado" if novo_forced else "Pendente"
+        cur.execute("""
+            UPDATE pedido_itens SET forced_confirmed = %s, status = %s, versao = versao + 1
+             WHERE numero_pedido = %s AND indice = %s AND versao = %s
+         RETURNING versao;
+        """, (novo_forced, novo_status, numero_pedido, indice, atual["versao"]))
+        row = cur.fetchone()
+        if row:
+            status_pedido = _ajustar_pendentes(cur, numero_pedido, status_antigo, novo_status, item={
+                "indice": indice, "status": novo_status, "status_antigo": status_antigo,
+                "forced_confirmed": novo_forced, "versao": row[0]
+            })
+            return {"indice": indice, "forced_confirmed": novo_forced, "status": novo_status,
+                    "status_antigo": status_antigo, "status_conferencia": status_pedido, "versao": row[0]}
+        if versao is not None:
+            break
+    return _conflito(cur, numero_pedido, indice)
+
+
+MAX_OPERACOES_LOTE = 500
+
+
+def aplicar_lote(cur, operacoes):
+    """
+    Aplica, na ordem, uma lista de operações de conferência na transação de
+    `cur`. Cada operação é um dict com "pedido_id", "produto_index" e:
+      - "tipo": "update" (padrão), com "quantidade_entregue" (obrigatória) e "observacao"
+      - "tipo": "force", que alterna o forced_confirmed
+    e opcionalmente "versao". Cada uma roda em um SAVEPOINT, então uma falha
+    ou conflito não desfaz as outras. Operações seguidas no mesmo item dentro
+    do lote se encadeiam: a versão que o cliente mandou para a primeira vale
+    para as seguintes. Retorna uma lista de resultados, na mesma ordem.
+    """
+    resultados = []
+    versoes = {}  # (pedido, indice) -> (versão enviada pelo cliente, versão gravada)
+    for posicao, op in enumerate(operacoes):
+        res = {"posicao": posicao}
+        try:
+            pedido_id = op["pedido_id"]
+            indice = int(op["produto_index"])
+            versao = op.get("versao")
+            versao = int(versao) if versao is not None else None
+            anterior = versoes.get((pedido_id, indice))
+            if versao is not None and anterior and anterior[0] == versao:
+                versao = anterior[1]
+            tipo = op.get("tipo", "update")
+            # Sem a quantidade, calcular_status daria "Corte Parcial" com NULL gravado
+            if tipo == "update" and op.get("quantidade_entregue") is None:
+                raise KeyError("quantidade_entregue")
+        except (KeyError, TypeError, ValueError) as e:
+            res.update(sucesso=False, erro=f"Operação inválida: {e}")
+            resultados.append(res)
+            continue
+        res.update(pedido_id=pedido_id, produto_index=indice, tipo=tipo)
+
+        cur.execute("SAVEPOINT op_lote;")
+        try:
+            if tipo == "update":
+                r = atualizar_item(cur, pedido_id, indice, op.get("quantidade_entregue"),
+                                   op.get("observacao", ''), versao=versao)
+            elif tipo == "force":
+                r = alternar_forcado(cur, pedido_id, indice=indice, versao=versao)
+            else:
+                raise ValueError(f"tipo desconhecido: {tipo}")
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT op_lote;")
+            res.update(sucesso=False, erro=str(e))
+            resultados.append(res)
+            continue
+
+        if r is None:
+            cur.execute("ROLLBACK TO SAVEPOINT op_lote;")
+            res.update(sucesso=False, erro="Item não encontrado.")
+        elif r.get("conflito"):
+            cur.execute("ROLLBACK TO SAVEPOINT op_lote;")
+            res.update(sucesso=False, conflito=True, item=r["atual"])
+        else:
+            cur.execute("RELEASE SAVEPOINT op_lote;")
+            if op.get("versao") is not None:
+                versoes[(pedido_id, indice)] = (int(op["versao"]), r["versao"])
+            res.update(sucesso=True, **{k: v for k, v in r.items() if k != "indice"})
+        resultados.append(res)
+    return resultados
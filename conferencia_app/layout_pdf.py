@@ -0,0 +1,130 @@
+# Arquivo: layout_pdf.py
+# Análise de layout compartilhada pelos parsers de PDF (pedido e mapa).
+#
+# Cada página monta a TextPage do PyMuPDF uma vez só e dela saem o texto
+# corrido e as palavras. As palavras viram uma tabela em colunas NumPy
+# (x0, y0, x1, y1 + textos) e o agrupamento em linhas/colunas é feito com
+# ordenação e diferenças vetorizadas, em vez de laços em Python.
+#
+# Os dois modos de agrupar reproduzem exatamente os laços que existiam:
+#   - encadeado (mapa): a palavra fica na linha se |y0 - y0 da palavra
+#     anterior| <= tolerância
+#   - ancorado (pedido): a palavra fica na linha se |y0 - y0 da primeira
+#     palavra da linha| < tolerância
+
+import fitz  # PyMuPDF
+import numpy as np
+
+
+class TabelaPalavras:
+    """Palavras de uma página em colunas: arrays x0/y0/x1/y1 e a lista de textos."""
+    __slots__ = ("x0", "y0", "x1", "y1", "texto")
+
+    def __init__(self, x0, y0, x1, y1, texto):
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+        self.texto = texto
+
+    @classmethod
+    def de_palavras(cls, palavras):
+        """A partir da saída de page.get_text("words")."""
+        if not palavras:
+            vazio = np.empty(0, dtype=np.float64)
+            return cls(vazio, vazio, vazio, vazio, [])
+        coords = np.array([p[:4] for p in palavras], dtype=np.float64)
+        return cls(coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3], [p[4] for p in palavras])
+
+    def __len__(self):
+        return len(self.texto)
+
+    def _ordem_leitura(self):
+        # Mesma ordem de sort(key=(y0, x0)): lexsort é estável como o sort do Python
+        return np.lexsort((self.x0, self.y0))
+
+    def _ordenar_linhas(self, ordem, inicios):
+        """Divide `ordem` nas linhas que começam em `inicios` e ordena cada uma por x0 (estável)."""
+        ids_linha = np.zeros(len(ordem), dtype=np.int64)
+        ids_linha[inicios[1:]] = 1
+        ids_linha = np.cumsum(ids_linha)
+        ordem = ordem[np.lexsort((self.x0[ordem], ids_linha))]
+        return np.split(ordem, inicios[1:])
+
+    def linhas_encadeadas(self, tolerancia):
+        """Lista de arrays de índices, uma por linha visual (modo do parser de mapa)."""
+        if not len(self):
+            return []
+        ordem = self._ordem_leitura()
+        ys = self.y0[ordem]
+        quebras = np.flatnonzero(np.abs(np.diff(ys)) > tolerancia) + 1
+        inicios = np.concatenate(([0], quebras))
+        return self._ordenar_linhas(ordem, inicios)
+
+    def linhas_ancoradas(self, tolerancia):
+        """Lista de arrays de índices, uma por linha visual (modo do extrator de pedido)."""
+        n = len(self)
+        if not n:
+            return []
+        ordem = self._ordem_leitura()
+        ys = self.y0[ordem]
+        inicios = [0]
+        inicio = 0
+        while True:
+            y_ref = ys[inicio]
+            # Primeiro índice fora da linha; o ajuste fino usa a mesma conta
+            # do laço original (ys - y_ref < tolerância) para não depender de
+            # arredondamento em y_ref + tolerância
+            fim = int(np.searchsorted(ys, y_ref + tolerancia, side="left"))
+            while fim > inicio + 1 and not (ys[fim - 1] - y_ref < tolerancia):
+                fim -= 1
+            while fim < n and ys[fim] - y_ref < tolerancia:
+                fim += 1
+            fim = max(fim, inicio + 1)
+            if fim >= n:
+                break
+            inicios.append(fim)
+            inicio = fim
+        return self._ordenar_linhas(ordem, np.array(inicios, dtype=np.int64))
+
+    def colunas(self, limites, indices=None):
+        """
+        Coluna de cada palavra (de todas, ou de `indices`) pelos limites em x0,
+        crescentes: 0 se x0 < limites[0], 1 se x0 < limites[1], ... (como os
+        if/elif dos parsers).
+        """
+        x0 = self.x0 if indices is None else self.x0[indices]
+        return np.searchsorted(np.asarray(limites, dtype=np.float64), x0, side="right")
+
+    def textos(self, indices):
+        texto = self.texto
+        return [texto[i] for i in indices]
+
+    def palavras(self, indices):
+        """As palavras de `indices` como tuplas (x0, y0, x1, y1, texto)."""
+        x0, y0, x1, y1, texto = self.x0, self.y0, self.x1, self.y1, self.texto
+        return [(float(x0[i]), float(y0[i]), float(x1[i]), float(y1[i]), texto[i]) for i in indices]
+
+
+class LayoutPagina:
+    """Uma página com a TextPage criada uma vez; texto e palavras saem dela."""
+
+    def __init__(self, pagina):
+        self.pagina = pagina
+        # Mesmos flags que get_text("text") e get_text("words") usam sozinhos
+        # (são iguais), então a saída não muda por compartilhar a TextPage
+        self.textpage = pagina.get_textpage(flags=fitz.TEXTFLAGS_TEXT)
+        self._texto = None
+        self._palavras = None
+
+    @property
+    def texto(self):
+        if self._texto is None:
+            self._texto = self.pagina.get_text("text", textpage=self.textpage)
+        return self._texto
+
+    @property
+    def palavras(self):
+        if self._palavras is None:
+            self._palavras = TabelaPalavras.de_palavras(self.pagina.get_text("words", textpage=self.textpage))
+        return self._palavras
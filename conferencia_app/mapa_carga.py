@@ -0,0 +1,309 @@
+# Arquivo: mapa_carga.py
+# Gravação dos mapas de separação (carga_grupos e carga_itens) em lote.
+#
+# O upload fazia um INSERT por grupo e um por item dentro de um laço: um mapa
+# de 2.000 itens eram 2.000 idas e voltas ao banco. Agora as linhas que o
+# parser entrega página a página vão se juntando e são gravadas com
+# execute_values, algumas centenas por comando, tudo na transação do upload.
+#
+# Reenvio de um mapa que já existe (PDF corrigido): em vez de apagar a carga
+# e perder a separação feita, MesclagemMapa compara com o que está gravado
+# pela chave (codigo, cod_barras, grupo_codigo). Só entram os itens novos,
+# só mudam os que tiveram quantidade/descrição alterada e os que sumiram do
+# PDF ficam marcados como removidos; separado, qtd_separada, observacao e o
+# separador do grupo continuam como estavam.
+#
+# Sincronização por delta: toda linha de carga_itens/carga_grupos guarda em
+# versao_mudanca o id da transação que a gravou por último (trigger). Quem
+# lê o mapa recebe uma versão (o xmin do snapshot: toda transação abaixo
+# dele já terminou) e depois pede só o que mudou desde ela (ler_mapa com
+# `desde`). Uma linha de uma transação ainda aberta na leitura tem id acima
+# da versão devolvida, então aparece na próxima; no pior caso vem repetida.
+#
+# Separação em lote: a tela junta as marcações (checkbox, quantidade, OBS,
+# fechar um grupo inteiro) e atualizar_itens grava todas com um único
+# UPDATE ... FROM (VALUES ...), em vez de uma requisição por item.
+
+import time
+
+from psycopg2.extras import execute_values
+
+# Itens acumulados antes de mandar um lote (o parser entrega por página)
+ITENS_POR_LOTE = 1000
+# Máximo de itens por chamada de atualizar_itens (um comando só)
+MAX_ITENS_ATUALIZACAO = 500
+
+COLUNAS_ITEM_MAPA = (
+    "grupo_codigo", "fabricante", "codigo", "cod_barras", "descricao",
+    "qtd_unidades", "unidade", "pack_qtd", "pack_unid"
+)
+
+
+def inserir_grupos(cur, numero_carga, grupos):
+    """Grupos novos entram; nos que já existem só o título acompanha o PDF (o separador fica)."""
+    linhas = [(numero_carga, g.get("grupo_codigo"), g.get("grupo_titulo")) for g in grupos or []]
+    if linhas:
+        execute_values(cur, """
+            INSERT INTO carga_grupos (numero_carga, grupo_codigo, grupo_titulo)
+            VALUES %s ON CONFLICT (numero_carga, grupo_codigo)
+            DO UPDATE SET grupo_titulo = EXCLUDED.grupo_titulo
+        """, linhas, page_size=ITENS_POR_LOTE)
+    return len(linhas)
+
+
+def inserir_itens(cur, numero_carga, itens, tabela="carga_itens"):
+    linhas = [(numero_carga, *(it.get(coluna) for coluna in COLUNAS_ITEM_MAPA)) for it in itens or []]
+    if linhas:
+        execute_values(cur, f"""
+            INSERT INTO {tabela} (numero_carga, {", ".join(COLUNAS_ITEM_MAPA)}) VALUES %s
+        """, linhas, page_size=ITENS_POR_LOTE)
+    return len(linhas)
+
+
+class GravacaoMapa:
+    """
+    Recebe as páginas do parser (grupos e itens) e grava em lotes de
+    ITENS_POR_LOTE. Os grupos de cada lote vão antes dos itens dele.
+    Quem chama faz o commit.
+    """
+
+    def __init__(self, cur, numero_carga, tabela_itens="carga_itens"):
+        self.cur = cur
+        self.numero_carga = numero_carga
+        self.tabela_itens = tabela_itens
+        self._grupos, self._itens = [], []
+        self.grupos = self.itens = self.lotes = 0
+        self.segundos = 0.0
+
+    def adicionar(self, grupos, itens):
+        self._grupos.extend(grupos)
+        self._itens.extend(itens)
+        if len(self._itens) >= ITENS_POR_LOTE:
+            self._gravar()
+
+    def _gravar(self):
+        if not self._grupos and not self._itens:
+            return
+        inicio = time.perf_counter()
+        self.grupos += inserir_grupos(self.cur, self.numero_carga, self._grupos)
+        self.itens += inserir_itens(self.cur, self.numero_carga, self._itens, self.tabela_itens)
+        self.segundos += time.perf_counter() - inicio
+        self.lotes += 1
+        self._grupos, self._itens = [], []
+
+    def concluir(self):
+        """Grava o que sobrou. Retorna um resumo para o log."""
+        self._gravar()
+        return {"grupos": self.grupos, "itens": self.itens, "lotes": self.lotes,
+                "ms_gravacao": round(1000 * self.segundos, 1)}
+
+
+# Numeração de cada item dentro da sua chave (codigo, cod_barras, grupo_codigo),
+# com nulos como '' para casarem entre si
+_SQL_NUMERADOS = """
+    SELECT t.{id}, COALESCE(t.codigo, '') AS codigo, COALESCE(t.cod_barras, '') AS cod_barras,
+           COALESCE(t.grupo_codigo, '') AS grupo_codigo,
+           ROW_NUMBER() OVER (PARTITION BY COALESCE(t.codigo, ''), COALESCE(t.cod_barras, ''),
+                                           COALESCE(t.grupo_codigo, '') ORDER BY t.{id}) AS ocorrencia
+      FROM {tabela} t
+"""
+# Colunas que o PDF define; o resto é estado da separação e não é tocado
+_COLUNAS_DO_PDF = ("fabricante", "descricao", "qtd_unidades", "unidade", "pack_qtd", "pack_unid")
+
+
+class MesclagemMapa(GravacaoMapa):
+    """
+    Reenvio mesclado: as páginas vão para uma tabela temporária (nos mesmos
+    lotes da gravação normal) e concluir() aplica a diferença em carga_itens
+    com quatro comandos. Itens com a mesma chave são pareados pela ordem em
+    que aparecem (o 2º do PDF com o 2º gravado, e assim por diante).
+    """
+
+    def __init__(self, cur, numero_carga):
+        cur.execute("""
+            CREATE TEMP TABLE mapa_novo (
+                ordem SERIAL, numero_carga TEXT, grupo_codigo TEXT, fabricante TEXT, codigo TEXT,
+                cod_barras TEXT, descricao TEXT, qtd_unidades INTEGER, unidade TEXT,
+                pack_qtd INTEGER, pack_unid TEXT
+            ) ON COMMIT DROP;
+        """)
+        super().__init__(cur, numero_carga, tabela_itens="mapa_novo")
+
+    def concluir(self):
+        resumo = super().concluir()
+        cur = self.cur
+        inicio = time.perf_counter()
+
+        # (id gravado, ordem no PDF novo): sem ordem = saiu do PDF; sem id = item novo
+        cur.execute(f"""
+            CREATE TEMP TABLE mapa_pares ON COMMIT DROP AS
+            SELECT a.id, n.ordem
+              FROM ({_SQL_NUMERADOS.format(id="ordem", tabela="mapa_novo")}) n
+              FULL JOIN ({_SQL_NUMERADOS.format(id="id", tabela="carga_itens")} WHERE t.numero_carga = %s) a
+                ON a.codigo = n.codigo AND a.cod_barras = n.cod_barras
+               AND a.grupo_codigo = n.grupo_codigo AND a.ocorrencia = n.ocorrencia;
+        """, (self.numero_carga,))
+
+        colunas_i = ", ".join(f"i.{c}" for c in _COLUNAS_DO_PDF)
+        colunas_m = ", ".join(f"m.{c}" for c in _COLUNAS_DO_PDF)
+        cur.execute(f"""
+            UPDATE carga_itens i
+               SET {", ".join(f"{c} = m.{c}" for c in _COLUNAS_DO_PDF)}, removido = FALSE,
+                   -- a falta acompanha a nova quantidade pedida
+                   faltou = CASE WHEN i.qtd_separada IS NULL THEN i.faltou
+                                 ELSE i.qtd_separada < m.qtd_unidades END
+              FROM mapa_pares p
+              JOIN mapa_novo m ON m.ordem = p.ordem
+             WHERE i.id = p.id
+               AND (i.removido OR ({colunas_i}) IS DISTINCT FROM ({colunas_m}));
+        """)
+        atualizados = cur.rowcount
+
+        cur.execute("""
+            UPDATE carga_itens i SET removido = TRUE
+              FROM mapa_pares p
+             WHERE i.id = p.id AND p.ordem IS NULL AND NOT i.removido;
+        """)
+        removidos = cur.rowcount
+
+        cur.execute(f"""
+            INSERT INTO carga_itens (numero_carga, {", ".join(COLUNAS_ITEM_MAPA)})
+            SELECT %s, {", ".join(f"m.{c}" for c in COLUNAS_ITEM_MAPA)}
+              FROM mapa_novo m
+              JOIN mapa_pares p ON p.ordem = m.ordem
+             WHERE p.id IS NULL
+             ORDER BY m.ordem;
+        """, (self.numero_carga,))
+        inseridos = cur.rowcount
+
+        resumo.update({"inseridos": inseridos, "atualizados": atualizados, "removidos": removidos,
+                       "ms_mesclagem": round(1000 * (time.perf_counter() - inicio), 1)})
+        return resumo
+
+
+def ler_mapa(cur, numero_carga, desde=None):
+    """
+    Grupos e itens da carga para a tela de separação. Com `desde` (uma versão
+    devolvida antes), só as linhas alteradas depois dela, a menos que a carga
+    tenha sido recriada: aí vem tudo e "completo" é True. `cur` é um RealDictCursor.
+    """
+    # A versão é lida antes dos dados: o que mudar entre as duas leituras
+    # tem id acima dela e volta no próximo delta
+    cur.execute("""
+        SELECT txid_snapshot_xmin(txid_current_snapshot()) AS versao,
+               (SELECT versao_base FROM cargas WHERE numero_carga = %s) AS versao_base;
+    """, (numero_carga,))
+    row = cur.fetchone()
+    versao, versao_base = row["versao"], row["versao_base"]
+    completo = desde is None or versao_base is None or versao_base >= desde
+    filtro = "" if completo else "AND versao_mudanca >= %(desde)s"
+    parametros = {"carga": numero_carga, "desde": desde}
+
+    # grupos (agora também busca o 'separador_nome')
+    cur.execute(f"""
+        SELECT grupo_codigo, grupo_titulo, separador_nome
+        FROM carga_grupos
+        WHERE numero_carga = %(carga)s {filtro}
+        ORDER BY
+            CASE
+                WHEN grupo_codigo = 'GERAL' THEN 0
+                ELSE 1
+            END,
+            grupo_codigo;
+    """, parametros)
+    grupos = cur.fetchall()
+
+    # itens (agora também busca a 'qtd_separada')
+    cur.execute(f"""
+        SELECT id, grupo_codigo, fabricante, codigo, cod_barras, descricao,
+               qtd_unidades, unidade, pack_qtd, pack_unid,
+               observacao, separado, forcar_conferido, faltou, sobrando, qtd_separada, removido
+        FROM carga_itens
+        WHERE numero_carga = %(carga)s {filtro}
+        ORDER BY id;
+    """, parametros)
+    itens = cur.fetchall()
+    return {"grupos": grupos, "itens": itens, "versao": versao, "completo": completo}
+
+
+# Campos da separação que a tela pode mudar, com o tipo para o VALUES
+_CAMPOS_SEPARACAO = (
+    ("separado", "boolean"), ("forcar_conferido", "boolean"), ("qtd_separada", "integer"),
+    ("faltou", "boolean"), ("observacao", "text"), ("sobrando", "integer"),
+)
+
+
+def _normalizar_alteracoes(alteracoes):
+    """
+    Junta as alterações por id (a última de cada campo vale) e aplica as
+    regras de /api/mapa/item/atualizar: quantidade separada informada marca
+    o item como separado (e faltou sai da comparação com a pedida, no banco).
+    """
+    por_id = {}
+    for alteracao in alteracoes:
+        item_id = int(alteracao.get("id", alteracao.get("item_id")))
+        campos = por_id.setdefault(item_id, {})
+        for campo, _tipo in _CAMPOS_SEPARACAO:
+            if campo in alteracao:
+                campos[campo] = alteracao[campo]
+    for campos in por_id.values():
+        if campos.get("qtd_separada") is not None:
+            campos["qtd_separada"] = int(campos["qtd_separada"])
+            campos["separado"] = True
+            campos.pop("faltou", None)
+        if "sobrando" in campos:
+            campos["sobrando"] = int(campos["sobrando"] or 0)
+        if "observacao" in campos:
+            campos["observacao"] = campos["observacao"] or ""
+    return {item_id: campos for item_id, campos in por_id.items() if campos}
+
+
+def atualizar_itens(cur, alteracoes):
+    """
+    Grava de uma vez várias alterações de itens do mapa. Cada alteração é um
+    dict com "id" (ou "item_id") e qualquer um de separado, forcar_conferido,
+    qtd_separada, faltou, observacao e sobrando; campo ausente fica como está.
+    Um único UPDATE ... FROM (VALUES ...) na transação de `cur` (quem chama
+    faz o commit). Retorna as linhas gravadas (id, numero_carga e os campos
+    da separação), na ordem dos ids; ids que não existem ficam de fora.
+    """
+    por_id = _normalizar_alteracoes(alteracoes)
+    if not por_id:
+        return []
+    if len(por_id) > MAX_ITENS_ATUALIZACAO:
+        raise ValueError(f"Máximo de {MAX_ITENS_ATUALIZACAO} itens por lote.")
+
+    # Cada campo vai em duas colunas: se veio (tem_x) e o valor. Assim dá
+    # para gravar NULL (ex.: limpar a qtd_separada) sem confundir com "não mexer"
+    linhas = []
+    for item_id in sorted(por_id):
+        campos = por_id[item_id]
+        linha = [item_id]
+        for campo, _tipo in _CAMPOS_SEPARACAO:
+            linha += [campo in campos, campos.get(campo)]
+        linhas.append(tuple(linha))
+    colunas = ["id"] + [f"{prefixo}{campo}" for campo, _tipo in _CAMPOS_SEPARACAO
+                        for prefixo in ("tem_", "")]
+    # Os tipos vão no template: o VALUES não tem de onde inferir (NULL vira text)
+    template = "(%s::integer, " + ", ".join(f"%s::boolean, %s::{tipo}" for _campo, tipo in _CAMPOS_SEPARACAO) + ")"
+
+    atribuicoes = []
+    for campo, _tipo in _CAMPOS_SEPARACAO:
+        valor = f"CASE WHEN v.tem_{campo} THEN v.{campo} ELSE i.{campo} END"
+        if campo == "faltou":
+            # Mesma regra da atualização item a item: faltou se separou menos que o pedido
+            valor = ("CASE WHEN v.qtd_separada IS NOT NULL THEN v.qtd_separada < COALESCE(i.qtd_unidades, 0) "
+                     "WHEN v.tem_faltou THEN v.faltou ELSE i.faltou END")
+        atribuicoes.append(f"{campo} = {valor}")
+    retorno = ", ".join(f"i.{campo}" for campo, _tipo in _CAMPOS_SEPARACAO)
+
+    gravados = execute_values(cur, f"""
+        UPDATE carga_itens i
+           SET {", ".join(atribuicoes)}
+          FROM (VALUES %s) AS v ({", ".join(colunas)})
+         WHERE i.id = v.id
+        RETURNING i.id, i.numero_carga, {retorno}
+    """, linhas, template=template, page_size=len(linhas), fetch=True)
+    colunas_retorno = ["id", "numero_carga"] + [campo for campo, _tipo in _CAMPOS_SEPARACAO]
+    gravados = [r if isinstance(r, dict) else dict(zip(colunas_retorno, r)) for r in gravados]
+    return sorted(gravados, key=lambda r: r["id"])
@@ -1,19 +1,34 @@
 # Arquivo: parser_mapa.py (Versão com mais filtros de cabeçalho)
 
 import re
-from typing import Dict, List, Tuple, Any
+from typing import Dict, Iterator, List, Tuple, Any
 
 try:
     import fitz  # PyMuPDF
 except ImportError:
     raise RuntimeError("PyMuPDF (fitz) não encontrado. Instale com: pip install pymupdf")
 
+try:
+    from conferencia_app.layout_pdf import LayoutPagina, TabelaPalavras
+    from conferencia_app.pool_extracao import iterar_no_pool, numero_de_workers
+except ImportError:
+    from .layout_pdf import LayoutPagina, TabelaPalavras
+    from .pool_extracao import iterar_no_pool, numero_de_workers
+
+# Versão do parser: gravada junto com o resultado no cache_parse.
+# Suba o número sempre que uma mudança alterar a saída de parse_mapa.
+VERSAO_PARSER = "1"
+
 # ===== Constantes de Layout e Padrões =====
 X_FABRICANTE = 430
 X_QUANTIDADE = 500
 Y_LINE_TOLERANCE = 4
 GRUPO_CODE_PATTERN = re.compile(r"([A-Z]{2,}\d{1,2})")
 
+# parse_mapa_paralelo: abaixo disso o custo dos processos não compensa
+MIN_PAGINAS_PARALELO = 8
+FAIXAS_POR_WORKER = 2
+
 # ===== PONTO DA CORREÇÃO AQUI =====
 # Adicionadas as novas palavras-chave para serem ignoradas
 HEADER_KEYWORDS = [
@@ -28,124 +43,237 @@ def _clean(s: str) -> str:
     return re.sub(r"\s+", " ", s).strip()
 
 def group_words_into_lines(words: list, y_tolerance: int) -> List[List[Tuple]]:
-    if not words: return []
-    lines = []
-    words.sort(key=lambda w: (w[1], w[0]))
-    
-    current_line = [words[0]]
-    last_y = words[0][1]
-
-    for i in range(1, len(words)):
-        word = words[i]
-        y0 = word[1]
-        
-        if abs(y0 - last_y) <= y_tolerance:
-            current_line.append(word)
-        else:
-            lines.append(sorted(current_line, key=lambda w: w[0]))
-            current_line = [word]
-        
-        last_y = y0
-        
-    lines.append(sorted(current_line, key=lambda w: w[0]))
-    return lines
+    """Linhas visuais como listas de palavras (x0, y0, x1, y1, texto); ver layout_pdf."""
+    tabela = TabelaPalavras.de_palavras(words)
+    return [tabela.palavras(linha) for linha in tabela.linhas_encadeadas(y_tolerance)]
 
 # ===== PARSER PRINCIPAL =====
-def parse_mapa(pdf_path: str) -> Tuple[Dict[str, str], Any, List[Dict[str, str]], List[Dict[str, Any]]]:
-    doc = fitz.open(pdf_path)
-    header, itens = {}, []
-    grupo_codigo_atual = "GERAL"
-    grupos = [{"grupo_codigo": "GERAL", "grupo_titulo": "ITENS SEM GRUPO"}]
-
-    for page_num, page in enumerate(doc):
-        if page_num == 0:
-            text = page.get_text("text")
-            m = re.search(r"N[uú]mero da Carga:\s*(\d+)", text, re.I); header["numero_carga"] = m.group(1).strip() if m else ""
-            m = re.search(r"Data Emiss[aã]o:\s*([\d/]+)", text, re.I); header["data"] = m.group(1).strip() if m else ""
-            m = re.search(r"Motorista:\s*(.+)", text, re.I); header["motorista"] = _clean(m.group(1)) if m else ""
-            m = re.search(r"Desc\.?\s*Romaneio:\s*(.+)", text, re.I); header["romaneio"] = _clean(m.group(1)) if m else ""
-
-        words = page.get_text("words")
-        visual_lines = group_words_into_lines(words, Y_LINE_TOLERANCE)
-
-        for line_words in visual_lines:
-            full_line_text = " ".join(w[4] for w in line_words)
-            
-            if any(keyword in full_line_text for keyword in HEADER_KEYWORDS):
-                continue
+# O parser é feito em duas etapas para poder rodar as páginas em paralelo:
+#   1. _classificar_paginas: cada página vira uma lista de linhas já
+#      classificadas, ("grupo", código, título) ou ("item", item), sem saber
+#      em que grupo a página começa. Não depende das outras páginas.
+#   2. _mesclar: percorre as linhas na ordem do documento levando o grupo
+#      atual de uma página para a outra, como o laço sequencial fazia.
 
-            if not full_line_text or "Cód. Barras" in full_line_text:
-                continue
-            
-            desc_parts, fab_parts, qtd_parts = [], [], []
-            for x0, _, _, _, text, *_ in line_words:
-                if x0 < X_FABRICANTE: desc_parts.append(text)
-                elif x0 < X_QUANTIDADE: fab_parts.append(text)
-                else: qtd_parts.append(text)
+def _cabecalho(text: str) -> Dict[str, str]:
+    header = {}
+    m = re.search(r"N[uú]mero da Carga:\s*(\d+)", text, re.I); header["numero_carga"] = m.group(1).strip() if m else ""
+    m = re.search(r"Data Emiss[aã]o:\s*([\d/]+)", text, re.I); header["data"] = m.group(1).strip() if m else ""
+    m = re.search(r"Motorista:\s*(.+)", text, re.I); header["motorista"] = _clean(m.group(1)) if m else ""
+    m = re.search(r"Desc\.?\s*Romaneio:\s*(.+)", text, re.I); header["romaneio"] = _clean(m.group(1)) if m else ""
+    return header
 
-            full_desc = _clean(" ".join(desc_parts))
-            fabricante = _clean(" ".join(fab_parts))
-            quantidade = _clean(" ".join(qtd_parts))
 
-            if not re.search(r'[a-zA-Z]', full_desc):
-                continue
+def _classificar_pagina(layout: LayoutPagina) -> List[Tuple]:
+    tabela = layout.palavras
+    textos = tabela.texto
+    colunas = tabela.colunas((X_FABRICANTE, X_QUANTIDADE)).tolist()
+    linhas = []
 
-            match_grupo_code = GRUPO_CODE_PATTERN.match(full_desc)
-            is_group_line = (match_grupo_code and not fabricante and not quantidade)
+    for linha in tabela.linhas_encadeadas(Y_LINE_TOLERANCE):
+        linha = linha.tolist()
+        full_line_text = " ".join(textos[i] for i in linha)
+        
+        if any(keyword in full_line_text for keyword in HEADER_KEYWORDS):
+            continue
 
-            if not quantidade and not is_group_line:
-                continue
+        if not full_line_text or "Cód. Barras" in full_line_text:
+            continue
+        
+        desc_parts, fab_parts, qtd_parts = [], [], []
+        partes = (desc_parts, fab_parts, qtd_parts)
+        for i in linha:
+            partes[colunas[i]].append(textos[i])
 
-            is_item_with_group = (match_grupo_code and (fabricante or quantidade))
+        full_desc = _clean(" ".join(desc_parts))
+        fabricante = _clean(" ".join(fab_parts))
+        quantidade = _clean(" ".join(qtd_parts))
 
-            if is_group_line or is_item_with_group:
-                grupo_codigo_atual = match_grupo_code.group(1)
-                temp_desc = GRUPO_CODE_PATTERN.sub('', full_desc).strip()
-                titulo_grupo = re.sub(r"^-?\s*", "", temp_desc)
+        if not re.search(r'[a-zA-Z]', full_desc):
+            continue
 
-                if not any(g['grupo_codigo'] == grupo_codigo_atual for g in grupos):
-                    grupos.append({"grupo_codigo": grupo_codigo_atual, "grupo_titulo": titulo_grupo})
-                
-                if is_group_line:
-                    continue
-                
-                full_desc = titulo_grupo
-            
-            if not full_desc: continue
-            
-            item = {"grupo_codigo": grupo_codigo_atual, "fabricante": fabricante}
+        match_grupo_code = GRUPO_CODE_PATTERN.match(full_desc)
+        is_group_line = (match_grupo_code and not fabricante and not quantidade)
+
+        if not quantidade and not is_group_line:
+            continue
+
+        is_item_with_group = (match_grupo_code and (fabricante or quantidade))
+
+        if is_group_line or is_item_with_group:
+            temp_desc = GRUPO_CODE_PATTERN.sub('', full_desc).strip()
+            titulo_grupo = re.sub(r"^-?\s*", "", temp_desc)
+            linhas.append(("grupo", match_grupo_code.group(1), titulo_grupo))
             
-            desc_words = full_desc.split()
-            if desc_words:
-                if re.match(r"^\d{12,14}$", desc_words[0]):
-                    item["cod_barras"] = desc_words.pop(0)
-                
-                if desc_words and re.match(r"^\d{3,}$", desc_words[0]):
-                    item["codigo"] = desc_words.pop(0)
-
-            item["descricao"] = " ".join(desc_words)
+            if is_group_line:
+                continue
             
-            item["qtd_unidades"] = 0; item["unidade"] = "UN"
-            match_unidade = re.match(r'(\d+)\s*([A-Z]+)', quantidade);
-            if match_unidade:
-                item["qtd_unidades"] = int(match_unidade.group(1))
-                item["unidade"] = match_unidade.group(2).upper()
+            full_desc = titulo_grupo
+        
+        if not full_desc: continue
+        
+        # O grupo do item só é conhecido na mescla (pode vir da página anterior)
+        item = {"grupo_codigo": None, "fabricante": fabricante}
+        
+        desc_words = full_desc.split()
+        if desc_words:
+            if re.match(r"^\d{12,14}$", desc_words[0]):
+                item["cod_barras"] = desc_words.pop(0)
             
-            item["pack_qtd"] = 1; item["pack_unid"] = "UN"
-            match_pack = re.search(r'C/\s*(\d+)', quantidade, re.I)
-            if match_pack: item["pack_qtd"] = int(match_pack.group(1))
+            if desc_words and re.match(r"^\d{3,}$", desc_words[0]):
+                item["codigo"] = desc_words.pop(0)
 
-            if item.get("descricao") or item.get("codigo"):
+        item["descricao"] = " ".join(desc_words)
+        
+        item["qtd_unidades"] = 0; item["unidade"] = "UN"
+        match_unidade = re.match(r'(\d+)\s*([A-Z]+)', quantidade);
+        if match_unidade:
+            item["qtd_unidades"] = int(match_unidade.group(1))
+            item["unidade"] = match_unidade.group(2).upper()
+        
+        item["pack_qtd"] = 1; item["pack_unid"] = "UN"
+        match_pack = re.search(r'C/\s*(\d+)', quantidade, re.I)
+        if match_pack: item["pack_qtd"] = int(match_pack.group(1))
+
+        if item.get("descricao") or item.get("codigo"):
+            linhas.append(("item", item))
+
+    return linhas
+
+
+def _ler(pdf):
+    """Caminho, bytes ou arquivo aberto (ex.: o upload do Flask): lê o arquivo aberto para bytes."""
+    if hasattr(pdf, "read"):
+        return pdf.read()
+    if isinstance(pdf, (bytearray, memoryview)):
+        return bytes(pdf)
+    return pdf
+
+
+def _abrir(pdf) -> "fitz.Document":
+    if isinstance(pdf, bytes):
+        return fitz.open(stream=pdf, filetype="pdf")
+    return fitz.open(pdf)
+
+
+def _classificar_paginas(pdf, inicio: int, fim: int) -> Tuple[Dict[str, str], List[List[Tuple]]]:
+    """Etapa 1 para as páginas [inicio, fim). Também lê o cabeçalho se inclui a página 0."""
+    doc = _abrir(pdf)
+    try:
+        header, paginas = None, []
+        for page_num in range(inicio, min(fim, len(doc))):
+            layout = LayoutPagina(doc[page_num])
+            if page_num == 0:
+                header = _cabecalho(layout.texto)
+            paginas.append(_classificar_pagina(layout))
+        return header, paginas
+    finally:
+        doc.close()
+
+
+GRUPO_GERAL = {"grupo_codigo": "GERAL", "grupo_titulo": "ITENS SEM GRUPO"}
+
+
+class _Mescla:
+    """Etapa 2: aplica a continuidade dos grupos, uma página por vez e na ordem."""
+
+    def __init__(self):
+        self.grupo_codigo_atual = "GERAL"
+        self.vistos = set()
+
+    def pagina(self, linhas) -> Tuple[List[Dict[str, str]], List[Dict[str, Any]]]:
+        """Grupos que aparecem pela primeira vez nesta página e os itens dela."""
+        grupos, itens = [], []
+        if not self.vistos:
+            self.vistos.add("GERAL")
+            grupos.append(dict(GRUPO_GERAL))
+        for linha in linhas:
+            if linha[0] == "grupo":
+                _, self.grupo_codigo_atual, titulo_grupo = linha
+                if self.grupo_codigo_atual not in self.vistos:
+                    self.vistos.add(self.grupo_codigo_atual)
+                    grupos.append({"grupo_codigo": self.grupo_codigo_atual, "grupo_titulo": titulo_grupo})
+            else:
+                item = linha[1]
+                item["grupo_codigo"] = self.grupo_codigo_atual
                 itens.append(item)
+        return grupos, itens
+
 
+def iterar_mapa(pdf) -> Iterator[Dict[str, Any]]:
+    """
+    Lê o mapa página a página. `pdf` pode ser caminho, bytes ou arquivo aberto.
+    Cada página rende {"pagina", "header" (só na 0, senão None), "grupos"
+    (os que aparecem pela primeira vez), "itens"}; só uma página fica em
+    memória por vez, e quem consome pode ir gravando enquanto o resto é lido.
+    """
+    doc = _abrir(_ler(pdf))
+    try:
+        mescla = _Mescla()
+        for page_num, page in enumerate(doc):
+            layout = LayoutPagina(page)
+            header = _cabecalho(layout.texto) if page_num == 0 else None
+            grupos, itens = mescla.pagina(_classificar_pagina(layout))
+            yield {"pagina": page_num, "header": header, "grupos": grupos, "itens": itens}
+    finally:
+        doc.close()
+
+
+def iterar_mapa_paralelo(pdf, max_workers: int = None) -> Iterator[Dict[str, Any]]:
+    """
+    Como iterar_mapa, com as páginas divididas em faixas contíguas
+    classificadas nos processos do pool de extração; as páginas saem na
+    ordem assim que a faixa delas fica pronta. Mapas pequenos (ou um worker
+    só) seguem pelo caminho sequencial.
+    """
+    pdf = _ler(pdf)
+    if max_workers is None:
+        max_workers = numero_de_workers()
+    doc = _abrir(pdf)
+    total = len(doc)
     doc.close()
-    return header, None, grupos, itens
+    if max_workers <= 1 or total < MIN_PAGINAS_PARALELO:
+        yield from iterar_mapa(pdf)
+        return
+
+    # Algumas faixas a mais que workers, para um processo lento não segurar o fim
+    tamanho = max(1, -(-total // (max_workers * FAIXAS_POR_WORKER)))
+    faixas = [(pdf, inicio, inicio + tamanho) for inicio in range(0, total, tamanho)]
+    mescla = _Mescla()
+    page_num = 0
+    for header, paginas in iterar_no_pool(_classificar_paginas, faixas, max_workers):
+        for linhas in paginas:
+            grupos, itens = mescla.pagina(linhas)
+            yield {"pagina": page_num, "header": header if page_num == 0 else None,
+                   "grupos": grupos, "itens": itens}
+            page_num += 1
+
+
+def juntar_paginas(paginas) -> Tuple[Dict[str, str], Any, List[Dict[str, str]], List[Dict[str, Any]]]:
+    """Junta o que iterar_mapa rende no formato de parse_mapa: (header, None, grupos, itens)."""
+    header, grupos, itens = {}, [], []
+    for pagina in paginas:
+        if pagina["header"] is not None:
+            header = pagina["header"]
+        grupos.extend(pagina["grupos"])
+        itens.extend(pagina["itens"])
+    return header, None, grupos or [dict(GRUPO_GERAL)], itens
+
+
+def parse_mapa(pdf) -> Tuple[Dict[str, str], Any, List[Dict[str, str]], List[Dict[str, Any]]]:
+    """Mapa inteiro de uma vez; `pdf` pode ser caminho, bytes ou arquivo aberto."""
+    return juntar_paginas(iterar_mapa(pdf))
+
+
+def parse_mapa_paralelo(pdf, max_workers: int = None) -> Tuple[Dict[str, str], Any, List[Dict[str, str]], List[Dict[str, Any]]]:
+    """Mesmo resultado de parse_mapa, classificando as páginas no pool de extração."""
+    return juntar_paginas(iterar_mapa_paralelo(pdf, max_workers))
 
 
-def debug_extrator(pdf_path: str):
-    doc = fitz.open(pdf_path)
+def debug_extrator(pdf):
+    doc = _abrir(_ler(pdf))
     rows = []
     for page in doc:
         rows.extend(page.get_text("text").splitlines())
     doc.close()
-    return [{"n": i + 1, "line": line, "parsed": {}} for i, line in enumerate(rows)]
\ No newline at end of file
+    return [{"n": i + 1, "line": line, "parsed": {}} for i, line in enumerate(rows)]
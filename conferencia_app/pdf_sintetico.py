@@ -0,0 +1,217 @@
+# Arquivo: pdf_sintetico.py
+# PDFs de pedido e de mapa de carga gerados com PyMuPDF, no layout dos reais.
+#
+# Servem para o benchmark de extração e para o corpus de regressão
+# (conferencia_app/golden): com a mesma semente o PDF sai sempre igual, então
+# dá para medir velocidade com qualquer número de páginas/itens e comparar a
+# saída dos parsers com a gravada. Cada gerador devolve também o gabarito
+# (o que foi escrito no PDF), para medir quantos itens o parser acertou.
+#
+# Uso (a partir da raiz do repositório):
+#   python -m conferencia_app.pdf_sintetico pedido saida.pdf [--paginas 3] [--itens 30] [--semente 0]
+#   python -m conferencia_app.pdf_sintetico mapa saida.pdf [--paginas 20] [--itens 70]
+
+import argparse
+import random
+import sys
+
+import fitz  # PyMuPDF
+
+LARGURA, ALTURA = 595, 842  # A4 em pontos
+Y_RODAPE = 800
+
+CLIENTES = ["MERCADO BOM PRECO", "SUPERMERCADO CENTRAL", "MERCEARIA SAO JOSE", "ATACADO DO NORTE", "PADARIA PAO QUENTE"]
+VENDEDORES = ["JOAO", "MARIA", "CARLOS", "ANA", "PEDRO"]
+MOTORISTAS = ["JOSE DA SILVA", "ANTONIO PEREIRA", "FRANCISCO SOUZA"]
+ROTAS = ["ROTA NORTE", "ROTA SUL", "CENTRO LESTE"]
+FABRICANTES = ["NESTLE", "AMBEV", "UNILEVER", "PEPSICO", "BRF"]
+PRODUTOS = ["BISCOITO RECHEADO", "REFRIGERANTE COLA", "SABAO EM PO", "CAFE TORRADO", "MACARRAO ESPAGUETE",
+            "ARROZ TIPO 1", "FEIJAO CARIOCA", "OLEO DE SOJA", "LEITE INTEGRAL", "ACHOCOLATADO"]
+SABORES = ["MORANGO", "CHOCOLATE", "ORIGINAL", "LIMAO", "BAUNILHA", "TRADICIONAL"]
+EMBALAGENS = [("CX", 12), ("CX", 24), ("FD", 6), ("PCT", 10), ("UN", 1)]
+
+
+def _reais(valor):
+    return f"{valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def _ean(aleatorio):
+    return "789" + "".join(str(aleatorio.randrange(10)) for _ in range(10))
+
+
+def _nome_produto(aleatorio):
+    return f"{aleatorio.choice(PRODUTOS)} {aleatorio.choice(SABORES)} {aleatorio.randrange(100, 999)}G"
+
+
+def gerar_pedido(paginas=1, itens_por_pagina=30, semente=0):
+    """
+    PDF de pedido: cabeçalho (Pedido/Cliente/Cond. Pgto, endereço com o
+    vendedor, quadro "Vendedor"), tabela "ITEM CÓD. BARRAS" em todas as
+    páginas e "TOTAL GERAL:" + "**POR GENTILEZA" no fim.
+    Retorna (bytes do PDF, gabarito).
+    """
+    aleatorio = random.Random(semente)
+    numero_pedido = str(100000 + aleatorio.randrange(900000))
+    cliente = aleatorio.choice(CLIENTES)
+    vendedor = aleatorio.choice(VENDEDORES)
+    produtos = []
+    total_geral = 0.0
+
+    doc = fitz.open()
+    item = 0
+    for numero_pagina in range(paginas):
+        pagina = doc.new_page(width=LARGURA, height=ALTURA)
+        y = 40
+        if numero_pagina == 0:
+            pagina.insert_text((40, y), f"Pedido: {numero_pedido}\nCliente: {cliente} Cond. Pgto: 30 DIAS",
+                               fontsize=9)
+            pagina.insert_text((300, y), "Vendedor", fontsize=9)
+            pagina.insert_text((300, y + 14), vendedor, fontsize=9)
+            y += 40
+            pagina.insert_text((40, y), f"Rua Minas Gerais, {aleatorio.randrange(1, 999)} {vendedor} Centro",
+                               fontsize=8)
+            y += 24
+        pagina.insert_text((20, y), "ITEM CÓD. BARRAS", fontsize=8)
+        pagina.insert_text((150, y), "DESCRIÇÃO", fontsize=8)
+        pagina.insert_text((360, y), "QUANTIDADE", fontsize=8)
+        pagina.insert_text((460, y), "UNIT. TOTAL", fontsize=8)
+        y += 16
+
+        for _ in range(itens_por_pagina):
+            if y > Y_RODAPE - 30:
+                break
+            item += 1
+            ean = _ean(aleatorio)
+            nome = _nome_produto(aleatorio)
+            unidade, por_pacote = aleatorio.choice(EMBALAGENS)
+            pacotes = aleatorio.randrange(1, 40)
+            quantidade = f"{pacotes} {unidade} C/{por_pacote}" if por_pacote > 1 else f"{pacotes} {unidade}"
+            unitario = aleatorio.randrange(300, 30000) / 100
+            total = round(unitario * pacotes, 2)
+            total_geral += total
+            # A ordem de escrita é a do PDF real: item, código, quantidade,
+            # valores e por último a descrição (o extrator antigo depende dela)
+            pagina.insert_text((20, y), f"{item:02d}", fontsize=7)
+            pagina.insert_text((50, y), ean, fontsize=7)
+            pagina.insert_text((360, y), quantidade, fontsize=7)
+            pagina.insert_text((460, y), f"R$ {_reais(unitario)} R$ {_reais(total)}", fontsize=7)
+            pagina.insert_text((150, y), nome, fontsize=7)
+            produtos.append({"produto_nome": nome, "codigo_barras": ean, "quantidade_pedida": quantidade,
+                             "valor_total_item": _reais(total), "unidades_pacote": por_pacote})
+            y += 12
+
+        if numero_pagina == paginas - 1:
+            y += 8
+            pagina.insert_text((360, y), f"TOTAL GERAL: R$ {_reais(total_geral)}", fontsize=8)
+            pagina.insert_text((40, y + 20), "**POR GENTILEZA CONFERIR A MERCADORIA NO ATO DA ENTREGA", fontsize=7)
+        pagina.insert_text((500, Y_RODAPE + 20), f"Pág. {numero_pagina + 1}/{paginas}", fontsize=7)
+
+    conteudo = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    gabarito = {"numero_pedido": numero_pedido, "nome_cliente": cliente, "vendedor": vendedor,
+                "paginas": paginas, "produtos": produtos}
+    return conteudo, gabarito
+
+
+def gerar_mapa(paginas=1, itens_por_pagina=70, semente=0):
+    """
+    PDF de mapa de separação: cabeçalho da carga na primeira página, linhas
+    de grupo ("CX01 - ...") e itens com código de barras, código, descrição,
+    fabricante e quantidade, com o desalinhamento vertical dos PDFs reais.
+    Retorna (bytes do PDF, gabarito).
+    """
+    aleatorio = random.Random(semente)
+    numero_carga = str(1000 + aleatorio.randrange(9000))
+    motorista = aleatorio.choice(MOTORISTAS)
+    romaneio = aleatorio.choice(ROTAS)
+    grupos, itens = [], []
+    grupo_atual = "GERAL"
+
+    doc = fitz.open()
+    for numero_pagina in range(paginas):
+        pagina = doc.new_page(width=LARGURA, height=ALTURA)
+        y = 40
+        if numero_pagina == 0:
+            for linha in ("SEPARAÇÃO DE CARGA", f"Número da Carga: {numero_carga}", "Data Emissão: 05/03/2026",
+                          f"Motorista: {motorista}", f"Desc. Romaneio: {romaneio}"):
+                pagina.insert_text((30, y), linha, fontsize=8)
+                y += 12
+        pagina.insert_text((30, y), "Cód. Barras Código Descrição", fontsize=8)
+        pagina.insert_text((440, y), "Fabricante", fontsize=8)
+        pagina.insert_text((510, y), "Qtd", fontsize=8)
+        y += 14
+
+        for _ in range(itens_por_pagina):
+            if y > Y_RODAPE:
+                break
+            if aleatorio.random() < 0.12:
+                n = len(grupos) + 1
+                # O parser só aceita até 2 dígitos no código do grupo
+                prefixo = "CX" if n < 100 else "CX" + chr(ord("A") + n // 100 - 1)
+                grupo_atual = f"{prefixo}{n % 100:02d}"
+                titulo = f"GRUPO {aleatorio.choice(ROTAS)} {n}"
+                grupos.append({"grupo_codigo": grupo_atual, "grupo_titulo": titulo})
+                pagina.insert_text((30, y), f"{grupo_atual} - {titulo}", fontsize=8)
+                y += 13
+
+            def desvio():
+                return aleatorio.uniform(0, 3.9)
+
+            ean = _ean(aleatorio)
+            codigo = str(aleatorio.randrange(1000, 99999))
+            descricao = _nome_produto(aleatorio)
+            fabricante = aleatorio.choice(FABRICANTES)
+            unidade, por_pacote = aleatorio.choice(EMBALAGENS)
+            quantidade = aleatorio.randrange(1, 99)
+            pagina.insert_text((30, y + desvio()), ean, fontsize=7)
+            pagina.insert_text((100, y + desvio()), codigo, fontsize=7)
+            pagina.insert_text((140, y + desvio()), descricao, fontsize=7)
+            pagina.insert_text((440, y + desvio()), fabricante, fontsize=7)
+            pagina.insert_text((510, y + desvio()), f"{quantidade} {unidade} C/{por_pacote}", fontsize=7)
+            itens.append({"grupo_codigo": grupo_atual, "cod_barras": ean, "codigo": codigo, "descricao": descricao,
+                          "fabricante": fabricante, "qtd_unidades": quantidade, "unidade": unidade,
+                          "pack_qtd": por_pacote})
+            y += aleatorio.choice([9, 10, 11, 12])
+        pagina.insert_text((30, Y_RODAPE + 20), f"PAG.: {numero_pagina + 1}", fontsize=7)
+
+    conteudo = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    gabarito = {"numero_carga": numero_carga, "motorista": motorista, "romaneio": romaneio,
+                "paginas": paginas, "grupos": grupos, "itens": itens}
+    return conteudo, gabarito
+
+
+GERADORES = {"pedido": gerar_pedido, "mapa": gerar_mapa}
+
+# Corpus fixo do teste de regressão: (nome, tipo, páginas, itens por página, semente).
+# Mudar uma linha aqui muda o PDF; rode o golden com --atualizar depois.
+CORPUS = [
+    ("pedido_1p", "pedido", 1, 20, 1),
+    ("pedido_3p", "pedido", 3, 45, 2),
+    ("mapa_1p", "mapa", 1, 70, 3),
+    ("mapa_8p", "mapa", 8, 70, 4),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera PDFs sintéticos de pedido ou de mapa")
+    parser.add_argument("tipo", choices=sorted(GERADORES))
+    parser.add_argument("saida", help="caminho do PDF a gravar")
+    parser.add_argument("--paginas", type=int, default=1)
+    parser.add_argument("--itens", type=int, default=None, help="itens por página (o que couber)")
+    parser.add_argument("--semente", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    opcoes = {"paginas": args.paginas, "semente": args.semente}
+    if args.itens is not None:
+        opcoes["itens_por_pagina"] = args.itens
+    conteudo, gabarito = GERADORES[args.tipo](**opcoes)
+    with open(args.saida, "wb") as f:
+        f.write(conteudo)
+    total = len(gabarito.get("produtos") or gabarito.get("itens"))
+    print(f"{args.saida}: {args.tipo}, {args.paginas} página(s), {total} item(ns)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+# Arquivo: pool_extracao.py
+# Pool de processos para extrair vários PDFs de pedido ao mesmo tempo.
+# O upload de uma carga grande deixa de processar arquivo por arquivo dentro
+# da thread da requisição: cada PDF vai para um processo do pool e os
+# resultados voltam na mesma ordem em que os arquivos foram enviados.
+# O mesmo pool atende o parser de mapa em paralelo (iterar_no_pool).
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from conferencia_app.extrator_pedido import extrair_dados_do_pdf
+except ImportError:
+    from .extrator_pedido import extrair_dados_do_pdf
+
+# Abaixo disso não compensa mandar para o pool (custo de IPC > ganho)
+MIN_ARQUIVOS_PARALELO = 2
+
+_pool = None
+_pool_pid = None
+_pool_workers = None
+
+
+def numero_de_workers() -> int:
+    """Quantidade de processos do pool (variável EXTRACAO_WORKERS ou nº de núcleos)."""
+    valor = os.environ.get("EXTRACAO_WORKERS")
+    try:
+        n = int(valor) if valor else (os.cpu_count() or 1)
+    except ValueError:
+        n = os.cpu_count() or 1
+    return max(1, n)
+
+
+def _contexto_mp():
+    # 'forkserver' evita herdar threads e conexões abertas do worker do gunicorn
+    metodos = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in metodos else "spawn")
+
+
+def _obter_pool(max_workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_pid, _pool_workers
+    # O gunicorn faz fork dos workers depois do import: cada processo cria o seu pool
+    if _pool is None or _pool_pid != os.getpid() or _pool_workers != max_workers:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=_contexto_mp())
+        _pool_pid = os.getpid()
+        _pool_workers = max_workers
+    return _pool
+
+
+def encerrar_pool():
+    """Finaliza o pool do processo atual (usado no benchmark e em testes manuais)."""
+    global _pool, _pool_pid, _pool_workers
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.shutdown(wait=True)
+    _pool = _pool_pid = _pool_workers = None
+
+
+def extrair_em_paralelo(arquivos, nome_da_carga, max_workers=None):
+    """
+    Extrai uma lista de PDFs de pedido.
+
+    `arquivos` é uma lista de tuplas (nome_arquivo, pdf_bytes). Retorna uma
+    lista com o resultado de `extrair_dados_do_pdf` de cada arquivo, na mesma
+    ordem da entrada. Uma falha em um arquivo vira {"erro": ...} só nele.
+    """
+    if max_workers is None:
+        max_workers = numero_de_workers()
+
+    if max_workers <= 1 or len(arquivos) < MIN_ARQUIVOS_PARALELO:
+        return [extrair_dados_do_pdf(stream=pdf_bytes, nome_da_carga=nome_da_carga, nome_arquivo=nome_arquivo)
+                for nome_arquivo, pdf_bytes in arquivos]
+
+    pool = _obter_pool(max_workers)
+    futuros = [pool.submit(extrair_dados_do_pdf, pdf_bytes, nome_da_carga, nome_arquivo)
+               for nome_arquivo, pdf_bytes in arquivos]
+
+    resultados = []
+    pool_quebrado = False
+    for futuro in futuros:
+        try:
+            resultados.append(futuro.result())
+        except BrokenProcessPool as e:
+            pool_quebrado = True
+            resultados.append({"erro": f"Processo de extração interrompido: {e}"})
+        except Exception as e:
+            resultados.append({"erro": f"Falha no processo de extração: {e}"})
+
+    if pool_quebrado:
+        # Um processo morreu (ex.: falta de memória); o próximo upload recria o pool
+        encerrar_pool()
+    return resultados
+
+
+def iterar_no_pool(funcao, tarefas, max_workers=None):
+    """
+    Roda `funcao(*args)` para cada tupla de `tarefas` no pool e rende os
+    resultados na ordem das tarefas, cada um assim que fica pronto. Diferente
+    de extrair_em_paralelo, uma falha é repassada para quem chamou (o
+    resultado não faria sentido pela metade). Se quem consome parar antes
+    do fim, as tarefas que ainda não começaram são canceladas.
+    """
+    if max_workers is None:
+        max_workers = numero_de_workers()
+    pool = _obter_pool(max_workers)
+    futuros = [pool.submit(funcao, *args) for args in tarefas]
+    try:
+        for futuro in futuros:
+            yield futuro.result()
+    except BrokenProcessPool:
+        encerrar_pool()
+        raise
+    finally:
+        for futuro in futuros:
+            futuro.cancel()
+
+
+def executar_no_pool(funcao, tarefas, max_workers=None):
+    """Como iterar_no_pool, devolvendo a lista completa."""
+    return list(iterar_no_pool(funcao, tarefas, max_workers))
@@ -0,0 +1,86 @@
+# Arquivo: registro_cargas.py
+# Registro das cargas de pedidos com contadores mantidos na hora.
+#
+# A tela inicial da conferência listava as cargas com SELECT DISTINCT sobre
+# a tabela pedidos inteira. Agora cada carga tem uma linha em registro_cargas
+# com quantos pedidos tem, quantos estão finalizados, quantos itens foram
+# cortados e quando houve atividade, atualizada no upload (inserir_itens) e
+# a cada mudança de status (itens_pedido._ajustar_pendentes).
+
+# A última atividade é regravada no máximo uma vez por este intervalo quando
+# nenhum contador muda, para as bipagens não disputarem a linha da carga.
+INTERVALO_ATIVIDADE = "1 minute"
+
+
+def recalcular(cur, nome_da_carga=None):
+    """Refaz os contadores a partir de pedidos/pedido_itens (uma carga ou todas)."""
+    filtro = "WHERE p.nome_da_carga = %(carga)s" if nome_da_carga is not None else "WHERE p.nome_da_carga IS NOT NULL"
+    parametros = {"carga": nome_da_carga}
+    cur.execute("""
+        DELETE FROM registro_cargas r
+         WHERE (%(carga)s::TEXT IS NULL OR r.nome_da_carga = %(carga)s)
+           AND NOT EXISTS (SELECT 1 FROM pedidos p WHERE p.nome_da_carga = r.nome_da_carga);
+    """, parametros)
+    cur.execute(f"""
+        INSERT INTO registro_cargas (nome_da_carga, pedidos, finalizados, cortes, ultima_atividade)
+        SELECT p.nome_da_carga, COUNT(*),
+               COUNT(*) FILTER (WHERE p.status_conferencia = 'Finalizado'),
+               COALESCE(SUM(c.cortes), 0), NOW()
+          FROM pedidos p
+          CROSS JOIN LATERAL (
+              -- mesmos status de itens_pedido.STATUS_CORTE
+              SELECT COUNT(*) AS cortes FROM pedido_itens i
+               WHERE i.numero_pedido = p.numero_pedido AND i.status IN ('Corte Parcial', 'Corte Total')
+          ) c
+          {filtro}
+         GROUP BY p.nome_da_carga
+        ON CONFLICT (nome_da_carga) DO UPDATE
+           SET pedidos = EXCLUDED.pedidos, finalizados = EXCLUDED.finalizados,
+               cortes = EXCLUDED.cortes;
+    """, parametros)
+
+
+def registrar_pedido(cur, nome_da_carga, finalizado, cortes=0):
+    """Um pedido novo entrou na carga (cria a carga no registro se preciso)."""
+    if nome_da_carga is None:
+        return
+    cur.execute("""
+        INSERT INTO registro_cargas (nome_da_carga, pedidos, finalizados, cortes)
+        VALUES (%s, 1, %s, %s)
+        ON CONFLICT (nome_da_carga) DO UPDATE
+           SET pedidos = registro_cargas.pedidos + 1,
+               finalizados = registro_cargas.finalizados + EXCLUDED.finalizados,
+               cortes = registro_cargas.cortes + EXCLUDED.cortes,
+               ultima_atividade = NOW();
+    """, (nome_da_carga, int(bool(finalizado)), cortes))
+
+
+def ajustar(cur, nome_da_carga, finalizados=0, cortes=0):
+    """Aplica a variação dos contadores de uma carga e marca a atividade."""
+    if nome_da_carga is None:
+        return
+    if finalizados or cortes:
+        cur.execute("""
+            UPDATE registro_cargas
+               SET finalizados = finalizados + %s, cortes = cortes + %s, ultima_atividade = NOW()
+             WHERE nome_da_carga = %s;
+        """, (finalizados, cortes, nome_da_carga))
+    else:
+        cur.execute(f"""
+            UPDATE registro_cargas SET ultima_atividade = NOW()
+             WHERE nome_da_carga = %s AND ultima_atividade < NOW() - INTERVAL '{INTERVALO_ATIVIDADE}';
+        """, (nome_da_carga,))
+
+
+def listar(cur):
+    cur.execute("""
+        SELECT nome_da_carga, pedidos, finalizados, cortes, ultima_atividade
+          FROM registro_cargas
+         WHERE pedidos > 0
+         ORDER BY nome_da_carga;
+    """)
+    return [
+        {"nome_da_carga": nome, "pedidos": pedidos, "finalizados": finalizados, "cortes": cortes,
+         "ultima_atividade": ultima.isoformat() if ultima else None}
+        for nome, pedidos, finalizados, cortes, ultima in cur.fetchall()
+    ]
@@ -0,0 +1,135 @@
+# Arquivo: relatorio_cortes.py
+# Relatório Excel dos cortes, gerado em memória constante.
+#
+# As linhas vêm de um cursor nomeado (server-side) em lotes e vão direto
+# para uma planilha xlsxwriter em modo constant_memory, gravada em arquivo
+# temporário; a resposta é o arquivo enviado em blocos. Nem o resultado da
+# consulta nem a planilha ficam inteiros na memória do worker.
+
+import os
+import re
+import logging
+import tempfile
+from datetime import timedelta
+
+import xlsxwriter
+
+try:
+    from conferencia_app import itens_pedido
+except ImportError:
+    from . import itens_pedido
+
+logger = logging.getLogger(__name__)
+
+LINHAS_POR_LOTE = 2000
+TAMANHO_BLOCO = 64 * 1024
+
+COLUNAS = (
+    ("Pedido", 14), ("Cliente", 40), ("Vendedor", 20), ("Carga", 20), ("Produto", 45),
+    ("Quantidade Pedida", 18), ("Quantidade Entregue", 20), ("Status", 14),
+    ("Observação", 30), ("Valor Total Item", 16), ("Valor do Corte Estimado", 22),
+)
+
+
+def valor_do_corte(produto):
+    """Valor estimado do que deixou de ser entregue (mesma conta do relatório antigo)."""
+    valor_total = float(str(produto.get('valor_total_item', '0')).replace(',', '.'))
+    unidades_pacote = int(produto.get('unidades_pacote', 1))
+    match = re.match(r'(\d+)', produto.get('quantidade_pedida', '0'))
+    pacotes_pedidos = int(match.group(1)) if match else 0
+    preco_por_pacote = valor_total / pacotes_pedidos if pacotes_pedidos > 0 else 0
+    preco_unidade = preco_por_pacote / unidades_pacote if unidades_pacote > 0 else 0
+    unidades_pedidas = pacotes_pedidos * unidades_pacote
+    qtd_entregue_str = str(produto.get('quantidade_entregue', '0'))
+    unidades_entregues = int(qtd_entregue_str) if qtd_entregue_str.isdigit() else 0
+    return round((unidades_pedidas - unidades_entregues) * preco_unidade, 2)
+
+
+def _consulta(filtros):
+    """SELECT dos cortes com os filtros opcionais: carga, vendedor, de, ate (datas)."""
+    condicoes = ["i.status IN %s"]
+    parametros = [itens_pedido.STATUS_CORTE]
+    if filtros.get("carga"):
+        condicoes.append("p.nome_da_carga = %s")
+        parametros.append(filtros["carga"])
+    if filtros.get("vendedor"):
+        condicoes.append("p.vendedor ILIKE %s")
+        parametros.append(f"%{filtros['vendedor']}%")
+    if filtros.get("de"):
+        condicoes.append("p.criado_em >= %s")
+        parametros.append(filtros["de"])
+    if filtros.get("ate"):
+        # 'ate' é inclusivo: vai até o fim do dia
+        condicoes.append("p.criado_em < %s")
+        parametros.append(filtros["ate"] + timedelta(days=1))
+    sql = f"""
+        SELECT p.numero_pedido, p.nome_cliente, p.vendedor, p.nome_da_carga, {itens_pedido.SQL_COLUNAS_ITEM}
+          FROM pedido_itens i
+          JOIN pedidos p ON p.numero_pedido = i.numero_pedido
+         WHERE {" AND ".join(condicoes)}
+         ORDER BY p.id, i.indice;
+    """
+    return sql, parametros
+
+
+def escrever_planilha(conn, caminho, filtros):
+    """Grava o relatório em `caminho`. Retorna quantas linhas de corte foram escritas."""
+    sql, parametros = _consulta(filtros)
+    workbook = xlsxwriter.Workbook(caminho, {"constant_memory": True})
+    try:
+        sheet = workbook.add_worksheet("Cortes")
+        negrito = workbook.add_format({"bold": True})
+        for coluna, (titulo, largura) in enumerate(COLUNAS):
+            sheet.set_column(coluna, coluna, largura)
+            sheet.write(0, coluna, titulo, negrito)
+
+        linha = 0
+        with conn.cursor(name="relatorio_cortes") as cur:
+            cur.itersize = LINHAS_POR_LOTE
+            cur.execute(sql, parametros)
+            for numero_pedido, nome_cliente, vendedor, nome_carga, *item in cur:
+                produto = dict(zip(itens_pedido.COLUNAS_ITEM, item))
+                try:
+                    corte = valor_do_corte(produto)
+                except (ValueError, TypeError, AttributeError) as e:
+                    logger.warning(f"Erro ao calcular corte para o produto {produto.get('produto_nome', 'N/A')}: {e}")
+                    continue
+                linha += 1
+                # constant_memory exige escrever linha a linha, em ordem
+                sheet.write_row(linha, 0, (
+                    numero_pedido, nome_cliente, vendedor, nome_carga,
+                    produto.get('produto_nome') or '', produto.get('quantidade_pedida') or '',
+                    produto.get('quantidade_entregue') or '', produto.get('status') or '',
+                    produto.get('observacao') or '', produto.get('valor_total_item'), corte,
+                ))
+        conn.rollback()  # fecha a transação do cursor nomeado
+    finally:
+        workbook.close()
+    return linha
+
+
+def gerar_arquivo(conn, filtros):
+    """Gera o relatório em um arquivo temporário. Retorna (caminho, linhas)."""
+    fd, caminho = tempfile.mkstemp(prefix="cortes_", suffix=".xlsx")
+    os.close(fd)
+    try:
+        return caminho, escrever_planilha(conn, caminho, filtros)
+    except Exception:
+        os.remove(caminho)
+        raise
+
+
+def enviar_em_blocos(caminho):
+    """Lê o arquivo em blocos para a resposta e o apaga no fim (ou se o cliente desistir)."""
+    try:
+        with open(caminho, "rb") as f:
+            while True:
+                bloco = f.read(TAMANHO_BLOCO)
+                if not bloco:
+                    break
+                yield bloco
+    finally:
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
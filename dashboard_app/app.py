@@ -1,6 +1,5 @@
 import os
 import psycopg2
-import pandas as pd
 from flask import Flask, jsonify, render_template, request, Blueprint, redirect, url_for, flash
 from werkzeug.security import check_password_hash
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
@@ -15,6 +14,7 @@ from dotenv import load_dotenv
 from datetime import datetime
 import calendar
 from dateutil.relativedelta import relativedelta
+import pool_conexoes
 
 load_dotenv()
 
@@ -41,8 +41,8 @@ def get_db_connection():
     database_url = os.environ.get('DATABASE_URL')
     if database_url is None:
         raise ValueError("A variável de ambiente DATABASE_URL não foi encontrada.")
-    conn = psycopg2.connect(database_url)
-    return conn
+    # Conexão do pool compartilhado; o close() devolve ao pool (ver pool_conexoes.py)
+    return pool_conexoes.conectar()
 
 class User(UserMixin):
     def __init__(self, id, username, role):
@@ -179,6 +179,7 @@ def delete_data():
 @dashboard_bp.route("/api/upload/vendas", methods=['POST'])
 @login_required
 def upload_data():
+    import pandas as pd  # só no upload e no cumulativo: não pesa no boot do app
     if current_user.role != 'admin':
         return jsonify({"message": "Acesso negado."}), 403
     if 'salesFile' not in request.files or 'portfolioFile' not in request.files or 'portfolioClientesFile' not in request.files:
@@ -563,6 +564,7 @@ def get_data():
 @dashboard_bp.route("/api/dados-cumulativos", methods=['GET'])
 @login_required
 def get_cumulative_data():
+    import pandas as pd
     conn = None
     try:
         conn = get_db_connection()
@@ -8,6 +8,7 @@ import pandas as pd
 from flask import Flask, render_template, request, flash, redirect, url_for, jsonify, abort
 from flask_sqlalchemy import SQLAlchemy
 from dotenv import load_dotenv
+import pool_conexoes
 from datetime import datetime
 from sqlalchemy import func, cast, Date, case, extract, distinct, or_
 import calendar
@@ -34,8 +35,12 @@ server = Flask(__name__, template_folder='templates')
 server.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
 server.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
 server.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Mesmo tamanho/espera do pool dos outros apps (ver pool_conexoes.py)
+server.config['SQLALCHEMY_ENGINE_OPTIONS'] = pool_conexoes.opcoes_sqlalchemy()
 
 db = SQLAlchemy(server)
+with server.app_context():
+    pool_conexoes.registrar_engine("financeiro", db.engine)
 server.jinja_env.globals.update(case=case, extract=extract)
 
 # --- 2. MODELOS DO BANCO DE DADOS (DO SEU APP ANTIGO) ---
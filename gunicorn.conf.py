@@ -0,0 +1,25 @@
+# Arquivo: gunicorn.conf.py
+# Configuração do gunicorn para o wsgi.py (todos os apps num processo só).
+# O gunicorn lê este arquivo sozinho quando roda da raiz do repositório:
+#   gunicorn wsgi:app
+#
+# Workers gthread: cada stream de eventos ao vivo (SSE) da conferência
+# (lista de pedidos, gestão e mapa abrem um cada) prende uma thread por até
+# 5 min. Com worker sync ele prenderia o worker inteiro, então as rotas SSE
+# recusam o stream (503) quando o servidor não roda com threads.
+#
+# Dimensionamento, por worker: GUNICORN_THREADS threads (16) e no máximo
+# SSE_MAX_STREAMS streams abertos (4, ver conferencia_app/eventos.py), o que
+# deixa pelo menos 12 threads para as requisições normais; o stream seguinte
+# recebe 503 e a página tenta de novo em 30s. Para mais streams por worker,
+# suba os dois juntos.
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+# O stream manda um ping a cada 15s; o timeout do gthread vale para o worker,
+# não para a requisição, então não precisa cobrir os 5 min do stream
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
@@ -0,0 +1,381 @@
+# Arquivo: migracoes.py
+# Migrações versionadas do banco compartilhado pelos apps (conferência e pontuação).
+#
+# O DDL rodava na importação do app da conferência (init_db a cada boot de
+# worker) e dentro das rotas logistica()/comercial() da pontuação, a cada
+# requisição: CREATE/ALTER ... IF NOT EXISTS que, mesmo sem mudar nada, pegam
+# lock no catálogo e disputam com o tráfego. Agora o esquema tem versão
+# (tabela schema_version) e as mudanças são migrações numeradas, aplicadas
+# uma vez por deploy com a linha de comando abaixo; boot e rotas não fazem DDL.
+#
+# Cada migração roda na sua própria transação, junto com o registro em
+# schema_version, sob um advisory lock: dois deploys ao mesmo tempo não
+# aplicam a mesma migração duas vezes. As primeiras migrações são o DDL que
+# existia (todo IF NOT EXISTS), então um banco já em produção passa por elas
+# sem mudar nada. Migração aplicada não se edita: mudança nova é migração nova,
+# no fim da lista. Por isso o DDL fica escrito aqui, e não chamado dos módulos
+# dos apps: mudar um módulo não pode mudar o que uma migração antiga faz.
+#
+# Uso (a partir da raiz do repositório, com DATABASE_URL definido):
+#   python -m migracoes              # aplica as pendentes
+#   python -m migracoes status       # lista aplicadas e pendentes
+#   python -m migracoes aplicar --ate 2
+
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+
+# Chave do pg_advisory_xact_lock das migrações (qualquer número fixo)
+CHAVE_LOCK = 7410221
+
+
+def _esquema_conferencia(cur):
+    """Tabelas da conferência e do mapa de separação (o antigo init_db do app)."""
+    # Tabela de pedidos
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS pedidos (
+            id SERIAL PRIMARY KEY, numero_pedido TEXT UNIQUE NOT NULL, nome_cliente TEXT,
+            vendedor TEXT, nome_da_carga TEXT, nome_arquivo TEXT, status_conferencia TEXT,
+            produtos JSONB, url_pdf TEXT, conferente TEXT, criado_em TIMESTAMP DEFAULT NOW()
+        );
+    ''')
+    # Data de upload, usada pelos filtros de período do relatório de cortes
+    cur.execute("ALTER TABLE IF EXISTS pedidos ADD COLUMN IF NOT EXISTS criado_em TIMESTAMP DEFAULT NOW();")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_criado_em ON pedidos (criado_em);")
+
+    # Tabelas do Mapa de Separação
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS cargas (
+          id SERIAL PRIMARY KEY, numero_carga TEXT UNIQUE NOT NULL, motorista TEXT,
+          descricao_romaneio TEXT, peso_total NUMERIC, entregas INTEGER,
+          data_emissao TEXT, criado_em TIMESTAMP DEFAULT NOW()
+        );
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS carga_grupos (
+          id SERIAL PRIMARY KEY, numero_carga TEXT REFERENCES cargas(numero_carga) ON DELETE CASCADE,
+          grupo_codigo TEXT, grupo_titulo TEXT
+        );
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS carga_itens (
+          id SERIAL PRIMARY KEY, numero_carga TEXT REFERENCES cargas(numero_carga) ON DELETE CASCADE,
+          grupo_codigo TEXT, fabricante TEXT, codigo TEXT, cod_barras TEXT, descricao TEXT,
+          qtd_unidades INTEGER, unidade TEXT, pack_qtd INTEGER, pack_unid TEXT,
+          observacao TEXT DEFAULT '', separado BOOLEAN DEFAULT FALSE, forcar_conferido BOOLEAN DEFAULT FALSE,
+          faltou BOOLEAN DEFAULT FALSE, sobrando INTEGER DEFAULT 0
+        );
+    ''')
+    cur.execute("ALTER TABLE IF EXISTS carga_grupos ADD COLUMN IF NOT EXISTS separador_nome TEXT;")
+    cur.execute("ALTER TABLE IF EXISTS carga_itens ADD COLUMN IF NOT EXISTS qtd_separada INTEGER;")
+    # Item que saiu do PDF num reenvio mesclado (continua visível, riscado)
+    cur.execute("ALTER TABLE IF EXISTS carga_itens ADD COLUMN IF NOT EXISTS removido BOOLEAN NOT NULL DEFAULT FALSE;")
+    # Versão de mudança para o delta de ler_mapa; cargas.versao_base muda
+    # quando a carga é recriada (modo substituir) e o delta não serve mais
+    for tabela in ("carga_itens", "carga_grupos"):
+        cur.execute(f"""
+            ALTER TABLE IF EXISTS {tabela}
+              ADD COLUMN IF NOT EXISTS versao_mudanca BIGINT NOT NULL DEFAULT txid_current();
+        """)
+    cur.execute("ALTER TABLE IF EXISTS cargas ADD COLUMN IF NOT EXISTS versao_base BIGINT NOT NULL DEFAULT txid_current();")
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION marcar_versao_mudanca() RETURNS trigger AS $$
+        BEGIN
+            NEW.versao_mudanca := txid_current();
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+    """)
+    for tabela in ("carga_itens", "carga_grupos"):
+        cur.execute(f"DROP TRIGGER IF EXISTS trg_{tabela}_versao ON {tabela};")
+        cur.execute(f"""
+            CREATE TRIGGER trg_{tabela}_versao BEFORE UPDATE ON {tabela}
+            FOR EACH ROW EXECUTE FUNCTION marcar_versao_mudanca();
+        """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_carga_itens_versao ON carga_itens (numero_carga, versao_mudanca);")
+    # O upload grava os grupos com ON CONFLICT (numero_carga, grupo_codigo)
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_carga_grupos_carga_codigo
+            ON carga_grupos (numero_carga, grupo_codigo);
+    """)
+
+    # Itens dos pedidos, uma linha por produto (ver itens_pedido.py)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS pedido_itens (
+            id SERIAL PRIMARY KEY,
+            numero_pedido TEXT NOT NULL REFERENCES pedidos(numero_pedido) ON DELETE CASCADE,
+            indice INTEGER NOT NULL, produto_nome TEXT, codigo_barras TEXT,
+            quantidade_pedida TEXT, quantidade_entregue TEXT, status TEXT DEFAULT 'Pendente',
+            valor_total_item TEXT, unidades_pacote INTEGER DEFAULT 1,
+            forced_confirmed BOOLEAN DEFAULT FALSE, observacao TEXT DEFAULT '',
+            versao INTEGER NOT NULL DEFAULT 1,
+            UNIQUE (numero_pedido, indice)
+        );
+    ''')
+    cur.execute("ALTER TABLE pedido_itens ADD COLUMN IF NOT EXISTS versao INTEGER NOT NULL DEFAULT 1;")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pedido_itens_barcode ON pedido_itens (numero_pedido, codigo_barras);")
+    # Índice parcial só com os itens em corte (itens_pedido.STATUS_CORTE)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_pedido_itens_cortes ON pedido_itens (numero_pedido, indice)
+         WHERE status IN ('Corte Parcial', 'Corte Total');
+    """)
+    cur.execute("ALTER TABLE IF EXISTS pedidos ADD COLUMN IF NOT EXISTS itens_pendentes INTEGER;")
+    # Pedidos antigos: o JSONB `produtos` vira linhas. A coluna fica como
+    # está (é a única cópia do original); esvaziá-la é outra migração, depois
+    # de conferir as linhas.
+    cur.execute('''
+        INSERT INTO pedido_itens (
+            numero_pedido, indice, produto_nome, codigo_barras, quantidade_pedida,
+            quantidade_entregue, status, valor_total_item, unidades_pacote,
+            forced_confirmed, observacao
+        )
+        SELECT p.numero_pedido, e.ordem - 1, e.item->>'produto_nome', e.item->>'codigo_barras',
+               e.item->>'quantidade_pedida', e.item->>'quantidade_entregue',
+               COALESCE(e.item->>'status', 'Pendente'), e.item->>'valor_total_item',
+               COALESCE(NULLIF(e.item->>'unidades_pacote', '')::INTEGER, 1),
+               COALESCE((e.item->>'forced_confirmed')::BOOLEAN, FALSE),
+               COALESCE(e.item->>'observacao', '')
+          FROM pedidos p
+         CROSS JOIN LATERAL jsonb_array_elements(p.produtos) WITH ORDINALITY AS e(item, ordem)
+         WHERE p.produtos IS NOT NULL AND jsonb_typeof(p.produtos) = 'array'
+           AND NOT EXISTS (SELECT 1 FROM pedido_itens i WHERE i.numero_pedido = p.numero_pedido)
+        ON CONFLICT (numero_pedido, indice) DO NOTHING;
+    ''')
+    cur.execute('''
+        UPDATE pedidos p
+           SET itens_pendentes = (
+                   SELECT COUNT(*) FROM pedido_itens i
+                    WHERE i.numero_pedido = p.numero_pedido AND i.status = 'Pendente'
+               )
+         WHERE p.itens_pendentes IS NULL;
+    ''')
+
+    # Registro das cargas com contadores (ver registro_cargas.py), montado a
+    # partir dos pedidos que já existem
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS registro_cargas (
+            nome_da_carga TEXT PRIMARY KEY,
+            pedidos INTEGER NOT NULL DEFAULT 0, finalizados INTEGER NOT NULL DEFAULT 0,
+            cortes INTEGER NOT NULL DEFAULT 0, ultima_atividade TIMESTAMP DEFAULT NOW()
+        );
+    ''')
+    cur.execute("""
+        INSERT INTO registro_cargas (nome_da_carga, pedidos, finalizados, cortes, ultima_atividade)
+        SELECT p.nome_da_carga, COUNT(*),
+               COUNT(*) FILTER (WHERE p.status_conferencia = 'Finalizado'),
+               COALESCE(SUM(c.cortes), 0), NOW()
+          FROM pedidos p
+          CROSS JOIN LATERAL (
+              SELECT COUNT(*) AS cortes FROM pedido_itens i
+               WHERE i.numero_pedido = p.numero_pedido AND i.status IN ('Corte Parcial', 'Corte Total')
+          ) c
+         WHERE p.nome_da_carga IS NOT NULL
+         GROUP BY p.nome_da_carga
+        ON CONFLICT (nome_da_carga) DO NOTHING;
+    """)
+
+    # Índices da busca de código de barras na carga toda (ver indice_barcode.py)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_nome_da_carga ON pedidos (nome_da_carga);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pedido_itens_ean ON pedido_itens USING hash (codigo_barras);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_carga_itens_barcode ON carga_itens (numero_carga, cod_barras);")
+
+    # Fila persistente de envio dos PDFs para o armazenamento (ver armazenamento.py)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS fila_uploads (
+            id SERIAL PRIMARY KEY, numero_pedido TEXT NOT NULL, chave TEXT NOT NULL,
+            conteudo BYTEA NOT NULL, tentativas INTEGER DEFAULT 0, ultimo_erro TEXT,
+            proxima_tentativa TIMESTAMP DEFAULT NOW(), criado_em TIMESTAMP DEFAULT NOW()
+        );
+    ''')
+
+    # Cache de extração por SHA-256 do PDF (ver cache_parse.py)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS cache_parse (
+            sha256 TEXT NOT NULL, tipo TEXT NOT NULL, versao TEXT NOT NULL,
+            resultado JSONB NOT NULL, tamanho INTEGER NOT NULL,
+            criado_em TIMESTAMP DEFAULT NOW(), usado_em TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (sha256, tipo)
+        );
+    ''')
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_cache_parse_usado_em ON cache_parse (usado_em);")
+
+
+# Tabelas de pontuação por setor: todas com os critérios A–E
+_COLUNAS_SETOR = """
+            A INTEGER, B INTEGER, C INTEGER, D INTEGER, E INTEGER,
+            extras TEXT, observacao TEXT, total INTEGER
+"""
+SETORES = ("loja", "expedicao", "logistica", "comercial")
+
+
+def _esquema_pontuacao(cur):
+    """Tabelas da pontuação (o antigo init_db do pontuacao_app e os CREATE das rotas)."""
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS pontuacoes (
+            id SERIAL PRIMARY KEY, data TEXT, setor TEXT, obrigacao TEXT,
+            pontuacao TEXT, observacao TEXT
+        )
+    ''')
+    cur.execute(f"CREATE TABLE IF NOT EXISTS loja (id SERIAL PRIMARY KEY, data TEXT, {_COLUNAS_SETOR})")
+    cur.execute(f"CREATE TABLE IF NOT EXISTS expedicao (id SERIAL PRIMARY KEY, data TEXT, {_COLUNAS_SETOR})")
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS logistica (id SERIAL PRIMARY KEY, data TEXT, motorista TEXT, {_COLUNAS_SETOR})
+    """)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS comercial (id SERIAL PRIMARY KEY, data DATE, vendedor TEXT, {_COLUNAS_SETOR})
+    """)
+
+
+def _indices_filtros(cur):
+    """Índices das consultas mais frequentes que faziam varredura da tabela."""
+    # pedidos(nome_da_carga) já vem da migração 1.
+    # Contadores do registro de cargas e o filtro de pedidos finalizados:
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_status ON pedidos (status_conferencia);")
+    # Marcar/definir separador de um grupo do mapa
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_carga_itens_grupo ON carga_itens (numero_carga, grupo_codigo);")
+    # Históricos (data >= ... ORDER BY data DESC) e o "já pontuou neste dia?" das rotas de setor
+    for tabela in SETORES:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{tabela}_data ON {tabela} (data);")
+
+
+def _carga_nos_itens(cur):
+    """
+    pedido_itens.nome_da_carga (cópia de pedidos.nome_da_carga, gravada no
+    upload) com índice (nome_da_carga, codigo_barras): a busca do EAN bipado
+    vai direto aos itens da carga, em vez de passar por todo o histórico do
+    EAN no hash da migração 1 e filtrar a carga no join.
+    """
+    cur.execute("ALTER TABLE pedido_itens ADD COLUMN IF NOT EXISTS nome_da_carga TEXT;")
+    cur.execute("""
+        UPDATE pedido_itens i SET nome_da_carga = p.nome_da_carga
+          FROM pedidos p
+         WHERE p.numero_pedido = i.numero_pedido
+           AND i.nome_da_carga IS DISTINCT FROM p.nome_da_carga;
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pedido_itens_carga_ean ON pedido_itens (nome_da_carga, codigo_barras);")
+    cur.execute("DROP INDEX IF EXISTS idx_pedido_itens_ean;")
+
+
+# (versão, descrição, função(cur)), em ordem. Só acrescente no fim.
+MIGRACOES = [
+    (1, "esquema da conferência e do mapa", _esquema_conferencia),
+    (2, "esquema da pontuação", _esquema_pontuacao),
+    (3, "índices de carga, status, grupo do mapa e data dos setores", _indices_filtros),
+    (4, "carga nos itens dos pedidos e índice (carga, código de barras)", _carga_nos_itens),
+]
+
+
+def _conectar():
+    return psycopg2.connect(os.environ.get('DATABASE_URL'))
+
+
+def criar_tabela_versao(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            versao INTEGER PRIMARY KEY, descricao TEXT NOT NULL,
+            aplicada_em TIMESTAMP NOT NULL DEFAULT NOW(), duracao_ms INTEGER
+        );
+    """)
+
+
+def versoes_aplicadas(cur):
+    """{versão: (descrição, aplicada_em)} das migrações já registradas."""
+    cur.execute("SELECT to_regclass('schema_version') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return {}
+    cur.execute("SELECT versao, descricao, aplicada_em FROM schema_version ORDER BY versao;")
+    return {versao: (descricao, aplicada_em) for versao, descricao, aplicada_em in cur.fetchall()}
+
+
+def pendentes(cur):
+    aplicadas = versoes_aplicadas(cur)
+    return [m for m in MIGRACOES if m[0] not in aplicadas]
+
+
+def aplicar(conectar=_conectar, ate=None, log=print):
+    """
+    Aplica as migrações pendentes (até a versão `ate`, se vier), uma
+    transação por migração. Retorna as versões aplicadas agora.
+    """
+    conn = conectar()
+    aplicadas_agora = []
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_xact_lock(%s);", (CHAVE_LOCK,))
+        criar_tabela_versao(cur)
+        conn.commit()
+
+        for versao, descricao, funcao in MIGRACOES:
+            if ate is not None and versao > ate:
+                break
+            # O lock é por transação: cada migração pega de novo e confere,
+            # já sob o lock, se outro processo não aplicou enquanto isso
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (CHAVE_LOCK,))
+            cur.execute("SELECT 1 FROM schema_version WHERE versao = %s;", (versao,))
+            if cur.fetchone():
+                conn.commit()
+                continue
+            inicio = time.perf_counter()
+            try:
+                funcao(cur)
+                duracao_ms = int(1000 * (time.perf_counter() - inicio))
+                cur.execute(
+                    "INSERT INTO schema_version (versao, descricao, duracao_ms) VALUES (%s, %s, %s);",
+                    (versao, descricao, duracao_ms)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                log(f"❌ Migração {versao} ({descricao}) falhou; nada dela foi gravado.")
+                raise
+            log(f"✅ {versao}: {descricao} ({duracao_ms} ms)")
+            aplicadas_agora.append(versao)
+        return aplicadas_agora
+    finally:
+        conn.close()
+
+
+def status(conectar=_conectar, log=print):
+    """Imprime aplicadas e pendentes. Retorna o número de pendentes."""
+    conn = conectar()
+    try:
+        cur = conn.cursor()
+        aplicadas = versoes_aplicadas(cur)
+    finally:
+        conn.close()
+    faltando = 0
+    for versao, descricao, _funcao in MIGRACOES:
+        if versao in aplicadas:
+            log(f"  [x] {versao}: {descricao} (em {aplicadas[versao][1]:%d/%m/%Y %H:%M})")
+        else:
+            log(f"  [ ] {versao}: {descricao}")
+            faltando += 1
+    for versao in sorted(set(aplicadas) - {m[0] for m in MIGRACOES}):
+        log(f"  [?] {versao}: {aplicadas[versao][0]} (aplicada, mas não existe neste código)")
+    return faltando
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrações do banco dos apps")
+    parser.add_argument("comando", nargs="?", default="aplicar", choices=["aplicar", "status"])
+    parser.add_argument("--ate", type=int, default=None, help="aplica só até esta versão")
+    args = parser.parse_args(argv)
+
+    if not os.environ.get('DATABASE_URL'):
+        print("Defina DATABASE_URL.")
+        return 2
+    if args.comando == "status":
+        return 1 if status() else 0
+    aplicadas = aplicar(ate=args.ate)
+    if not aplicadas:
+        print("Nenhuma migração pendente.")
+    return 0
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    sys.exit(main())
@@ -7,15 +7,18 @@ import psycopg2
 import os
 import re
 import logging
-import cloudinary
-import cloudinary.uploader
 import tempfile
 import zipfile
-import pandas as pd
 from flask import send_file
 import io
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
+try:
+    import pool_conexoes
+except ImportError:
+    # Rodando sozinho de dentro de pontuacao_app (Procfile/render.yaml daqui,
+    # `gunicorn app:app`): a raiz do repositório não está no path
+    pool_conexoes = None
+# pandas, openpyxl e cloudinary são importados dentro das rotas que usam
+# (backup, restauração e relatório): pesam no boot e quase nunca são chamados
 DELETE_PASSWORD = 'confie123'
 
 #logs
@@ -74,90 +77,21 @@ def _filtro_responsavel_sql(tabela: str, responsavel: str):
 app = Flask(__name__)
 app.secret_key = 'confie'
 
-# Conexão com o banco PostgreSQL no Render
+# Conexão com o banco PostgreSQL no Render, pelo pool compartilhado (ver
+# pool_conexoes.py) quando montado pelo wsgi.py; sozinho, conexão direta
 def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    if pool_conexoes is None:
+        return psycopg2.connect(os.environ['DATABASE_URL'])
+    return pool_conexoes.conectar()
 
-# Inicializa o banco e cria as tabelas se não existirem
-def init_db():
-    conn = get_db_connection()
-    c = conn.cursor()
-
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS pontuacoes (
-            id SERIAL PRIMARY KEY,
-            data TEXT,
-            setor TEXT,
-            obrigacao TEXT,
-            pontuacao TEXT,
-            observacao TEXT
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS loja (
-            id SERIAL PRIMARY KEY,
-            data TEXT,
-            A INTEGER,
-            B INTEGER,
-            C INTEGER,
-            D INTEGER,
-            E INTEGER,
-            extras TEXT,
-            observacao TEXT,
-            total INTEGER
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS expedicao (
-            id SERIAL PRIMARY KEY,
-            data TEXT,
-            A INTEGER,
-            B INTEGER,
-            C INTEGER,
-            D INTEGER,
-            E INTEGER,
-            extras TEXT,
-            observacao TEXT,
-            total INTEGER
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS logistica (
-            id SERIAL PRIMARY KEY,
-            data TEXT,
-            motorista TEXT,
-            A INTEGER,
-            B INTEGER,
-            C INTEGER,
-            D INTEGER,
-            E INTEGER,
-            extras TEXT,
-            observacao TEXT,
-            total INTEGER
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS comercial (
-            id SERIAL PRIMARY KEY,
-            data DATE,
-            vendedor TEXT,
-            A INTEGER,
-            B INTEGER,
-            C INTEGER,
-            D INTEGER,
-            E INTEGER,
-            extras TEXT,
-            observacao TEXT,
-            total INTEGER
-        )
-    ''')
-
-    conn.commit()
-    conn.close()
-
-cloudinary.config()
+# As tabelas são criadas pelas migrações versionadas (migracoes.py na raiz
+# do repositório, `python -m migracoes`), não mais aqui nem nas rotas.
 
 def fazer_backup_e_enviar():
+    import cloudinary
+    import cloudinary.uploader
+    import pandas as pd
+    cloudinary.config()
     conn = None
     try:
         conn = get_db_connection()
@@ -597,22 +531,6 @@ def logistica():
     conn = get_db_connection()
     c = conn.cursor()
 
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS logistica (
-            id SERIAL PRIMARY KEY,
-            data TEXT,
-            motorista TEXT,
-            A INTEGER,
-            B INTEGER,
-            C INTEGER,
-            D INTEGER,
-            E INTEGER,
-            extras TEXT,
-            observacao TEXT,
-            total INTEGER
-        )
-    ''')
-
     motoristas = ['Denilson', 'Fabio', 'Rogerio', 'Robson', 'Simone', 'Vinicius', 'Equipe']
 
     if request.method == 'POST':
@@ -832,22 +750,6 @@ def comercial():
     conn = get_db_connection()
     c = conn.cursor()
 
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS comercial (
-            id SERIAL PRIMARY KEY,
-            data DATE,
-            vendedor TEXT,
-            A INTEGER,
-            B INTEGER,
-            C INTEGER,
-            D INTEGER,
-            E INTEGER,
-            extras TEXT,
-            observacao TEXT,
-            total INTEGER
-        )
-    ''')
-
     vendedores = ['EVERTON', 'MARCELO', 'PEDRO', 'SILVANA', 'TIAGO', 'RODOLFO', 'MARCOS', 'THYAGO', 'EQUIPE']
 
     if request.method == 'POST':
@@ -1006,14 +908,6 @@ def zerar_tudo():
     return redirect(url_for('home_pontuacao'))
 
 
-@app.route('/criar_banco')
-def criar_banco():
-    try:
-        init_db()
-        return "✅ Banco de dados criado com sucesso!"
-    except Exception as e:
-        return f"❌ Erro ao criar banco: {str(e)}"
-
 @app.route('/restaurar_backup', methods=['GET', 'POST'])
 def restaurar_backup():
     if request.method == 'POST':
@@ -1021,6 +915,7 @@ def restaurar_backup():
         if arquivo and arquivo.filename.endswith('.zip'):
             try:
                 with tempfile.TemporaryDirectory() as tmpdirname:
+                    import pandas as pd
                     caminho_zip = os.path.join(tmpdirname, arquivo.filename)
                     arquivo.save(caminho_zip)
 
@@ -1060,11 +955,12 @@ def restaurar_backup():
 from io import BytesIO
 from datetime import datetime
 from flask import send_file
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 
 @app.route('/baixar_relatorio_excel')
 def baixar_relatorio_excel():
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+
     conn = get_db_connection()
     c = conn.cursor()
 
@@ -0,0 +1,304 @@
+# Arquivo: pool_conexoes.py
+# Pool de conexões Postgres compartilhado pelos apps montados no wsgi.py.
+#
+# Cada rota da conferência, da pontuação e do dashboard abria uma conexão
+# nova (psycopg2.connect) e fechava no fim: TCP + TLS + autenticação a cada
+# requisição, e mais uma no load_user do dashboard. Agora get_db_connection()
+# de cada app pega uma conexão deste pool e o close() dela devolve ao pool em
+# vez de encerrar, então o código das rotas não muda.
+#
+# - Tamanho pelo ambiente: DB_POOL_MIN, DB_POOL_MAX (por processo), e
+#   DB_POOL_ESPERA (segundos esperando uma conexão livre antes de dar erro).
+#   Acima de DB_POOL_MIN, conexões paradas há mais de DB_POOL_OCIOSA segundos
+#   são fechadas, para o processo não segurar o pico para sempre.
+# - Conexão parada há mais de DB_POOL_VALIDAR_APOS segundos é testada com um
+#   SELECT 1 antes de ser entregue (o servidor derruba conexões ociosas).
+# - Fork do gunicorn: o pool é por processo. O filho começa com um pool
+#   vazio e nunca usa nem fecha as conexões herdadas do pai (fechar mandaria
+#   o "terminate" pelo mesmo socket e derrubaria a sessão do pai).
+# - O financeiro usa SQLAlchemy, que tem o pool dele: opcoes_sqlalchemy() dá
+#   as mesmas configurações e registrar_engine() inclui o engine no descarte
+#   pós-fork e nas estatísticas.
+#
+# estatisticas() devolve os números do pool (abertas, em uso, esperas...),
+# expostos em /_/pool pelo wsgi.py.
+
+import os
+import time
+import logging
+import threading
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+logger = logging.getLogger(__name__)
+
+
+def _config(nome, padrao, tipo=int):
+    try:
+        return tipo(os.environ.get(nome, padrao))
+    except ValueError:
+        logger.warning(f"[Pool] {nome} inválido, usando {padrao}")
+        return tipo(padrao)
+
+
+class ConexaoDoPool:
+    """
+    Conexão emprestada do pool: repassa tudo para a conexão psycopg2, menos
+    close(), que desfaz a transação aberta (se houver) e devolve ao pool.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def _viva(self):
+        conn = self.__dict__.get("_conn")
+        if conn is None:
+            raise psycopg2.InterfaceError("connection already closed")
+        return conn
+
+    def __getattr__(self, nome):
+        return getattr(self._viva(), nome)
+
+    def __setattr__(self, nome, valor):
+        # conn.autocommit = ..., conn.isolation_level = ...: vão para a conexão
+        if nome in ("_pool", "_conn"):
+            object.__setattr__(self, nome, valor)
+        else:
+            setattr(self._viva(), nome, valor)
+
+    @property
+    def closed(self):
+        return 1 if self._conn is None else self._conn.closed
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.devolver(conn)
+
+    # `with conn:` faz commit/rollback como no psycopg2 (sem fechar)
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def __del__(self):
+        # Rota que esqueceu o close(): a conexão volta quando o objeto some
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class PoolConexoes:
+    """Pool de um processo: conexões livres em pilha (a mais recente sai primeiro)."""
+
+    def __init__(self, dsn, minimo=1, maximo=10, espera=10.0, validar_apos=30.0, ociosa=300.0):
+        self.dsn = dsn
+        self.minimo = max(0, minimo)
+        self.maximo = max(1, maximo, self.minimo)
+        self.espera = espera
+        self.validar_apos = validar_apos
+        self.ociosa = ociosa
+        self.pid = os.getpid()
+        self._cond = threading.Condition()
+        self._livres = []           # [(conexão, devolvida_em)]
+        self._abertas = 0
+        self._esperando = 0
+        self._stats = {"emprestimos": 0, "criadas": 0, "descartadas": 0, "esperas": 0,
+                       "ms_espera": 0.0, "estouros": 0, "falhas_validacao": 0}
+
+    def _conectar(self):
+        return psycopg2.connect(self.dsn)
+
+    def _descartar(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._abertas -= 1
+            self._stats["descartadas"] += 1
+            self._cond.notify()
+
+    def _valida(self, conn, devolvida_em):
+        if conn.closed:
+            return False
+        if time.monotonic() - devolvida_em < self.validar_apos:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1;")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            with self._cond:
+                self._stats["falhas_validacao"] += 1
+            return False
+
+    def obter(self):
+        """Uma conexão psycopg2 (crua). Espera até `espera` segundos se o pool estiver cheio."""
+        while True:
+            inicio = time.monotonic()
+            with self._cond:
+                if not self._livres and self._abertas >= self.maximo:
+                    self._stats["esperas"] += 1
+                    self._esperando += 1
+                    try:
+                        limite = inicio + self.espera
+                        while not self._livres and self._abertas >= self.maximo:
+                            restante = limite - time.monotonic()
+                            if restante <= 0:
+                                self._stats["estouros"] += 1
+                                raise PoolError(f"Nenhuma conexão livre em {self.espera:g}s "
+                                                f"(DB_POOL_MAX={self.maximo}).")
+                            self._cond.wait(restante)
+                    finally:
+                        self._esperando -= 1
+                        self._stats["ms_espera"] += 1000 * (time.monotonic() - inicio)
+                self._stats["emprestimos"] += 1
+                if self._livres:
+                    conn, devolvida_em = self._livres.pop()
+                else:
+                    conn, devolvida_em = None, None
+                    self._abertas += 1
+
+            if conn is None:
+                try:
+                    conn = self._conectar()
+                except Exception:
+                    with self._cond:
+                        self._abertas -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._stats["criadas"] += 1
+                return conn
+            if self._valida(conn, devolvida_em):
+                return conn
+            # Caiu enquanto estava parada: descarta e tenta a próxima (ou abre outra)
+            self._descartar(conn)
+
+    def devolver(self, conn):
+        if os.getpid() != self.pid:
+            return  # conexão do processo pai: não mexe
+        if not conn.closed:
+            try:
+                # Transação esquecida aberta (ou com erro) não passa para o próximo
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                pass
+        if conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            self._descartar(conn)
+            return
+        agora = time.monotonic()
+        with self._cond:
+            self._livres.append((conn, agora))
+            self._cond.notify()
+            # A mais antiga fica no fundo da pilha
+            sobra = None
+            if len(self._livres) > self.minimo and agora - self._livres[0][1] > self.ociosa:
+                sobra = self._livres.pop(0)[0]
+        if sobra is not None:
+            self._descartar(sobra)
+
+    def estatisticas(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(pid=self.pid, minimo=self.minimo, maximo=self.maximo,
+                         abertas=self._abertas, livres=len(self._livres),
+                         em_uso=self._abertas - len(self._livres), esperando=self._esperando)
+        stats["ms_espera"] = round(stats["ms_espera"], 1)
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# Pools herdados num fork: ficam referenciados para o GC não fechar as
+# conexões do pai por este processo
+_herdados = []
+_engines = {}
+
+
+def _novo_pool():
+    return PoolConexoes(
+        os.environ.get('DATABASE_URL'),
+        minimo=_config("DB_POOL_MIN", 1),
+        maximo=_config("DB_POOL_MAX", 10),
+        espera=_config("DB_POOL_ESPERA", 10, float),
+        validar_apos=_config("DB_POOL_VALIDAR_APOS", 30, float),
+        ociosa=_config("DB_POOL_OCIOSA", 300, float),
+    )
+
+
+def obter_pool():
+    """O pool deste processo (criado no primeiro uso, e de novo depois de um fork)."""
+    global _pool
+    pool = _pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid != os.getpid():
+            _herdados.append(_pool)
+            _pool = None
+        if _pool is None:
+            _pool = _novo_pool()
+        return _pool
+
+
+def conectar():
+    """Substituto de psycopg2.connect(DATABASE_URL): conexão do pool, devolvida no close()."""
+    pool = obter_pool()
+    return ConexaoDoPool(pool, pool.obter())
+
+
+def _apos_fork():
+    global _pool
+    if _pool is not None:
+        _herdados.append(_pool)
+        _pool = None
+    for engine in _engines.values():
+        # close=False: só esquece as conexões do pai, sem encerrá-las
+        engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_apos_fork)
+
+
+def opcoes_sqlalchemy():
+    """SQLALCHEMY_ENGINE_OPTIONS com o mesmo tamanho, espera e validação do pool."""
+    minimo = _config("DB_POOL_MIN", 1)
+    maximo = max(1, _config("DB_POOL_MAX", 10), minimo)
+    return {
+        "pool_size": max(1, minimo),
+        "max_overflow": max(0, maximo - max(1, minimo)),
+        "pool_timeout": _config("DB_POOL_ESPERA", 10, float),
+        "pool_pre_ping": True,
+        "pool_use_lifo": True,
+    }
+
+
+def registrar_engine(nome, engine):
+    """Engine do SQLAlchemy que entra no descarte pós-fork e nas estatísticas."""
+    _engines[nome] = engine
+
+
+def estatisticas():
+    pool = _pool if _pool is not None and _pool.pid == os.getpid() else None
+    stats = {"psycopg2": pool.estatisticas() if pool else {"pid": os.getpid(), "abertas": 0}}
+    for nome, engine in _engines.items():
+        p = engine.pool
+        stats[f"sqlalchemy:{nome}"] = {
+            "tamanho": p.size(), "em_uso": p.checkedout(), "livres": p.checkedin(),
+            "overflow": p.overflow(), "status": p.status(),
+        }
+    return stats
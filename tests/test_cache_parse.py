@@ -0,0 +1,80 @@
+# Arquivo: tests/test_cache_parse.py
+# Cache do mapa página a página (conferencia_app/cache_parse.py).
+# Rodar da raiz: python -m unittest discover tests  (ou python -m pytest tests)
+
+import gc
+import unittest
+import weakref
+
+from conferencia_app.cache_parse import CacheParse, TIPO_MAPA_PAGINAS, iterar_mapa_com_cache
+
+
+class _Pagina(dict):
+    """dict que aceita weakref, para saber se alguém ainda segura a página/grupo/item."""
+
+
+class _BackendMemoria:
+    nome = "memoria"
+
+    def __init__(self):
+        self.entradas = {}
+
+    def obter(self, sha256, tipo, versao):
+        entrada = self.entradas.get((sha256, tipo))
+        return entrada[1] if entrada and entrada[0] == versao else None
+
+    def guardar(self, sha256, tipo, versao, resultado):
+        self.entradas[(sha256, tipo)] = (versao, resultado)
+
+
+def _iterar(total, referencias=None):
+    def iterar(pdf_bytes):
+        for n in range(total):
+            grupo, item = _Pagina(grupo=f"G{n}"), _Pagina(produto=f"P{n}")
+            pagina = _Pagina(pagina=n, header={"numero_carga": "123"} if n == 0 else None,
+                             grupos=[grupo], itens=[item])
+            if referencias is not None:
+                referencias.append((weakref.ref(pagina), weakref.ref(grupo), weakref.ref(item)))
+            yield pagina
+    return iterar
+
+
+class IterarMapaComCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = _BackendMemoria()
+        self.cache = CacheParse(self.backend)
+
+    def test_miss_de_mapa_grande_nao_segura_as_paginas(self):
+        referencias = []
+        paginas = iterar_mapa_com_cache(self.cache, b"grande", _iterar(100, referencias), "v1", max_paginas=5)
+        for n, pagina in enumerate(paginas):
+            self.assertEqual(pagina["pagina"], n)
+            del pagina
+            if n == 50:
+                gc.collect()
+                # Nem as páginas já repassadas nem os grupos/itens delas
+                vivas = [r for trio in referencias[:50] for r in trio if r() is not None]
+                self.assertEqual(vivas, [])
+        self.assertEqual(self.backend.entradas, {})
+
+    def test_mapa_pequeno_e_guardado_e_o_hit_sai_por_pagina(self):
+        lidas = list(iterar_mapa_com_cache(self.cache, b"pequeno", _iterar(3), "v1", max_paginas=5))
+        self.assertIn(TIPO_MAPA_PAGINAS, {tipo for _, tipo in self.backend.entradas})
+
+        def nao_deveria_ler(pdf_bytes):
+            raise AssertionError("hit não deveria chamar o parser")
+
+        do_cache = list(iterar_mapa_com_cache(self.cache, b"pequeno", nao_deveria_ler, "v1", max_paginas=5))
+        self.assertEqual(do_cache, lidas)
+        self.assertEqual(self.cache.contadores.copia()[TIPO_MAPA_PAGINAS]["hits"], 1)
+
+    def test_leitura_interrompida_nao_grava(self):
+        paginas = iterar_mapa_com_cache(self.cache, b"pequeno", _iterar(3), "v1", max_paginas=5)
+        next(paginas)
+        paginas.close()
+        self.assertEqual(self.backend.entradas, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
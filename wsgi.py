@@ -7,42 +7,101 @@ from dotenv import load_dotenv
 load_dotenv()
 # =======================================================
 
-from flask import Flask
+import os
+import time
+import importlib
+import threading
+
+from flask import Flask, jsonify
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
 
-# Importa as suas aplicações existentes
-from conferencia_app.app import app as conferencia_app
-from pontuacao_app.app import app as pontuacao_app
-from dashboard_app.app import app as dashboard_app
+import pool_conexoes
 
-# =======================================================
-# ADICIONE A IMPORTAÇÃO DA NOVA APLICAÇÃO FINANCEIRA
-# =======================================================
-from financeiro_app.app import app as financeiro_app
-# =======================================================
+
+# Montagem preguiçosa: cada app só é importado na primeira requisição ao seu
+# prefixo. O host dorme as instâncias paradas e cada despertar é um cold
+# start; importar tudo de uma vez (pandas, dash, plotly, PyMuPDF e o layout
+# do financeiro) atrasava até o /_/healthz. WSGI_PRE_CARREGAR=todos (ou uma
+# lista de prefixos separados por vírgula) carrega no import, para quem usa
+# gunicorn --preload e prefere pagar isso antes do fork.
+class AppPreguicosa:
+    """App WSGI ("modulo:atributo") importado no primeiro uso."""
+
+    def __init__(self, caminho, configurar=None):
+        self.caminho = caminho
+        self.configurar = configurar
+        self.ms_carga = None
+        self._app = None
+        self._lock = threading.Lock()
+
+    @property
+    def carregado(self):
+        return self._app is not None
+
+    def carregar(self):
+        if self._app is None:
+            with self._lock:
+                if self._app is None:
+                    inicio = time.perf_counter()
+                    modulo, atributo = self.caminho.split(":")
+                    app = getattr(importlib.import_module(modulo), atributo)
+                    if self.configurar:
+                        self.configurar(app)
+                    self.ms_carga = round(1000 * (time.perf_counter() - inicio), 1)
+                    self._app = app
+        return self._app
+
+    def __call__(self, environ, start_response):
+        return self.carregar()(environ, start_response)
 
 
-# (opcional) isolar sessão da Pontuação
-pontuacao_app.config.update(
-    SESSION_COOKIE_NAME='pont_session',
-    SESSION_COOKIE_PATH='/pontuacao'
-)
+def _configurar_pontuacao(app):
+    # (opcional) isolar sessão da Pontuação
+    app.config.update(
+        SESSION_COOKIE_NAME='pont_session',
+        SESSION_COOKIE_PATH='/pontuacao'
+    )
+
+
+# Importa as suas aplicações existentes (na primeira requisição de cada uma)
+APPS = {
+    "/": AppPreguicosa("conferencia_app.app:app"),
+    "/pontuacao": AppPreguicosa("pontuacao_app.app:app", _configurar_pontuacao),
+    "/dashboard": AppPreguicosa("dashboard_app.app:app"),
+    "/financeiro": AppPreguicosa("financeiro_app.app:app"),
+}
+
+
+def carregar(prefixos=None):
+    """Importa já os apps dos `prefixos` (todos, se None)."""
+    for prefixo in (prefixos or APPS):
+        APPS[prefixo].carregar()
+
 
 # health opcional em /_/healthz
 health = Flask(__name__)
 @health.get("/healthz")
 def ok(): return "ok", 200
 
+# números do pool de conexões deste processo (ver pool_conexoes.py)
+@health.get("/pool")
+def pool(): return jsonify(pool_conexoes.estatisticas())
+
+# quais apps este processo já carregou e quanto cada um levou
+@health.get("/apps")
+def apps(): return jsonify({p: {"carregado": a.carregado, "ms_carga": a.ms_carga} for p, a in APPS.items()})
+
+
+_pre_carregar = os.environ.get("WSGI_PRE_CARREGAR", "").strip()
+if _pre_carregar:
+    carregar(None if _pre_carregar.lower() == "todos" else [p.strip() for p in _pre_carregar.split(",") if p.strip()])
+
 # Middleware para rotear as requisições:
 # A aplicação de Conferência responde na rota principal "/"
 # As outras aplicações respondem em sub-rotas
-app = DispatcherMiddleware(conferencia_app, {
-    "/pontuacao": pontuacao_app,
-    "/dashboard": dashboard_app,
-    # =======================================================
-    # ADICIONE A ROTA PARA A APLICAÇÃO FINANCEIRA
-    # =======================================================
-    "/financeiro": financeiro_app,
-    # =======================================================
+app = DispatcherMiddleware(APPS["/"], {
+    "/pontuacao": APPS["/pontuacao"],
+    "/dashboard": APPS["/dashboard"],
+    "/financeiro": APPS["/financeiro"],
     "/_": health,
-})
\ No newline at end of file
+})